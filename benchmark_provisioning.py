@@ -0,0 +1,482 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTANCE_NAME = "cloudbook"
+# cold: nothing installed; warm: everything already up; repair: distro intact but images and containers pruned
+SCENARIOS = ["cold", "warm", "repair"]
+
+DEFAULT_CONFIG = {
+    # Seconds added to every wsl.exe invocation (Windows interop process start)
+    "spawn_latency": 0.05,
+    # Seconds added to every docker CLI call inside the distro
+    "docker_latency": 0.02,
+    "import_mb_per_s": 200.0,
+    "pull_seconds": 2.0,
+    "compose_seconds": 3.0,
+    # `docker compose up` when the stack is already running
+    "compose_warm_seconds": 0.3,
+    # Host ports the backend stack publishes; all distros share them, as on WSL 2
+    "compose_ports": ["8080"],
+    "payload_mb": 32,
+    # Command prefix -> number of times it fails before succeeding, e.g. {"docker pull": 1}
+    "failures": {},
+}
+
+# Non-interactive bash sources $BASH_ENV even with --norc; map absolute `cd` targets into the fake rootfs.
+BASH_ENV_SCRIPT = """cd() {
+    if [ -n "$1" ] && [ "${1#/}" != "$1" ] && [ -d "$FAKE_ROOTFS$1" ]; then builtin cd "$FAKE_ROOTFS$1"; else builtin cd "$@"; fi
+}
+"""
+
+LAUNCHER = """#!{python}
+import sys
+sys.path.insert(0, {repo!r})
+import benchmark_provisioning
+sys.exit(benchmark_provisioning.{entry}(sys.argv[1:]))
+"""
+
+
+# ---------------------------------------------------------------------------
+# Fake wsl/docker, run as their own processes with CLOUDBOOK_FAKE_STATE set. They are
+# POSIX scripts, so the benchmark runs on Linux and macOS.
+
+def _state_dir():
+    return os.environ["CLOUDBOOK_FAKE_STATE"]
+
+
+def _config():
+    with open(os.path.join(_state_dir(), "config.json")) as f:
+        return json.load(f)
+
+
+class _State:
+    """JSON file shared by concurrent fake processes, guarded by an exclusive lock."""
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+
+    def __enter__(self):
+        import fcntl
+        self.lock = open(self.path + ".lock", "w")
+        fcntl.flock(self.lock, fcntl.LOCK_EX)
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = json.loads(json.dumps(self.default))
+        return self.data
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            with open(self.path, "w") as f:
+                json.dump(self.data, f)
+        self.lock.close()
+
+
+def _wsl_state():
+    return _State(os.path.join(_state_dir(), "wsl.json"), {"distros": {}, "failures": {}})
+
+
+def _rootfs(name):
+    return os.path.join(_state_dir(), "distros", name)
+
+
+def _docker_state():
+    return _State(os.path.join(os.environ["FAKE_ROOTFS"], "var", "lib", "fake-docker.json"),
+                  {"images": [], "containers": [], "compose_up": False})
+
+
+def _inject_failure(argv):
+    """Return an exit code when `argv` matches a failure that is still armed."""
+    command = " ".join(argv)
+    with _wsl_state() as state:
+        for prefix, count in _config()["failures"].items():
+            used = state["failures"].get(prefix, 0)
+            if command.startswith(prefix) and used < count:
+                state["failures"][prefix] = used + 1
+                return 1
+    return 0
+
+
+def _utf16(text):
+    # wsl.exe writes UTF-16LE unless WSL_UTF8=1
+    sys.stdout.buffer.write(text.encode("utf-16-le"))
+    return 0
+
+
+def fake_wsl(argv):
+    config = _config()
+    time.sleep(config["spawn_latency"])
+    if _inject_failure(["wsl"] + argv):
+        print(f"wsl: injected failure for {argv}", file=sys.stderr)
+        return 1
+    if argv[:1] == ["--version"]:
+        return _utf16("WSL version: 2.3.26.0\r\nKernel version: 5.15.167.4-1\r\n")
+    if argv[:2] == ["-l", "-v"]:
+        with _wsl_state() as state:
+            rows = [f"  {name:<20} {info['state']:<10} 2\r\n" for name, info in state["distros"].items()]
+        return _utf16("  NAME                   STATE      VERSION\r\n" + "".join(rows))
+    if argv[:3] == ["-l", "--running", "-q"]:
+        with _wsl_state() as state:
+            running = [f"{name}\r\n" for name, info in state["distros"].items() if info["state"] == "Running"]
+        if not running:
+            _utf16("There are no running distributions.\r\n")
+            return 1
+        return _utf16("".join(running))
+    if argv[:1] == ["--install"]:
+        return 0
+    if argv[:1] == ["--import"]:
+        return _fake_import(argv[1], argv[2], argv[3], config)
+    if argv[:1] == ["--unregister"]:
+        with _wsl_state() as state:
+            state["distros"].pop(argv[1], None)
+            state["host_ports"] = {port: distro for port, distro in state.get("host_ports", {}).items()
+                                   if distro != argv[1]}
+        shutil.rmtree(_rootfs(argv[1]), ignore_errors=True)
+        return 0
+    if argv[:1] == ["-d"]:
+        name = argv[1]
+        command = argv[argv.index("--") + 1:]
+        with _wsl_state() as state:
+            if name not in state["distros"]:
+                print(f"There is no distribution with the supplied name: {name}", file=sys.stderr)
+                return 1
+            state["distros"][name]["state"] = "Running"
+        env = dict(os.environ, FAKE_ROOTFS=_rootfs(name), BASH_ENV=os.path.join(_state_dir(), "bash_env.sh"))
+        os.execvpe(command[0], command, env)
+    print(f"wsl: unsupported arguments {argv}", file=sys.stderr)
+    return 1
+
+
+def _fake_import(name, target_dir, source, config):
+    """Read the tar at `import_mb_per_s` and leave a sparse ext4.vhdx of the same size."""
+    rate = config["import_mb_per_s"] * 1e6
+    started = time.monotonic()
+    read = 0
+    with (sys.stdin.buffer if source == "-" else open(source, "rb")) as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            read += len(chunk)
+            ahead = read / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    os.makedirs(target_dir, exist_ok=True)
+    with open(os.path.join(target_dir, "ext4.vhdx"), "wb") as disk:
+        disk.truncate(read)
+    rootfs = _rootfs(name)
+    shutil.rmtree(rootfs, ignore_errors=True)
+    os.makedirs(os.path.join(rootfs, "usr", "backend"))
+    os.makedirs(os.path.join(rootfs, "var", "lib"))
+    with _wsl_state() as state:
+        state["distros"][name] = {"state": "Stopped"}
+    return 0
+
+
+def fake_docker(argv):
+    config = _config()
+    time.sleep(config["docker_latency"])
+    if _inject_failure(["docker"] + argv):
+        print(f"docker: injected failure for {argv}", file=sys.stderr)
+        return 1
+    with _docker_state() as docker:
+        if argv[:2] == ["image", "inspect"]:
+            return 0 if argv[2] in docker["images"] else 1
+        if argv[:1] == ["images"]:
+            print("\n".join(docker["images"]))
+            return 0
+        if argv[:1] == ["ps"]:
+            for container in docker["containers"]:
+                print(json.dumps(container))
+            return 0
+        if argv[:1] == ["start"]:
+            for container in docker["containers"]:
+                if container["ID"] in argv[1:]:
+                    container["State"] = "running"
+            return 0
+        if argv[:2] == ["rm", "-f"]:
+            docker["containers"] = [c for c in docker["containers"] if c["ID"] not in argv[2:]]
+            return 0
+        if argv[:1] == ["run"]:
+            return _fake_run(docker, argv[1:])
+        if argv[:2] == ["compose", "config"]:
+            ports = [{"mode": "ingress", "target": int(port), "published": port, "protocol": "tcp"}
+                     for port in config["compose_ports"]]
+            print(json.dumps({"name": "backend", "services": {"api": {"ports": ports}}}, indent=2))
+            return 0
+        if argv[:2] == ["compose", "up"]:
+            if not _bind_compose_ports(config):
+                return 1
+            warm = docker["compose_up"]
+            docker["compose_up"] = True
+    # Slow operations sleep outside the lock so parallel steps overlap like the real thing
+    if argv[:2] == ["compose", "up"]:
+        time.sleep(config["compose_warm_seconds"] if warm else config["compose_seconds"])
+        return 0
+    if argv[:1] == ["pull"]:
+        time.sleep(config["pull_seconds"])
+        with _docker_state() as docker:
+            if argv[1] not in docker["images"]:
+                docker["images"].append(argv[1])
+        print(f"Status: Downloaded newer image for {argv[1]}")
+        return 0
+    print(f"docker: unsupported arguments {argv}", file=sys.stderr)
+    return 1
+
+
+def _bind_compose_ports(config):
+    """Claim the stack's published host ports for this distro; False when another distro holds one."""
+    ports = config["compose_ports"]
+    if os.environ.get("COMPOSE_FILE"):
+        with open(os.environ["COMPOSE_FILE"]) as f:
+            ports = [port["published"] for service in json.load(f)["services"].values()
+                     for port in service.get("ports", ())]
+    distro = os.path.basename(os.environ["FAKE_ROOTFS"])
+    with _wsl_state() as state:
+        bound = state.setdefault("host_ports", {})
+        for port in ports:
+            if bound.get(port, distro) != distro:
+                print(f"Error: Bind for 0.0.0.0:{port} failed: port is already allocated", file=sys.stderr)
+                return False
+        bound.update({port: distro for port in ports})
+    return True
+
+
+def _fake_run(docker, args):
+    image = args[-1]
+    if image not in docker["images"]:
+        print(f"Unable to find image '{image}' locally", file=sys.stderr)
+        return 125
+    labels, ports = [], []
+    for flag, value in zip(args, args[1:]):
+        if flag == "--label":
+            labels.append(value)
+        elif flag == "-p":
+            host, _, inner = value.rpartition(":")
+            ports.append(f"0.0.0.0:{host}->{inner}/tcp")
+    container_id = f"{len(docker['containers']) + 1:012x}"
+    docker["containers"].append({
+        "ID": container_id, "Image": image, "Names": f"fake_{container_id}", "State": "running",
+        "Labels": ",".join(labels), "Ports": ", ".join(ports),
+    })
+    print(container_id)
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Harness
+
+def _write_launchers(bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, entry in (("wsl", "fake_wsl"), ("docker", "fake_docker")):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(LAUNCHER.format(python=sys.executable, repo=REPO_DIR, entry=entry))
+        os.chmod(path, 0o755)
+
+
+def _build_payload(work_dir, payload_mb):
+    """A rootfs-shaped tar of `payload_mb` MB packed into a verified payload container."""
+    import payload_verify
+    from payload_container import append_members
+    from wsl_config import PAYLOAD_NAME
+    tar_path = os.path.join(work_dir, PAYLOAD_NAME)
+    blob = os.path.join(work_dir, "blob")
+    with open(blob, "wb") as f:
+        chunk = os.urandom(1024 * 1024)
+        for _ in range(payload_mb):
+            f.write(chunk)
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(blob, "usr/lib/blob")
+    os.remove(blob)
+    container = os.path.join(work_dir, "cloudbook.payload")
+    on_chunk, attributes = payload_verify.embedding_hooks()
+    append_members(container, [tar_path], on_chunk, attributes)
+    os.remove(tar_path)
+    return container
+
+
+def _prepare(scenario, state_dir):
+    """Shape the simulated machine for a scenario; warm and repair start from the previous run's state."""
+    if scenario == "cold":
+        shutil.rmtree(os.path.join(state_dir, "distros"), ignore_errors=True)
+        shutil.rmtree(os.path.join(state_dir, "wsl_root"), ignore_errors=True)
+        if os.path.exists(os.path.join(state_dir, "wsl.json")):
+            os.remove(os.path.join(state_dir, "wsl.json"))
+    elif scenario == "repair":
+        docker_state = os.path.join(state_dir, "distros", INSTANCE_NAME, "var", "lib", "fake-docker.json")
+        if os.path.exists(docker_state):
+            os.remove(docker_state)
+    # Every scenario starts with the distro shut down and injected failures re-armed.
+    wsl_state = os.path.join(state_dir, "wsl.json")
+    if os.path.exists(wsl_state):
+        with open(wsl_state) as f:
+            state = json.load(f)
+        for info in state["distros"].values():
+            info["state"] = "Stopped"
+        state["failures"] = {}
+        with open(wsl_state, "w") as f:
+            json.dump(state, f)
+
+
+def run_scenario(scenario, work_dir, payload, timeout=600):
+    """Run `provision` for one scenario in a fresh interpreter and return its timings."""
+    state_dir = os.path.join(work_dir, "state")
+    bin_dir = os.path.join(work_dir, "bin")
+    run_dir = os.path.join(work_dir, "runs", scenario)
+    os.makedirs(run_dir, exist_ok=True)
+    _prepare(scenario, state_dir)
+    env = dict(
+        os.environ,
+        PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        PYTHONPATH=REPO_DIR,
+        CLOUDBOOK_WSL_EXE=os.path.join(bin_dir, "wsl"),
+        CLOUDBOOK_DOCKER_EXE=os.path.join(bin_dir, "docker"),
+        CLOUDBOOK_WSL_ROOT=os.path.join(state_dir, "wsl_root"),
+        CLOUDBOOK_PAYLOAD=payload,
+        CLOUDBOOK_FAKE_STATE=state_dir,
+    )
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", scenario],
+        cwd=run_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout,
+    )
+    elapsed = time.perf_counter() - started
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"ok": False, "process_seconds": round(elapsed, 3), "error": result.stderr.strip()[-2000:]}
+    report = json.loads(lines[-1])
+    report["process_seconds"] = round(elapsed, 3)
+    return report
+
+
+def _worker(scenario):
+    """Inside the benchmark subprocess: provision once and print the timings as one JSON line."""
+    started = time.perf_counter()
+    import log_backend
+    log_backend.configure(".", console=False)
+    import tracing
+    import install_wsl3
+    import_seconds = time.perf_counter() - started
+
+    stages = {}
+    current = []
+
+    def on_stage(stage):
+        now = time.perf_counter()
+        if current:
+            stages[current[0]] = round(now - current[1], 3)
+        current[:] = [stage, now]
+
+    error = None
+    provision_started = time.perf_counter()
+    try:
+        install_wsl3.provision(INSTANCE_NAME, on_stage)
+    except SystemExit as e:
+        error = f"exit {e.code}"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    now = time.perf_counter()
+    if current:
+        stages[current[0]] = round(now - current[1], 3)
+
+    steps = {}
+    for span in tracing.finished_spans():
+        if span.name.startswith("step "):
+            steps[span.name[len("step "):]] = {
+                "seconds": round(span.duration, 3),
+                "exit_code": span.attributes.get("exit_code"),
+            }
+    failed = [name for name, step in steps.items() if step["exit_code"] not in (0, None)]
+    if failed and error is None:
+        error = f"steps failed: {failed}"
+    log_backend.shutdown()
+    print(json.dumps({
+        "ok": error is None,
+        "error": error,
+        "import_seconds": round(import_seconds, 3),
+        "provision_seconds": round(now - provision_started, 3),
+        "stages": stages,
+        "steps": steps,
+    }))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run install_wsl3.provision against fake wsl/docker executables in cold, warm and "
+                    "repair scenarios and report per-stage timings as JSON.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenario to run (repeatable; default: all, in order)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of the whole scenario sequence")
+    parser.add_argument("--config", help="JSON file overriding the simulation settings")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one setting, e.g. --set import_mb_per_s=50")
+    parser.add_argument("--fail", action="append", default=[], metavar="PREFIX=COUNT",
+                        help='fail a command COUNT times, e.g. --fail "docker pull=1"')
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory for inspection")
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker)
+        return 0
+
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+    for item in args.set:
+        key, value = item.split("=", 1)
+        config[key] = json.loads(value)
+    for item in args.fail:
+        prefix, count = item.rsplit("=", 1)
+        config["failures"][prefix] = int(count)
+
+    work_dir = tempfile.mkdtemp(prefix="cloudbook-bench-")
+    try:
+        state_dir = os.path.join(work_dir, "state")
+        os.makedirs(state_dir)
+        with open(os.path.join(state_dir, "config.json"), "w") as f:
+            json.dump(config, f)
+        with open(os.path.join(state_dir, "bash_env.sh"), "w") as f:
+            f.write(BASH_ENV_SCRIPT)
+        _write_launchers(os.path.join(work_dir, "bin"))
+        payload = _build_payload(work_dir, config["payload_mb"])
+
+        runs = []
+        for iteration in range(args.repeat):
+            for scenario in args.scenario or SCENARIOS:
+                report = run_scenario(scenario, work_dir, payload)
+                report.update(scenario=scenario, iteration=iteration)
+                runs.append(report)
+                print(f"{scenario:>6} #{iteration}: {'ok' if report['ok'] else 'FAILED'} "
+                      f"{report.get('provision_seconds', report['process_seconds'])}s {report.get('stages', '')}",
+                      file=sys.stderr)
+        result = {"config": config, "python": sys.version.split()[0], "runs": runs}
+        text = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+    finally:
+        if args.keep:
+            print(f"Work directory kept at {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return 0 if all(run["ok"] for run in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import lzma
+import time
+import queue
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import payload_verify
+import tar_index
+from payload_container import append_stream
+from tar_index import FRAMES_SUFFIX, INDEX_SUFFIX
+from wsl_config import WSL_EXE, PAYLOAD_NAME
+
+# Build-time pipeline: `wsl --export <distro> -` is cut into fixed-size frames, the frames
+# are compressed on a thread pool as independent xz streams / zstd frames, and the results
+# are written in order while the payload's tree hash is computed from the same bytes.
+# The stages are linked by bounded queues, so export, compression and hashing overlap and
+# the rootfs is read exactly once. Decoders read the concatenated frames as one stream.
+# The tar member index (see tar_index) is built from the same bytes on its own thread.
+FRAME_SIZE = 16 * 1024 * 1024
+MAX_WORKERS = os.cpu_count() or 1
+FORMATS = {"xz": ".xz", "zstd": ".zst"}
+XZ_PRESET = 6
+ZSTD_LEVEL = 10
+REPORT_INTERVAL = 5.0
+
+
+def xz_compressor(level=None):
+    preset = XZ_PRESET if level is None else level
+    return lambda data: lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=preset)
+
+
+def zstd_compressor(level=None):
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Building .zst payloads needs `pip install zstandard`")
+    local = threading.local()
+
+    def compress(data):
+        # ZstdCompressor objects must not be shared between threads.
+        compressor = getattr(local, "compressor", None)
+        if compressor is None:
+            compressor = local.compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL if level is None else level, write_checksum=True)
+        return compressor.compress(data)
+
+    return compress
+
+
+COMPRESSORS = {"xz": xz_compressor, "zstd": zstd_compressor}
+
+
+def _compress_frame(compress, frame):
+    return len(frame), compress(frame)
+
+
+def _put(pending, item, stop):
+    """Block on a full queue, but give up once the consumer has gone away."""
+    while not stop.is_set():
+        try:
+            pending.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def compress_stream(source, compress, frame_size=FRAME_SIZE, max_workers=MAX_WORKERS, stats=None):
+    """Yield (uncompressed size, compressed frame) for `source`, in order.
+
+    A reader thread cuts the input into frames and submits them to the
+    pool through a bounded queue, so at most `2 * max_workers` frames are in
+    memory and a slow consumer holds back the export instead of buffering it.
+    `stats` collects the time each side spent waiting for the other.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("reader_blocked_s", 0.0)
+    stats.setdefault("writer_waiting_s", 0.0)
+    pending = queue.Queue(maxsize=2 * max_workers)
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="compress") as pool:
+
+        def read_frames():
+            try:
+                for frame in iter(lambda: source.read(frame_size), b""):
+                    waited = time.monotonic()
+                    if not _put(pending, pool.submit(_compress_frame, compress, frame), stop):
+                        return
+                    stats["reader_blocked_s"] += time.monotonic() - waited
+            except BaseException as e:
+                _put(pending, e, stop)
+            _put(pending, None, stop)
+
+        reader = threading.Thread(target=read_frames, name="export-reader", daemon=True)
+        reader.start()
+        try:
+            while True:
+                waited = time.monotonic()
+                item = pending.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                result = item.result()
+                stats["writer_waiting_s"] += time.monotonic() - waited
+                yield result
+        finally:
+            stop.set()
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if hasattr(item, "cancel"):
+                    item.cancel()
+            reader.join()
+
+
+def open_export(distro):
+    """Start `wsl --export <distro> -`; its stdout is the rootfs tar."""
+    command = [WSL_EXE, "--export", distro, "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+    def check():
+        returncode = process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    return process.stdout, check
+
+
+def build_payload(source, output=None, container=None, fmt="xz", level=None, frame_size=FRAME_SIZE,
+                  max_workers=MAX_WORKERS, signing_key=None, check_source=None, index=True):
+    """Compress, hash and write a rootfs tar stream in one pass; returns the build stats.
+
+    The payload goes to `output` (with its manifest, frame table and member
+    index as sidecars) or straight into the payload `container`, where the
+    index becomes a member of its own. `check_source()` is called after the
+    last byte, before anything is committed, so a failed export never leaves
+    a truncated payload behind.
+    """
+    if (output is None) == (container is None):
+        raise ValueError("Pass exactly one of `output` and `container`")
+    name = PAYLOAD_NAME + FORMATS[fmt]
+    compress = COMPRESSORS[fmt](level)
+    hasher = payload_verify.TreeHasher()
+    frames = []
+    stats = {"name": name, "format": fmt, "frame_size": frame_size, "workers": max_workers,
+             "bytes_in": 0, "bytes_out": 0}
+    started = last_report = time.monotonic()
+    indexer = tar_index.StreamIndexer() if index else None
+    members = []
+
+    def chunks():
+        nonlocal last_report
+        reader = indexer.wrap(source) if indexer is not None else source
+        for size, data in compress_stream(reader, compress, frame_size, max_workers, stats):
+            hasher.update(data)
+            frames.append([stats["bytes_in"], size, stats["bytes_out"], len(data)])
+            stats["bytes_in"] += size
+            stats["bytes_out"] += len(data)
+            if time.monotonic() - last_report >= REPORT_INTERVAL:
+                last_report = time.monotonic()
+                logging.info(f"Exported {stats['bytes_in'] / 1e9:.2f} GB -> {stats['bytes_out'] / 1e9:.2f} GB "
+                             f"({stats['bytes_in'] / (last_report - started) / 1e6:.1f} MB/s)")
+            yield data
+        if check_source is not None:
+            check_source()
+        if indexer is not None:
+            # A stream that is not a valid tar fails here, before the payload is committed.
+            members[:] = indexer.finish()[0]
+
+    def manifest():
+        built = payload_verify.build_manifest(name, hasher)
+        if signing_key is not None:
+            payload_verify.sign_manifest(built, signing_key)
+        stats["root"] = built["root"]
+        return built
+
+    def index_lines():
+        meta = tar_index.index_meta(name, members, stats["bytes_in"], root=stats["root"])
+        return tar_index.index_lines(members, meta)
+
+    frame_table = {"format": fmt, "frame_size": frame_size, "frames": frames}
+    try:
+        if container is not None:
+            append_stream(container, name, chunks(), lambda: {"verify": manifest(), "frames": frame_table})
+            if indexer is not None:
+                append_stream(container, name + INDEX_SUFFIX, index_lines())
+        else:
+            partial = output + ".partial"
+            try:
+                with open(partial, "wb") as f:
+                    for data in chunks():
+                        f.write(data)
+                built = manifest()
+            except BaseException:
+                os.remove(partial)
+                raise
+            os.replace(partial, output)
+            with open(output + payload_verify.SIDECAR_SUFFIX, "w") as f:
+                json.dump(built, f)
+            with open(output + FRAMES_SUFFIX, "w") as f:
+                json.dump(frame_table, f)
+            if indexer is not None:
+                with open(output + INDEX_SUFFIX, "wb") as f:
+                    f.writelines(index_lines())
+    finally:
+        hasher.close()
+        if indexer is not None:
+            indexer.close()
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    stats.update({
+        "frames": len(frames),
+        "indexed_members": len(members) if indexer is not None else None,
+        "seconds": round(elapsed, 3),
+        "ratio": round(stats["bytes_out"] / stats["bytes_in"], 4) if stats["bytes_in"] else None,
+        "input_mb_per_s": round(stats["bytes_in"] / elapsed / 1e6, 2),
+        "reader_blocked_s": round(stats["reader_blocked_s"], 3),
+        "writer_waiting_s": round(stats["writer_waiting_s"], 3),
+    })
+    # Whichever side waited longer was waiting on the other: a blocked reader means compression is
+    # the bottleneck, a waiting writer means the export (or too few workers) is.
+    logging.info(f"Built {name}: {stats}")
+    return stats
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Export a WSL distro and build the compressed, hashed Cloudbook payload in one pass.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--distro", help="distro to stream from `wsl --export <distro> -`")
+    source.add_argument("--input", help="existing rootfs tar to build from ('-' for stdin)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="write the payload to this file, with sidecar manifest and frame table")
+    target.add_argument("--container", help="append the payload to this payload container (or EXE)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="xz")
+    parser.add_argument("--level", type=int, help=f"compression level (xz preset {XZ_PRESET}, zstd {ZSTD_LEVEL})")
+    parser.add_argument("--frame-size", type=int, default=FRAME_SIZE // (1024 * 1024), help="frame size in MiB")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="compression threads")
+    parser.add_argument("--signing-key", help="Ed25519 private key (PEM) to sign the manifest with")
+    parser.add_argument("--unsigned", action="store_true", help="development payload; release builds refuse it")
+    parser.add_argument("--no-index", action="store_true", help="skip the tar member index (see tar_index.py)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    signing_key = None
+    if args.signing_key:
+        with open(args.signing_key, "rb") as f:
+            signing_key = f.read()
+    if not args.unsigned:
+        # Checked before the export starts, not after minutes of compression.
+        try:
+            payload_verify.check_release_signing(signing_key)
+        except payload_verify.SignatureError as e:
+            parser.error(str(e))
+    check_source = None
+    if args.distro:
+        stream, check_source = open_export(args.distro)
+    elif args.input == "-":
+        stream = sys.stdin.buffer
+    else:
+        stream = open(args.input, "rb")
+    with stream:
+        stats = build_payload(stream, args.output, args.container, args.format, args.level,
+                              args.frame_size * 1024 * 1024, args.workers, signing_key, check_source,
+                              not args.no_index)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Cold import of the launcher measures ~100-110 ms with the import-only modules loaded lazily
+# (see install_wsl3); leave headroom for slower machines.
+DEFAULT_MODULE = "install_wsl3"
+DEFAULT_BUDGET_MS = 150.0
+
+
+def measure_import_time(module):
+    """Import `module` in a fresh interpreter with -X importtime; return cumulative microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if len(fields) == 3 and fields[1].isdigit():
+            timings.append((fields[2], int(fields[0]), int(fields[1])))
+    top_level = [cumulative for name, _, cumulative in timings if name == module]
+    if not top_level:
+        raise RuntimeError(f"No importtime line for {module}")
+    return top_level[-1], sorted(timings, key=lambda timing: timing[2], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when cold import of the launcher exceeds a budget.")
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    total_us, timings = measure_import_time(args.module)
+    total_ms = total_us / 1000
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, _, cumulative in timings[1:args.top + 1]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
+    forbidden = [name.strip() for name, _, _ in timings if name.strip().split(".")[0] in ("PyQt6", "winshell", "win32com")]
+    if forbidden:
+        print(f"GUI/Windows-only modules imported eagerly: {forbidden}")
+        return 1
+    return 0 if total_ms <= args.budget_ms else 1
+
+
+if __name__ == "__main__":
+    try:
+        status = main()
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Piped into `head`: stop quietly instead of tracing back, and keep the exit at shutdown silent too.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        status = 1
+    sys.exit(status)
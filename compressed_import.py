@@ -0,0 +1,210 @@
+import sys
+import lzma
+import time
+import shutil
+import logging
+import threading
+import subprocess
+
+from wsl_config import WSL_EXE
+from payload_container import open_payload, stat_payload, payload_name
+
+# Large pipe buffers keep the decompressor and `wsl --import` from stalling each other.
+PIPE_BUFFER_SIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+# F_SETPIPE_SZ from <linux/fcntl.h>; only meaningful on Linux.
+F_SETPIPE_SZ = 1031
+
+
+def is_compressed_payload(path):
+    """Check whether the payload is a compressed rootfs rather than a plain tar."""
+    return payload_name(path).endswith((".zst", ".zstd", ".xz"))
+
+
+class _OwningLZMAFile(lzma.LZMAFile):
+    """LZMAFile that also closes the file object it reads from."""
+
+    def __init__(self, source):
+        super().__init__(source, "rb")
+        self._source = source
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+def _feed(source, sink):
+    """Copy `source` into a subprocess stdin; runs on its own thread."""
+    try:
+        with source, sink:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                sink.write(chunk)
+    except BrokenPipeError:
+        pass
+    except Exception as e:
+        # Closing stdin ends the stream early; the owner of `source` reports the cause.
+        logging.error(f"Stopped feeding the decompressor: {e}")
+
+
+class _ProcessReader:
+    """Read a decompressor's stdout and fail like `wsl --export` does when the process fails.
+
+    Reaching EOF waits for the process and raises CalledProcessError on a
+    non-zero exit, so a truncated or corrupt stream is never taken for a short
+    one. Closing early kills the process; either way it is reaped.
+    """
+
+    def __init__(self, process, command):
+        self.process = process
+        self.command = command
+        self._checked = False
+
+    def _check(self):
+        self._checked = True
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command)
+
+    def readinto(self, buffer):
+        read = self.process.stdout.readinto(buffer)
+        if not read and len(buffer) and not self._checked:
+            self._check()
+        return read
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        if not data and size != 0 and not self._checked:
+            self._check()
+        return data
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self.process.stdout.closed
+
+    def close(self):
+        self.process.stdout.close()
+        if self._checked:
+            return
+        if self.process.poll() is None:
+            # Stopped before the end of the stream; the exit code says nothing then.
+            self._checked = True
+            self.process.kill()
+            self.process.wait()
+        else:
+            self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _open_zstd(path, source=None):
+    """Open a zstd stream with the zstandard module, or the zstd CLI when it is missing."""
+    try:
+        import zstandard
+    except ImportError:
+        zstd = shutil.which("zstd")
+        if zstd is None:
+            raise RuntimeError("Reading .zst payloads needs `pip install zstandard` or the zstd CLI")
+        if source is None and isinstance(path, str):
+            command = [zstd, "-dc", path]
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=PIPE_BUFFER_SIZE)
+        else:
+            # Container members and wrapped readers have no path of their own; feed them through stdin.
+            command = [zstd, "-dc"]
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       bufsize=PIPE_BUFFER_SIZE)
+            threading.Thread(target=_feed, args=(source or open_payload(path), process.stdin), daemon=True).start()
+        return _ProcessReader(process, command)
+    if source is None:
+        source = open_payload(path)
+    return zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True, closefd=True)
+
+
+def open_decompressed(path, source=None):
+    """Return a file object yielding the uncompressed tar stream of a payload file or container member.
+
+    `source` replaces the raw payload reader, e.g. with one that verifies
+    the compressed bytes as they are read.
+    """
+    name = payload_name(path)
+    if name.endswith(".xz"):
+        # LZMAFile handles the concatenated streams written by parallel compressors.
+        return _OwningLZMAFile(source or open_payload(path))
+    if name.endswith((".zst", ".zstd")):
+        return _open_zstd(path, source)
+    return source or open_payload(path)
+
+
+def _grow_pipe(pipe):
+    """Raise the kernel pipe buffer where the platform allows it."""
+    try:
+        import fcntl
+        fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+    except (ImportError, OSError):
+        pass
+
+
+def pipe_into_import(reader, instance_name, target_dir, on_chunk=None):
+    """Feed a tar stream to `wsl --import <name> <dir> -` and return the bytes written."""
+    command = [WSL_EXE, "--import", instance_name, target_dir, "-"]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, bufsize=PIPE_BUFFER_SIZE)
+    _grow_pipe(process.stdin)
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    written = 0
+    try:
+        while True:
+            read = reader.readinto(buffer)
+            if not read:
+                break
+            if on_chunk is not None:
+                on_chunk(view[:read])
+            process.stdin.write(view[:read])
+            written += read
+        process.stdin.close()
+    except BrokenPipeError:
+        # wsl exited early; its return code below carries the real error.
+        pass
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return written
+
+
+def import_compressed_rootfs(archive_path, instance_name, target_dir, source=None):
+    """Decompress `archive_path` on the fly into `wsl --import` and report throughput."""
+    compressed_size = stat_payload(archive_path)[0]
+    started = time.monotonic()
+    with open_decompressed(archive_path, source) as reader:
+        written = pipe_into_import(reader, instance_name, target_dir)
+    elapsed = max(time.monotonic() - started, 1e-6)
+    stats = {
+        "compressed_bytes": compressed_size,
+        "uncompressed_bytes": written,
+        "seconds": round(elapsed, 3),
+        "compressed_mb_per_s": round(compressed_size / elapsed / 1e6, 2),
+        "uncompressed_mb_per_s": round(written / elapsed / 1e6, 2),
+    }
+    logging.info(
+        f"Decompressed {compressed_size} -> {written} bytes into '{instance_name}' in "
+        f"{stats['seconds']}s ({stats['uncompressed_mb_per_s']} MB/s uncompressed)"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(import_compressed_rootfs(sys.argv[1], sys.argv[2], sys.argv[3]))
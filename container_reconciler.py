@@ -0,0 +1,233 @@
+import json
+import shlex
+import base64
+import hashlib
+import logging
+from dataclasses import dataclass, field
+
+from wsl_session import CommandResult
+
+SPEC_LABEL = "cloudbook.spec"
+PS_COMMAND = "docker ps -a --format '{{json .}}'"
+# Compose file written beside the stack's own when its published ports are shifted.
+SHIFTED_COMPOSE_FILE = "docker-compose.cloudbook-ports.json"
+
+
+@dataclass
+class DesiredContainer:
+    """The container we want running: image, published ports and restart policy."""
+    image: str
+    ports: tuple = ()
+    restart: str = "always"
+    name: str = None
+
+    def spec_hash(self):
+        spec = json.dumps([self.image, sorted(self.ports), self.restart, self.name])
+        return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+    def run_command(self):
+        args = ["docker", "run", "-d", f"--restart={self.restart}", "--label", f"{SPEC_LABEL}={self.spec_hash()}"]
+        if self.name:
+            args += ["--name", self.name]
+        for port in self.ports:
+            args += ["-p", port]
+        args.append(self.image)
+        return " ".join(shlex.quote(arg) for arg in args)
+
+
+@dataclass
+class ReconcilePlan:
+    actions: list = field(default_factory=list)
+    commands: list = field(default_factory=list)
+
+    @property
+    def changed(self):
+        return bool(self.commands)
+
+
+def parse_ps_output(text):
+    """Parse `docker ps -a --format '{{json .}}'`, one JSON object per line."""
+    containers = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        container = json.loads(line)
+        labels = {}
+        for pair in (container.get("Labels") or "").split(","):
+            if "=" in pair:
+                key, value = pair.split("=", 1)
+                labels[key] = value
+        container["LabelMap"] = labels
+        containers.append(container)
+    return containers
+
+
+def _ports_match(container, desired):
+    """Compare published ports; docker only lists them for running containers."""
+    published = container.get("Ports") or ""
+    if not published:
+        return True
+    for port in desired.ports:
+        host, _, inner = port.rpartition(":")
+        if f":{host}->{inner}/" not in published:
+            return False
+    return True
+
+
+def _matches(container, desired):
+    label = container["LabelMap"].get(SPEC_LABEL)
+    if label is not None:
+        return label == desired.spec_hash()
+    # Containers created by the old shell one-liner carry no label; judge them by ports.
+    return _ports_match(container, desired)
+
+
+def plan(desired, containers):
+    """Compute the fewest actions taking `containers` to the desired state."""
+    result = ReconcilePlan()
+    if desired.name:
+        candidates = [c for c in containers if desired.name in c.get("Names", "").split(",")]
+    else:
+        candidates = [c for c in containers if c.get("Image") == desired.image]
+    matching = [c for c in candidates if _matches(c, desired)]
+    stale = [c for c in candidates if c not in matching]
+
+    running = [c for c in matching if c.get("State") == "running"]
+    if running:
+        result.actions.append(f"keep {running[0]['ID']} (running)")
+        return result
+    if matching:
+        container = matching[0]
+        result.actions.append(f"start {container['ID']} ({container.get('State')})")
+        result.commands.append(f"docker start {shlex.quote(container['ID'])}")
+        return result
+    if stale:
+        ids = " ".join(shlex.quote(c["ID"]) for c in stale)
+        result.actions.append(f"recreate (remove {ids})")
+        result.commands.append(f"docker rm -f {ids}")
+    else:
+        result.actions.append("create")
+    result.commands.append(desired.run_command())
+    return result
+
+
+def reconcile(desired, run_command):
+    """Query actual state once, apply the plan in one more round trip if needed.
+
+    `run_command(command)` runs a shell command in the distro and returns a
+    CommandResult; the returned CommandResult reports what was changed.
+    """
+    query = run_command(PS_COMMAND)
+    if query.exit_code != 0:
+        return query
+    current = plan(desired, parse_ps_output(query.stdout))
+    logging.info(f"Reconciling {desired.image}: {current.actions}")
+    duration = query.duration
+    stderr = ""
+    exit_code = 0
+    if current.changed:
+        applied = run_command(" && ".join(current.commands))
+        duration += applied.duration
+        stderr = applied.stderr
+        exit_code = applied.exit_code
+    return CommandResult(
+        command=f"reconcile {desired.image}",
+        stdout="\n".join(current.actions) + "\n",
+        stderr=stderr,
+        exit_code=exit_code,
+        duration=duration,
+    )
+
+
+def shift_published_ports(config, offset):
+    """Add `offset` to every published host port of a `docker compose config --format json` document.
+
+    Returns the changes as "service: old -> new" lines.
+    """
+    changes = []
+    for name, service in (config.get("services") or {}).items():
+        for port in service.get("ports") or ():
+            published = port.get("published")
+            if published in (None, ""):
+                continue
+            low, _, high = str(published).partition("-")
+            shifted = str(int(low) + offset) + (f"-{int(high) + offset}" if high else "")
+            changes.append(f"{name}: {published} -> {shifted}")
+            port["published"] = shifted
+    return changes
+
+
+def published_ports(config):
+    """(service, host port) for the first published TCP port of each service in a compose config."""
+    ports = []
+    for name, service in (config.get("services") or {}).items():
+        for port in service.get("ports") or ():
+            published = port.get("published")
+            if published in (None, "") or port.get("protocol", "tcp") != "tcp":
+                continue
+            ports.append((name, int(str(published).partition("-")[0])))
+            break
+    return ports
+
+
+def host_ports(config):
+    """(service, host port) for every published host port of a compose config, ranges expanded."""
+    ports = []
+    for name, service in (config.get("services") or {}).items():
+        for port in service.get("ports") or ():
+            published = port.get("published")
+            if published in (None, ""):
+                continue
+            low, _, high = str(published).partition("-")
+            ports.extend((name, number) for number in range(int(low), int(high or low) + 1))
+    return ports
+
+
+def compose_up(directory, port_offset, run_command, on_published=None, check_ports=None):
+    """`docker compose up --build -d` in `directory`, with every published host port moved by `port_offset`.
+
+    All WSL 2 distros share the host's network, so instances provisioned side
+    by side cannot publish the same host ports. The stack's resolved config is
+    written next to its compose file with the shifted ports and brought up
+    from there; the original file is left alone. `on_published` receives
+    the stack's published ports (see published_ports), after any shift.
+    `check_ports` receives the stack's unshifted host ports (see host_ports)
+    before anything is brought up; a ValueError from it fails the step.
+    """
+    cd = f"cd {shlex.quote(directory)}"
+    if not port_offset and on_published is None and check_ports is None:
+        return run_command(f"{cd} && docker compose up --build -d")
+    query = run_command(f"{cd} && docker compose config --format json")
+    if query.exit_code != 0:
+        return query
+    try:
+        config = json.loads(query.stdout[query.stdout.index("{"):])
+    except ValueError as e:
+        return CommandResult(f"compose config in {directory}", query.stdout, f"Unreadable compose config: {e}\n",
+                             1, query.duration)
+    if check_ports is not None:
+        try:
+            check_ports(host_ports(config))
+        except ValueError as e:
+            return CommandResult(f"compose up in {directory}", "", f"{e}\n", 1, query.duration)
+    if not port_offset:
+        applied = run_command(f"{cd} && docker compose up --build -d")
+        if applied.exit_code == 0 and on_published is not None:
+            on_published(published_ports(config))
+        return CommandResult(applied.command, applied.stdout, applied.stderr, applied.exit_code,
+                             query.duration + applied.duration)
+    changes = shift_published_ports(config, port_offset)
+    logging.info(f"Shifting published ports in {directory} by {port_offset}: {changes}")
+    encoded = base64.b64encode(json.dumps(config).encode()).decode()
+    applied = run_command(f"{cd} && echo {encoded} | base64 -d > {SHIFTED_COMPOSE_FILE} && "
+                          f"COMPOSE_FILE={SHIFTED_COMPOSE_FILE} docker compose up --build -d")
+    if applied.exit_code == 0 and on_published is not None:
+        on_published(published_ports(config))
+    return CommandResult(
+        command=f"compose up in {directory} (host ports +{port_offset})",
+        stdout="".join(f"{change}\n" for change in changes) + applied.stdout,
+        stderr=applied.stderr,
+        exit_code=applied.exit_code,
+        duration=query.duration + applied.duration,
+    )
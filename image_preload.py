@@ -0,0 +1,140 @@
+import io
+import os
+import json
+import logging
+import tarfile
+import argparse
+import posixpath
+import threading
+import subprocess
+
+from wsl_config import WSL_EXE, DOCKER_EXE
+from output_streaming import STDOUT, TailBuffer
+
+# Images the provisioning steps need; compose base images are passed on the command line.
+REQUIRED_IMAGES = ["arunpragash/angular_todo:1.1"]
+PIPE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def save_images(images, archive_path):
+    """Build time: save every image into one archive; shared layers are stored once."""
+    logging.info(f"Saving {len(images)} images to {archive_path}...")
+    subprocess.run([DOCKER_EXE, "save", "-o", archive_path] + list(images), check=True)
+    manifest = read_archive_manifest(archive_path)
+    layers = {layer for entry in manifest for layer in entry["Layers"]}
+    logging.info(f"Saved {sum(len(entry.get('RepoTags') or []) for entry in manifest)} tags "
+                 f"sharing {len(layers)} unique layers ({os.path.getsize(archive_path)} bytes)")
+    return manifest
+
+
+def read_archive_manifest(archive_path):
+    """Return the manifest.json entries of a `docker save` archive."""
+    with tarfile.open(archive_path, "r") as archive:
+        return json.load(archive.extractfile("manifest.json"))
+
+
+def list_local_images(instance_name):
+    """Return the repo:tag names already present in the distro's docker store."""
+    result = subprocess.run(
+        [WSL_EXE, "-d", instance_name, "--", "docker", "images", "--format", "{{.Repository}}:{{.Tag}}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return {line.strip() for line in result.stdout.splitlines() if line.strip()}
+
+
+def _member_paths_for(entries):
+    """Archive paths needed to load `entries`: configs and layers, plus legacy layer directories."""
+    paths = set()
+    prefixes = set()
+    for entry in entries:
+        paths.add(entry["Config"])
+        for layer in entry["Layers"]:
+            paths.add(layer)
+            directory = posixpath.dirname(layer)
+            # Legacy layout keeps json/VERSION beside <id>/layer.tar; OCI blobs share one directory.
+            if directory and not directory.startswith("blobs/"):
+                prefixes.add(directory + "/")
+    return paths, prefixes
+
+
+def write_filtered_archive(archive_path, entries, out):
+    """Stream a `docker save` archive to `out` containing only the images in `entries`."""
+    paths, prefixes = _member_paths_for(entries)
+    manifest = json.dumps(entries).encode()
+    with tarfile.open(archive_path, "r") as archive, tarfile.open(fileobj=out, mode="w|") as filtered:
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(manifest)
+        info.mtime = archive.getmember("manifest.json").mtime
+        filtered.addfile(info, io.BytesIO(manifest))
+        for member in archive:
+            name = member.name.removeprefix("./")
+            if name in paths or any(name.startswith(prefix) or name + "/" == prefix for prefix in prefixes):
+                filtered.addfile(member, archive.extractfile(member) if member.isreg() else None)
+
+
+def load_missing_images(instance_name, archive_path):
+    """Install time: `docker load` only the archived images the distro does not have yet.
+
+    Returns the list of tags that were loaded.
+    """
+    entries = read_archive_manifest(archive_path)
+    local = list_local_images(instance_name)
+    missing = [entry for entry in entries if not set(entry.get("RepoTags") or []) <= local]
+    if not missing:
+        logging.info(f"All {len(entries)} bundled images are already present in '{instance_name}'.")
+        return []
+
+    tags = [tag for entry in missing for tag in entry.get("RepoTags") or []]
+    logging.info(f"Loading {len(tags)} images into '{instance_name}': {tags}")
+    command = [WSL_EXE, "-d", instance_name, "--", "docker", "load"]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=PIPE_BUFFER_SIZE)
+    # Drained while the archive is written: docker's progress output would otherwise fill the pipe and
+    # block it while we block writing to it. Only the tail is kept for the log and errors.
+    tail = TailBuffer()
+    reader = threading.Thread(
+        target=lambda: [tail(STDOUT, line.decode(errors="replace")) for line in process.stdout],
+        daemon=True,
+    )
+    reader.start()
+    try:
+        if len(missing) == len(entries):
+            with open(archive_path, "rb") as archive:
+                for chunk in iter(lambda: archive.read(PIPE_BUFFER_SIZE), b""):
+                    process.stdin.write(chunk)
+        else:
+            write_filtered_archive(archive_path, missing, process.stdin)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    reader.join()
+    output = tail.text(STDOUT)
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output)
+    logging.info(f"docker load: {output.strip()}")
+    return tags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle docker images for offline provisioning.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    save = commands.add_parser("save", help="save images into one layer-deduplicated archive")
+    save.add_argument("archive_path")
+    save.add_argument("images", nargs="*", help=f"images to bundle in addition to {REQUIRED_IMAGES}")
+    load = commands.add_parser("load", help="load missing images from an archive into a distro")
+    load.add_argument("archive_path")
+    load.add_argument("instance_name")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "save":
+        images = list(dict.fromkeys(REQUIRED_IMAGES + args.images))
+        save_images(images, args.archive_path)
+    else:
+        print(load_missing_images(args.instance_name, args.archive_path))
+
+
+if __name__ == "__main__":
+    main()
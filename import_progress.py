@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+# One JSON object per import, appended so runs on different machines and disks can be compared.
+IMPORT_RUNS_FILE = "import_runs.jsonl"
+REPORT_INTERVAL = 1.0
+# Current throughput is averaged over this window; ETA uses it rather than the run average.
+RATE_WINDOW = 5.0
+SAMPLE_INTERVAL = 0.5
+
+# GetDriveTypeW return values
+DRIVE_TYPES = {0: "unknown", 1: "no root", 2: "removable", 3: "fixed", 4: "network", 5: "cdrom", 6: "ramdisk"}
+
+# Imports of several instances can finish at once; keep their lines whole.
+_runs_lock = threading.Lock()
+
+
+class ImportProgress:
+    """Track bytes imported and report bytes done, throughput and ETA at most every `interval` seconds."""
+
+    def __init__(self, total_bytes, on_progress=None, interval=REPORT_INTERVAL, window=RATE_WINDOW):
+        self.total_bytes = total_bytes
+        self.on_progress = on_progress
+        self.interval = interval
+        self.window = window
+        self.bytes_done = 0
+        self.started = time.monotonic()
+        self.peak_mb_per_s = 0.0
+        self._samples = deque([(self.started, 0)])
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def update(self, count):
+        """Add `count` bytes; called for every chunk fed to the import."""
+        with self._lock:
+            self.bytes_done += count
+            self._maybe_report()
+
+    def set_done(self, bytes_done):
+        """Set the absolute byte count, e.g. from a sampled directory size."""
+        with self._lock:
+            self.bytes_done = bytes_done
+            self._maybe_report()
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        event = self._event(now)
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+    def _event(self, now, final=False):
+        self._samples.append((now, self.bytes_done))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+        first_time, first_bytes = self._samples[0]
+        elapsed = max(now - self.started, 1e-6)
+        rate = (self.bytes_done - first_bytes) / max(now - first_time, 1e-6)
+        self.peak_mb_per_s = max(self.peak_mb_per_s, rate / 1e6)
+        remaining = max(self.total_bytes - self.bytes_done, 0) if self.total_bytes else None
+        if final:
+            percent, eta = 100.0, 0.0
+        else:
+            # Sampled directory sizes can pass the payload size before wsl is done.
+            percent = min(100.0 * self.bytes_done / self.total_bytes, 99.0) if self.total_bytes else None
+            eta = remaining / rate if remaining is not None and rate > 0 else None
+        return {
+            "bytes_done": self.bytes_done,
+            "total_bytes": self.total_bytes,
+            "percent": round(percent, 1) if percent is not None else None,
+            "mb_per_s": round(rate / 1e6, 2),
+            "average_mb_per_s": round(self.bytes_done / elapsed / 1e6, 2),
+            "eta_s": round(eta, 1) if eta is not None else None,
+            "elapsed_s": round(elapsed, 2),
+            "final": final,
+        }
+
+    def finish(self):
+        """Report completion and return the run's throughput summary."""
+        with self._lock:
+            event = self._event(time.monotonic(), final=True)
+        if self.on_progress is not None:
+            self.on_progress(event)
+        return {
+            "bytes": self.bytes_done,
+            "seconds": event["elapsed_s"],
+            "average_mb_per_s": event["average_mb_per_s"],
+            "peak_mb_per_s": round(self.peak_mb_per_s, 2),
+        }
+
+
+def format_event(event):
+    """One-line description of a progress event for logs and the splash screen."""
+    done = f"{event['bytes_done'] / 1e9:.2f} GB"
+    if event["total_bytes"]:
+        done += f" of {event['total_bytes'] / 1e9:.2f} GB ({event['percent']:.0f}%)"
+    text = f"Imported {done} at {event['mb_per_s']:.1f} MB/s"
+    if event["eta_s"] is not None and not event["final"]:
+        minutes, seconds = divmod(int(event["eta_s"]), 60)
+        text += f", about {minutes}:{seconds:02d} left"
+    return text
+
+
+class MeteredReader:
+    """Pass reads through from `source`, counting the bytes into an ImportProgress."""
+
+    def __init__(self, source, progress):
+        self.source = source
+        self.progress = progress
+
+    def readinto(self, buffer):
+        read = self.source.readinto(buffer)
+        if read:
+            self.progress.update(read)
+        return read
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data:
+            self.progress.update(len(data))
+        return data
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self.source.closed
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DirectoryGrowthSampler:
+    """Sample the size of the import directory while `wsl --import` reads the payload itself."""
+
+    def __init__(self, path, progress, interval=SAMPLE_INTERVAL):
+        self.path = path
+        self.progress = progress
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="import-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.progress.set_done(directory_size(self.path))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.progress.set_done(directory_size(self.path))
+
+
+def drive_type(path):
+    """Windows drive type of `path` (fixed, removable, network...), or None elsewhere."""
+    if sys.platform != "win32":
+        return None
+    import ctypes
+    drive = os.path.splitdrive(os.path.abspath(path))[0] + "\\"
+    return DRIVE_TYPES.get(ctypes.windll.kernel32.GetDriveTypeW(drive), "unknown")
+
+
+def record_run(summary, path=IMPORT_RUNS_FILE):
+    """Append one import summary to the JSON-lines run log and return it."""
+    record = {
+        "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+    }
+    record.update(summary)
+    if "target_dir" in record and "drive_type" not in record:
+        record["drive_type"] = drive_type(record["target_dir"])
+    try:
+        with _runs_lock, open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not record import run in {path}: {e}")
+    return record
+
+
+if __name__ == "__main__":
+    # Metered import of a payload file, e.g. against a throttled stub via CLOUDBOOK_WSL_EXE.
+    from compressed_import import open_decompressed, pipe_into_import
+    logging.basicConfig(level=logging.INFO)
+    payload, instance_name, target_dir = sys.argv[1:4]
+    progress = ImportProgress(os.path.getsize(payload), lambda event: print(format_event(event)))
+    with open_decompressed(payload, MeteredReader(open(payload, "rb"), progress)) as reader:
+        pipe_into_import(reader, instance_name, target_dir)
+    print(record_run(dict(progress.finish(), instance=instance_name, payload=payload, target_dir=target_dir)))
@@ -4,6 +4,8 @@ import shutil
 import subprocess
 import logging
 
+from payload_staging import stage_payload
+
 def get_tar_file_path():
     """Get the path to the embedded tar file."""
     if hasattr(sys, '_MEIPASS'):
@@ -18,14 +20,10 @@ def extract_tar_file():
     tar_path = get_tar_file_path()
     logging.info(f"Extracting tar file from {tar_path}...")
 
-    # Write the file to a temporary location
-    with open(tar_path, "rb") as f:
-        tar_data = f.read()
-    
-    with open("infogreen-billing.tar", "wb") as f:
-        f.write(tar_data)
-    logging.info(f"Extracted tar file to 'infogreen-billing.tar'")
-    return "infogreen-billing.tar"
+    # Stream or link the file into place instead of reading it into memory
+    extracted_file = stage_payload(tar_path, "infogreen-billing.tar")
+    logging.info(f"Extracted tar file to '{extracted_file}'")
+    return extracted_file
 
 def is_wsl_installed():
     """Check if WSL is installed."""
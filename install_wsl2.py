@@ -4,14 +4,14 @@ import shutil
 import subprocess
 import logging
 
-import winshell  # Install with `pip install winshell`
-from win32com.client import Dispatch
-
-from PyQt6.QtCore import QUrl
-from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget
-from PyQt6.QtWebEngineWidgets import QWebEngineView
 from datetime import datetime
 
+from lazy_import import lazy_import
+
+# Windows-only; loaded the first time a shortcut is created
+winshell = lazy_import("winshell")  # Install with `pip install winshell`
+win32com_client = lazy_import("win32com.client")
+
 def run_wsl_commands(wsl_instance, commands, log_file, sudo_password=None):
     try:
         # Prepare the log file
@@ -99,6 +99,11 @@ def configure_logging():
 @log_function_entry_exit
 def start_gui():
     """Start the GUI application."""
+    # Qt and Chromium are only loaded once a window is actually shown
+    from PyQt6.QtCore import QUrl
+    from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget
+    from PyQt6.QtWebEngineWidgets import QWebEngineView
+
     logging.info("Starting GUI application...")
     app = QApplication(sys.argv)
 
@@ -129,7 +134,7 @@ def create_shortcut():
     target = sys.executable
     icon = os.path.join(os.path.dirname(target), "app.ico")
 
-    shell = Dispatch('WScript.Shell')
+    shell = win32com_client.Dispatch('WScript.Shell')
     shortcut = shell.CreateShortcut(shortcut_path)
     shortcut.TargetPath = target
     shortcut.WorkingDirectory = os.path.dirname(target)
@@ -1,153 +1,146 @@
 import sys
 import os
+import time
 import shutil
 import subprocess
 import logging
+import threading
+import functools
+
+from payload_staging import stage_payload
+import wsl_probe
+from output_streaming import LogFileSink, ByteCounter, STDOUT, STDERR
+import container_reconciler
+from wsl_config import (WSL_EXE, PAYLOAD_NAME, COMPRESSED_PAYLOAD_NAMES, DELTA_NAME, IMAGES_ARCHIVE_NAME,
+                        PAYLOAD_REQUIRED_PATHS, instance_dir)
+import log_backend
+import tracing
+from log_backend import INFO, ERROR, DEBUG, WARNING, WSL_OUTPUT, WSL_ERROR
+from lazy_import import lazy_import
+
+# Only needed once an import or a recorded run starts, so they stay off the launcher's cold start.
+payload_container = lazy_import("payload_container")
+payload_cache = lazy_import("payload_cache")
+payload_verify = lazy_import("payload_verify")
+import_progress = lazy_import("import_progress")
+run_store = lazy_import("run_store")
+tar_index = lazy_import("tar_index")
+
+# Baseline for the time-to-usable-UI measurement.
+PROCESS_STARTED = time.monotonic()
+
+FRONTEND_CONTAINER = container_reconciler.DesiredContainer(
+    image="arunpragash/angular_todo:1.1",
+    ports=("9000:80",),
+    restart="always",
+)
 
-import winshell  # Install with `pip install winshell`
-from win32com.client import Dispatch
-
-from PyQt6.QtCore import QUrl
-from PyQt6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget
-from PyQt6.QtWebEngineWidgets import QWebEngineView
-from datetime import datetime
-
-INFO = 'info'
-ERROR ='error'
-DEBUG = 'debug'
-WARNING = 'warning'
-WSL_OUTPUT = 'wsl_output'
-WSL_ERROR = 'wsl_error'
-
-
-
-def run_wsl_commands(wsl_instance, commands, log_file, sudo_password=None):
-    try:
-        # Prepare the log file
-        with open(log_file, 'w', newline='\n') as log:
-            for command in commands:
-                # Check if the command contains sudo and a password is provided
-                if 'sudo' in command and sudo_password:
-                    # Construct the WSL command with password piped to sudo using -S
-                    wsl_command = f"wsl -d {wsl_instance} bash -c \"echo {sudo_password} | sudo -S {command}\""
-                else:
-                    # Construct the WSL command
-                    wsl_command = f"wsl -d {wsl_instance} bash -c \"{command}\""
-                
-                # Run the WSL command
-                result = subprocess.run(wsl_command, shell=True, text=True, capture_output=True)
-                output = f"{command} {result.stdout}"
-                error = f"{command} {result.stderr}"
-                update_logs(output, WSL_OUTPUT)
-                update_logs(error, WSL_ERROR)
-                # Log the results
-                log.write(f"Command: {command}\n")
-                log.write(f"Output:\n{result.stdout}\n")
-                log.write(f"Error (if any):\n{result.stderr}\n")
-                log.write("\n" + "-" * 80 + "\n")
-    except Exception as e:
-        # Catch and log any exceptions
-        with open(log_file, 'a', newline='\n') as log:
-            log.write(f"An error occurred: {str(e)}\n")
-            update_logs(f"An error occurred: {str(e)}\n", WSL_ERROR)
 
 def log_function_entry_exit(func):
-    """Decorator to log entry and exit of functions."""
+    """Decorator to log entry and exit of functions and time them as trace spans."""
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         logging.info(f"Entering function: {func.__name__}")
         update_logs(f"Entering function: {func.__name__}", INFO)
-        result = func(*args, **kwargs)
-        logging.info(f"Exiting function: {func.__name__}")
-        update_logs(f"Exiting function: {func.__name__}", INFO)
+        with tracing.span(func.__name__) as span:
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                logging.error(f"Function {func.__name__} raised {type(e).__name__} after {span.duration:.3f}s")
+                update_logs(f"Function {func.__name__} raised {type(e).__name__} after {span.duration:.3f}s", ERROR)
+                raise
+        logging.info(f"Exiting function: {func.__name__} ({span.duration:.3f}s)")
+        update_logs(f"Exiting function: {func.__name__} ({span.duration:.3f}s)", INFO)
         return result
     return wrapper
 
 
 
 def update_logs(message, type=INFO):
-    # Get the current time and format it
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Format the datetime as a string
-    
-    if(type == INFO):
-        with open("info.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    elif(type == DEBUG):
-        with open("debug.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    elif(type == ERROR):
-        with open("error.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    elif(type == WARNING):
-        with open("warning.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    elif(type == WSL_ERROR):
-        with open("wsl_error.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    elif(type == WSL_OUTPUT):
-        with open("wsl_output.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    else:
-        with open("others.log", 'a') as file:
-            file.write(current_time + " " + message + "\n")  # Add newline at the end for each log entry
-    
-
-
+    """Queue a message for its channel file (info.log, wsl_output.log, ...)."""
+    log_backend.log(message, type)
 
 
 def configure_logging():
     """Set up logging for the application."""
-    log_file = "application.log"
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
-    logging.info("Logging configured. Outputting to %s", log_file)
+    # application.log and the per-channel files share one batching writer thread,
+    # which is flushed at exit
+    log_backend.configure(".")
+    tracing.enable_export_at_exit("trace.json")
+    logging.info("Logging configured. Outputting to %s", log_backend.CHANNEL_FILES[log_backend.APPLICATION])
 
 
 @log_function_entry_exit
-def start_gui():
-    """Start the GUI application."""
+def start_gui(instance_name):
+    """Show the window immediately and provision in the background."""
     logging.info("Starting GUI application...")
     update_logs("Starting GUI application...", INFO)
-    app = QApplication(sys.argv)
-
-    window = QMainWindow()
-    window.setWindowTitle("Embedded Web App")
-
-    browser = QWebEngineView()
-    browser.setUrl(QUrl("http://localhost:9000"))
-
-    layout = QVBoxLayout()
-    layout.addWidget(browser)
+    # Qt and Chromium are only loaded once a window is actually shown
+    import launcher_gui
+    launcher_gui.run(
+        lambda on_stage, on_output, on_progress: provision(instance_name, on_stage, on_output, on_progress),
+        PROCESS_STARTED,
+    )
 
-    container = QWidget()
-    container.setLayout(layout)
-    window.setCentralWidget(container)
 
-    window.resize(1024, 768)
-    window.show()
-    app.exec()
+@log_function_entry_exit
+def get_tar_file_path():
+    """Locate the rootfs payload, preferring a compressed one.
+
+    A payload container beside (or appended to) the EXE is used in place and
+    only read if an import happens; builds that still bundle the tar with
+    --add-data fall back to the extracted copy in _MEIPASS.
+    """
+    member = payload_container.find_member(COMPRESSED_PAYLOAD_NAMES + [PAYLOAD_NAME])
+    if member is not None:
+        return member
+    base_dir = getattr(sys, '_MEIPASS', "")
+    for name in COMPRESSED_PAYLOAD_NAMES:
+        path = os.path.join(base_dir, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(base_dir, PAYLOAD_NAME)
 
 
+@log_function_entry_exit
+def get_delta_file_path():
+    """Get the path to a bundled rootfs delta, or None when the installer ships without one."""
+    path = os.path.join(getattr(sys, '_MEIPASS', ""), DELTA_NAME)
+    return path if os.path.exists(path) else None
 
 
 @log_function_entry_exit
-def get_tar_file_path():
-    """Get the path to the embedded tar file."""
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, "infogreen-cloudbook.tar")
-    else:
-        return "infogreen-cloudbook.tar"
+def apply_delta_update(instance_name):
+    """Update an existing instance in place from the bundled delta; return True on success."""
+    delta_path = get_delta_file_path()
+    if delta_path is None:
+        return False
+    import rootfs_delta
+    try:
+        rootfs_delta.apply_delta(delta_path, instance_name)
+    except rootfs_delta.BaseMismatchError as e:
+        logging.info(f"Delta does not apply: {e}. Falling back to a full import.")
+        update_logs(f"Delta does not apply: {e}. Falling back to a full import.", INFO)
+        return False
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error applying delta to '{instance_name}': {e}. Falling back to a full import.")
+        update_logs(f"Error applying delta to '{instance_name}': {e}. Falling back to a full import.", ERROR)
+        return False
+    logging.info(f"WSL instance '{instance_name}' updated from delta {delta_path}.")
+    update_logs(f"WSL instance '{instance_name}' updated from delta {delta_path}.", INFO)
+    return True
 
 
 @log_function_entry_exit
 def extract_tar_file():
-    """Extract the embedded tar file to a temporary location."""
+    """Stage the embedded tar file for import without copying it where possible."""
     tar_path = get_tar_file_path()
+    tracing.set_attribute("payload", str(tar_path))
+    if isinstance(tar_path, payload_container.PayloadMember):
+        # Container members are streamed straight into `wsl --import`; nothing to stage.
+        logging.info(f"Reading payload from container {tar_path}")
+        update_logs(f"Reading payload from container {tar_path}", INFO)
+        return tar_path
     logging.info(f"Extracting tar file from {tar_path}...")
     update_logs(f"Extracting tar file from {tar_path}...", INFO)
     if not os.path.exists(tar_path):
@@ -155,41 +148,49 @@ def extract_tar_file():
         update_logs(f"Tar file {tar_path} does not exist.", ERROR)
         sys.exit(1)
 
-    extracted_file = "infogreen-cloudbook.tar"
-    shutil.copyfile(tar_path, extracted_file)
-    logging.info(f"Extracted tar file to {extracted_file}")
-    update_logs(f"Extracted tar file to {extracted_file}", INFO)
+    # `wsl --import` reads the bundled tar directly, so nothing is copied out of _MEIPASS.
+    extracted_file = stage_payload(tar_path)
+    logging.info(f"Staged tar file at {extracted_file}")
+    update_logs(f"Staged tar file at {extracted_file}", INFO)
     return extracted_file
 
 
+@log_function_entry_exit
+def check_payload_contents(tar_file):
+    """Refuse a payload whose member index lacks a required path; log what it contains.
+
+    Only the index and the few members it points at are read. Payloads built
+    without an index are imported unchecked.
+    """
+    index = tar_index.index_for(tar_file)
+    if index is None:
+        logging.info(f"No member index for {tar_file}; skipping the content check.")
+        update_logs(f"No member index for {tar_file}; skipping the content check.", INFO)
+        return
+    with index:
+        missing = [path for path in PAYLOAD_REQUIRED_PATHS if index.resolve(path) is None]
+        if missing:
+            logging.error(f"Payload {tar_file} is missing {', '.join(missing)}; refusing to import it.")
+            update_logs(f"Payload {tar_file} is missing {', '.join(missing)}; refusing to import it.", ERROR)
+            sys.exit(1)
+        summary = tar_index.describe(index)
+    logging.info(f"Payload contents: {summary}")
+    update_logs(f"Payload contents: {summary}", INFO)
+
+
 @log_function_entry_exit
 def is_wsl_installed():
     """Check if WSL is installed."""
-    try:
-        # Check if WSL is present and supports --version (available in WSL 2 and later)
-        result = subprocess.run(["wsl", "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    snapshot = wsl_probe.get_snapshot()
+    if snapshot.installed:
         logging.info("WSL is installed.")
         update_logs("WSL is installed.", INFO)
-        logging.debug(f"WSL version output: {result.stdout.decode().strip()}")
-        update_logs(f"WSL version output: {result.stdout.decode().strip()}", INFO)
-        return True
-    except subprocess.CalledProcessError as e:
-        update_logs(f"WSL version check failed: {e}. Output: {e.stdout.decode()} {e.stderr.decode()}", WARNING)
-        logging.warning(f"WSL version check failed: {e}. Output: {e.stdout.decode()} {e.stderr.decode()}")
-    except FileNotFoundError:
-        logging.warning("WSL is not installed or not available.")
-        update_logs("WSL is not installed or not available.", WARNING)
-
-    # Fallback check: Test if the `wsl` command exists (for older systems)
-    try:
-        result = subprocess.run(["wsl", "--help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        logging.info("WSL is installed but might not support `--version`.")
-        update_logs("WSL is installed but might not support `--version`.", INFO)
-        return True
-    except (FileNotFoundError, subprocess.CalledProcessError):
+        logging.debug(f"WSL version: {snapshot.wsl_version}, kernel: {snapshot.kernel_version}")
+        update_logs(f"WSL version: {snapshot.wsl_version}, kernel: {snapshot.kernel_version}", INFO)
+    else:
         logging.error("WSL is not installed or not functional.")
         update_logs("WSL is not installed or not functional.", ERROR)
-        return False
+    return snapshot.installed
 
 
 @log_function_entry_exit
@@ -198,7 +199,8 @@ def install_wsl():
     logging.info("Attempting to install WSL...")
     update_logs("Attempting to install WSL...", INFO)
     try:
-        subprocess.run(["wsl", "--install", "--no-distribution"], check=True)
+        subprocess.run([WSL_EXE, "--install", "--no-distribution"], check=True)
+        wsl_probe.invalidate()
         logging.info("WSL installation completed successfully.")
         update_logs("WSL installation completed successfully.", INFO)
     except subprocess.CalledProcessError as e:
@@ -215,86 +217,246 @@ def install_wsl():
 
 
 @log_function_entry_exit
-def import_wsl_instance(tar_file, instance_name):
-    """Import the provided tar file into a new WSL instance."""
-    if not os.path.exists(tar_file):
+def import_wsl_instance(tar_file, instance_name, on_progress=None, verified_digest=None, unverified_digest=None):
+    """Import the provided tar file into a new WSL instance.
+
+    Progress events (bytes done, MB/s, ETA) go to the log and `on_progress`.
+    Returns the payload's tree digest when it was verified during the import, else None.
+    Pass `verified_digest` when the caller already checked the payload, to skip hashing it again,
+    or `unverified_digest` when it only hashed a payload that has no manifest to check against.
+    """
+    if not isinstance(tar_file, payload_container.PayloadMember) and not os.path.exists(tar_file):
         logging.error(f"Error: The file '{tar_file}' does not exist.")
         update_logs(f"Error: The file '{tar_file}' does not exist.", ERROR)
         sys.exit(1)
 
+    payload_bytes = payload_container.stat_payload(tar_file)[0]
+    tracing.set_attribute("instance", instance_name)
+    tracing.set_attribute("payload", str(tar_file))
+    tracing.set_attribute("payload_bytes", payload_bytes)
+
+    # The manifest is checked before anything is touched; a truncated payload fails here.
+    try:
+        known_digest = verified_digest or unverified_digest
+        manifest = payload_verify.load_manifest_for(tar_file) if known_digest is None else None
+        verified = payload_verify.open_verified(tar_file, manifest) if manifest is not None else None
+    except payload_verify.PayloadCorruptError as e:
+        logging.error(f"Refusing to import '{tar_file}': {e}")
+        update_logs(f"Refusing to import '{tar_file}': {e}", ERROR)
+        sys.exit(1)
+    if verified_digest is not None:
+        logging.info(f"'{tar_file}' was verified before the import (tree digest {verified_digest}).")
+        update_logs(f"'{tar_file}' was verified before the import (tree digest {verified_digest}).", INFO)
+    elif verified is None:
+        logging.warning(f"'{tar_file}' has no verification manifest; importing it unchecked.")
+        update_logs(f"'{tar_file}' has no verification manifest; importing it unchecked.", WARNING)
+    tracing.set_attribute("verified", verified is not None or verified_digest is not None)
+
     logging.info(f"Importing '{tar_file}' as WSL instance '{instance_name}'...")
     update_logs(f"Importing '{tar_file}' as WSL instance '{instance_name}'...", INFO)
-    target_dir = f"C:\\WSL\\{instance_name}"
+    target_dir = instance_dir(instance_name)
     if os.path.exists(target_dir):
         shutil.rmtree(target_dir)
     os.makedirs(target_dir, exist_ok=True)
 
+    def report_progress(event):
+        logging.info(import_progress.format_event(event))
+        update_logs(import_progress.format_event(event), INFO)
+        if on_progress is not None:
+            on_progress(event)
+
+    from compressed_import import is_compressed_payload, import_compressed_rootfs, pipe_into_import
+    progress = import_progress.ImportProgress(payload_bytes, report_progress)
+    run = {
+        "instance": instance_name,
+        "payload": str(tar_file),
+        "payload_bytes": payload_bytes,
+        "compressed": is_compressed_payload(tar_file),
+        "verified": verified is not None or verified_digest is not None,
+        "target_dir": target_dir,
+    }
+    digest = known_digest
     try:
-        subprocess.run(["wsl", "--import", instance_name, target_dir, tar_file], check=True)
+        if run["compressed"] or verified is not None or isinstance(tar_file, payload_container.PayloadMember):
+            # Piping lets the same chunks be metered and hashed on their way into `wsl --import`.
+            run["method"] = "pipe"
+            source = import_progress.MeteredReader(verified or payload_container.open_payload(tar_file), progress)
+            if run["compressed"]:
+                stats = import_compressed_rootfs(tar_file, instance_name, target_dir, source)
+                run["uncompressed_bytes"] = stats["uncompressed_bytes"]
+                tracing.set_attribute("uncompressed_bytes", stats["uncompressed_bytes"])
+                update_logs(f"Decompression throughput: {stats['uncompressed_mb_per_s']} MB/s ({stats})", INFO)
+            else:
+                with source as reader:
+                    pipe_into_import(reader, instance_name, target_dir)
+        else:
+            # wsl reads the file itself; the growing virtual disk stands in for bytes read.
+            run["method"] = "in place"
+            with import_progress.DirectoryGrowthSampler(target_dir, progress):
+                subprocess.run([WSL_EXE, "--import", instance_name, target_dir, tar_file], check=True)
+        if verified is not None:
+            digest = verified.hasher.finish()
+            logging.info(f"Verified '{tar_file}' while importing (tree digest {digest}).")
+            update_logs(f"Verified '{tar_file}' while importing (tree digest {digest}).", INFO)
+        wsl_probe.invalidate()
         logging.info(f"WSL instance '{instance_name}' imported successfully.")
         update_logs(f"WSL instance '{instance_name}' imported successfully.", INFO)
+    except payload_verify.PayloadCorruptError as e:
+        _abort_import(instance_name, run, progress, f"Payload verification failed, import aborted: {e}")
     except subprocess.CalledProcessError as e:
-        logging.error(f"Error importing WSL instance: {e}")
-        update_logs(f"Error importing WSL instance: {e}", ERROR)
-        sys.exit(1)
+        if verified is not None and verified.hasher.failed:
+            # wsl was stopped because a chunk failed verification; report that instead.
+            _abort_import(instance_name, run, progress,
+                          f"Payload verification failed, import aborted: {verified.hasher.error}")
+        _abort_import(instance_name, run, progress, f"Error importing WSL instance: {e}", unregister=False)
+    except Exception as e:
+        # xz and zstd check their own CRCs and can notice corruption before the tree hash does.
+        _abort_import(instance_name, run, progress,
+                      f"Payload could not be decoded, import aborted: {type(e).__name__}: {e}")
+    run.update(progress.finish())
+    record = import_progress.record_run(run)
+    tracing.set_attribute("import_mb_per_s", record["average_mb_per_s"])
+    logging.info(f"Import summary: {record}")
+    update_logs(f"Import summary: {record}", INFO)
+    return digest
+
+
+def _abort_import(instance_name, run, progress, message, unregister=True):
+    """Log a failed import, record it in the run log and exit."""
+    logging.error(message)
+    update_logs(message, ERROR)
+    run.update(progress.finish())
+    run["error"] = message
+    import_progress.record_run(run)
+    if unregister:
+        unregister_wsl_instance(instance_name)
+    sys.exit(1)
 
 
 @log_function_entry_exit
+def preload_docker_images(instance_name):
+    """Load bundled docker images the instance is missing, so provisioning works offline."""
+    archive_path = os.path.join(getattr(sys, '_MEIPASS', ""), IMAGES_ARCHIVE_NAME)
+    if not os.path.exists(archive_path):
+        logging.info("No bundled docker images; images will be pulled from the registry.")
+        update_logs("No bundled docker images; images will be pulled from the registry.", INFO)
+        return
+    import image_preload
+    try:
+        loaded = image_preload.load_missing_images(instance_name, archive_path)
+        tracing.set_attribute("images_loaded", len(loaded))
+        logging.info(f"Preloaded docker images into '{instance_name}': {loaded}")
+        update_logs(f"Preloaded docker images into '{instance_name}': {loaded}", INFO)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error preloading docker images: {e}. Falling back to pulling.")
+        update_logs(f"Error preloading docker images: {e}. Falling back to pulling.", ERROR)
+
 
-def execute_commands_in_instance(instance_name):
-    """Log in to the WSL instance and execute specified commands."""
-    commands = [
-    "cd /usr/backend",
-    "docker pull arunpragash/angular_todo:1.1",
-    '''docker ps --filter "ancestor=arunpragash/angular_todo:1.1" --format '{{.ID}}' | grep -q . || \
-(docker ps -a --filter "ancestor=arunpragash/angular_todo:1.1" --filter "status=exited" --format '{{.ID}}' | grep -q . && \
-docker ps -a --filter "ancestor=arunpragash/angular_todo:1.1" --filter "status=exited" --format '{{.ID}}' | xargs -r docker start) || \
-docker run -d --restart=always -p 9000:80 arunpragash/angular_todo:1.1''',
-    "cd /usr/backend && docker compose up --build -d",
-    "exit"
+@log_function_entry_exit
+def execute_commands_in_instance(instance_name, on_output=None, frontend=FRONTEND_CONTAINER, log_file="logging_.txt",
+                                 backend_port_offset=0, on_published=None, check_ports=None):
+    """Log in to the WSL instance and execute the provisioning steps.
+
+    Instances provisioned side by side share the WSL network, so each gets
+    its own `frontend` port mapping, its backend's published ports moved by
+    `backend_port_offset`, and its own `log_file`. `on_published` receives
+    the backend stack's published host ports once it is up (for readiness);
+    `check_ports` may reject the stack's ports before it is brought up.
+    """
+    from provision_scheduler import Step
+    preload_docker_images(instance_name)
+    steps = [
+    # Preloaded images are used as is; pulling only happens when the image is still missing
+    Step("pull_frontend", "docker image inspect arunpragash/angular_todo:1.1 >/dev/null 2>&1 || docker pull arunpragash/angular_todo:1.1"),
+    # One `docker ps -a` query decides whether the container is kept, started or (re)created
+    Step("start_frontend", functools.partial(container_reconciler.reconcile, frontend),
+         deps=("pull_frontend",), description=f"reconcile {frontend.image} on {', '.join(frontend.ports)}"),
+    # The backend stack does not depend on the frontend container, so it builds in parallel
+    Step("backend_compose", "cd /usr/backend && docker compose up --build -d")
+    if not backend_port_offset and on_published is None and check_ports is None else
+    Step("backend_compose", functools.partial(container_reconciler.compose_up, "/usr/backend", backend_port_offset,
+                                              on_published=on_published, check_ports=check_ports),
+         description=f"docker compose up in /usr/backend with host ports +{backend_port_offset}"),
 ]
-    wsl_instance = 'cloudbook'
-    run_wsl_commands(wsl_instance, commands, "logging_.txt", "infogreen@123")
+    report = run_provisioning_steps(instance_name, steps, log_file, "infogreen@123", on_output=on_output)
+    # Running commands boots the distro, so its recorded state is stale now
+    wsl_probe.invalidate()
+    return report
+
+
+def run_provisioning_steps(wsl_instance, steps, log_file, sudo_password=None, max_parallel=2, on_output=None):
+    """Run provisioning steps concurrently where their dependencies allow and log each result.
+
+    Output is streamed into `log_file` line by line as it is produced and,
+    when given, to `on_output(step_name, stream, line)` for live progress.
+    Only the last lines of each step are kept in memory for error reports.
+    `log_file` is appended to, and each step is also recorded in the run
+    store when a run is being recorded (see run_store).
+    """
+    run = run_store.current_run()
+    stage = run.current_stage if run is not None else None
+    counters = {}
+    with open(log_file, 'a', newline='\n') as log:
+        log_lock = threading.Lock()
+        log.write(f"Run {run.run_id if run is not None else '-'} started at {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+        def sinks_for_step(step):
+            counters[step.name] = ByteCounter()
+            sinks = [LogFileSink(log, step.name, log_lock), counters[step.name]]
+            if on_output is not None:
+                sinks.append(lambda stream, line: on_output(step.name, stream, line))
+            return sinks
+
+        def write_result(step, status, result):
+            if run is not None:
+                counter = counters.get(step.name)
+                run.record_step(step.name, step.description, status, result,
+                                counter.bytes[STDOUT] if counter is not None else None,
+                                counter.bytes[STDERR] if counter is not None else None, stage)
+            with log_lock:
+                log.write(f"Step: {step.name} ({status})\n")
+                log.write(f"Command: {step.description}\n")
+                if result is not None:
+                    log.write(f"Exit code: {result.exit_code} ({result.duration:.2f}s)\n")
+                    if result.exit_code != 0:
+                        log.write(f"Error tail:\n{result.stderr}\n")
+                        update_logs(f"{step.description} {result.stderr}", WSL_ERROR)
+                    update_logs(f"{step.description} {result.stdout}", WSL_OUTPUT)
+                log.write("\n" + "-" * 80 + "\n")
+
+        from provision_scheduler import run_steps, session_runner
+        runner = session_runner(wsl_instance, sudo_password, sinks_for_step=sinks_for_step)
+
+        try:
+            report = run_steps(steps, runner, max_parallel=max_parallel, on_step_done=write_result)
+        finally:
+            runner.close()
+        log.write(f"Critical path: {' -> '.join(report.critical_path)} (wall time {report.wall_time:.2f}s)\n")
+
+    logging.info(f"Provisioning finished in {report.wall_time:.2f}s; critical path: {' -> '.join(report.critical_path)}")
+    update_logs(f"Provisioning finished in {report.wall_time:.2f}s; critical path: {' -> '.join(report.critical_path)}", INFO)
+    if not report.ok:
+        failed = {name: state for name, state in report.status.items() if state != "succeeded"}
+        logging.error(f"Provisioning steps did not all succeed: {failed}")
+        update_logs(f"Provisioning steps did not all succeed: {failed}", ERROR)
+    return report
 
 @log_function_entry_exit
 def is_wsl_instance_running(instance_name):
     """Check if a WSL instance is already running."""
-    try:
-        result = subprocess.run(
-            ["wsl", "-l", "--running"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        running_instances = result.stdout
-        logging.debug(f"Running WSL instances: {running_instances}")
-        update_logs(f"Running WSL instances: {running_instances}", DEBUG)
-        return instance_name in running_instances
-    except Exception as e:
-        logging.error(f"Error checking running WSL instances: {e}")
-        update_logs(f"Error checking running WSL instances: {e}", ERROR)
-        return False
+    snapshot = wsl_probe.get_snapshot()
+    logging.debug(f"WSL instances: {list(snapshot.distros.values())}")
+    update_logs(f"WSL instances: {list(snapshot.distros.values())}", DEBUG)
+    return snapshot.is_running(instance_name)
 
 
 @log_function_entry_exit
 def does_wsl_instance_exist(instance_name):
     """Check if a WSL instance already exists."""
-    try:
-        result = subprocess.run(
-            ["wsl", "-l", "-v"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        existing_instances = result.stdout.strip()
-        existing_instances = existing_instances.replace('\x00', '') # parsing into a proper string to make comparision
-        logging.debug(f"Existing WSL instances: {existing_instances}")
-        update_logs(f"Existing WSL instances: {existing_instances}", DEBUG)
-        return (" " +instance_name + " ") in existing_instances # added space to validate exact instance name eg cloudbook not cloudbook1 or 1cloudbook
-    except Exception as e:
-        logging.error(f"Error checking existing WSL instances: {e}")
-        update_logs(f"Error checking existing WSL instances: {e}", DEBUG)
-        return False
+    distros = wsl_probe.get_snapshot().distros
+    logging.debug(f"Existing WSL instances: {list(distros)}")
+    update_logs(f"Existing WSL instances: {list(distros)}", DEBUG)
+    return instance_name in distros
 
 
 @log_function_entry_exit
@@ -310,19 +472,60 @@ def install_wsl_if_needed():
 
 
 @log_function_entry_exit
-def import_wsl_instance_if_needed(tar_file, instance_name):
-    """Import the WSL instance only if it doesn't already exist."""
-    if not does_wsl_instance_exist(instance_name):
+def unregister_wsl_instance(instance_name):
+    """Remove an existing WSL instance so it can be re-imported."""
+    logging.info(f"Unregistering WSL instance '{instance_name}'...")
+    update_logs(f"Unregistering WSL instance '{instance_name}'...", INFO)
+    payload_cache.invalidate(instance_name)
+    subprocess.run([WSL_EXE, "--unregister", instance_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    wsl_probe.invalidate()
+
+
+@log_function_entry_exit
+def import_wsl_instance_if_needed(tar_path, instance_name, on_progress=None, payload_digest=None):
+    """Import the WSL instance unless it already holds this exact payload.
+
+    With `payload_digest`, `tar_path` is a payload the caller has already
+    staged (see multi_provision) and is imported as is. It is a function
+    returning the payload's (tree digest, verified) and is only called when
+    the digest is actually needed, so up-to-date instances never hash it.
+    """
+    if does_wsl_instance_exist(instance_name):
+        if payload_cache.load_manifest(instance_name) is None:
+            # Instance predates the payload cache: keep it and adopt the current payload.
+            logging.info(f"WSL instance '{instance_name}' already exists. Recording payload and skipping import.")
+            update_logs(f"WSL instance '{instance_name}' already exists. Recording payload and skipping import.", INFO)
+            payload_cache.write_manifest(instance_name, tar_path,
+                                         payload_digest()[0] if payload_digest is not None else None)
+            return
+        if payload_cache.payload_matches_manifest(instance_name, tar_path):
+            logging.info(f"WSL instance '{instance_name}' is up to date with the payload. Skipping import.")
+            update_logs(f"WSL instance '{instance_name}' is up to date with the payload. Skipping import.", INFO)
+            return
+        if apply_delta_update(instance_name):
+            return
+        logging.info(f"WSL instance '{instance_name}' was imported from a different payload. Re-importing...")
+        update_logs(f"WSL instance '{instance_name}' was imported from a different payload. Re-importing...", INFO)
+        unregister_wsl_instance(instance_name)
+    else:
         logging.info(f"WSL instance '{instance_name}' does not exist. Importing...")
         update_logs(f"WSL instance '{instance_name}' does not exist. Importing...", INFO)
-        import_wsl_instance(tar_file, instance_name)
+    if payload_digest is None:
+        tar_file = extract_tar_file()
+        check_payload_contents(tar_file)
+        digest = import_wsl_instance(tar_file, instance_name, on_progress)
     else:
-        logging.info(f"WSL instance '{instance_name}' already exists. Skipping import.")
-        update_logs(f"WSL instance '{instance_name}' already exists. Skipping import.", INFO)
+        tar_file = tar_path
+        check_payload_contents(tar_file)
+        known_digest, verified = payload_digest()
+        digest = import_wsl_instance(tar_file, instance_name, on_progress,
+                                     known_digest if verified else None, None if verified else known_digest)
+    # A verified import already hashed every byte; only unverified payloads are read again.
+    payload_cache.write_manifest(instance_name, tar_file, digest)
 
 
 @log_function_entry_exit
-def execute_commands_in_instance_if_needed(instance_name):
+def execute_commands_in_instance_if_needed(instance_name, on_output=None, on_published=None):
     """Execute commands in the WSL instance if it's not already running."""
     if not is_wsl_instance_running(instance_name):
         logging.info(f"WSL instance '{instance_name}' is not running. Starting commands...")
@@ -330,19 +533,40 @@ def execute_commands_in_instance_if_needed(instance_name):
     else:
         logging.info(f"WSL instance '{instance_name}' is already running. Skipping commands.")
         update_logs(f"WSL instance '{instance_name}' is already running. Skipping commands.", INFO)
-    execute_commands_in_instance(instance_name)
+    execute_commands_in_instance(instance_name, on_output, on_published=on_published)
+
 
 
+@log_function_entry_exit
+def provision(instance_name, on_stage=None, on_output=None, on_progress=None):
+    """Install WSL, import the instance and start its services, reporting each stage.
+
+    Returns the backend stack's published (service, host port) pairs, for
+    readiness.backend_services. The run and its stages are recorded in the
+    run store; query it with run_store.py.
+    """
+    published = []
+    stages = [
+        ("Checking WSL", install_wsl_if_needed),
+        ("Importing Cloudbook", lambda: import_wsl_instance_if_needed(get_tar_file_path(), instance_name, on_progress)),
+        ("Starting services", lambda: execute_commands_in_instance_if_needed(instance_name, on_output,
+                                                                             published.extend)),
+    ]
+    with run_store.recording(instance=instance_name) as run:
+        for stage, run_stage in stages:
+            if on_stage is not None:
+                on_stage(stage)
+            with run.stage(stage):
+                run_stage()
+    return published
+
 
 @log_function_entry_exit
 def main():
     configure_logging()
     instance_name = "cloudbook"
-    install_wsl_if_needed()
-    tar_file = extract_tar_file()
-    import_wsl_instance_if_needed(tar_file, instance_name)
-    execute_commands_in_instance_if_needed(instance_name)
-    start_gui()
+    # The window and web engine start right away; provisioning runs on a worker thread
+    start_gui(instance_name)
     
 
 if __name__ == "__main__":
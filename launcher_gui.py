@@ -0,0 +1,176 @@
+import sys
+import time
+import logging
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, Qt, QThreadPool, QUrl, pyqtSignal
+from PyQt6.QtWidgets import QApplication, QLabel, QMainWindow, QProgressBar, QStackedWidget, QVBoxLayout, QWidget
+from PyQt6.QtWebEngineWidgets import QWebEngineView
+
+import log_backend
+import readiness
+from import_progress import format_event
+
+
+class ReadinessSignals(QObject):
+    """Carries readiness updates from the polling thread to the Qt main thread."""
+    status = pyqtSignal(str, str, str)
+    finished = pyqtSignal(object)
+
+
+class ProvisioningSignals(QObject):
+    """Progress of the provisioning worker, delivered on the Qt main thread."""
+    stage = pyqtSignal(str)
+    output = pyqtSignal(str, str, str)
+    progress = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    finished = pyqtSignal(object)
+
+
+class ProvisioningWorker(QRunnable):
+    """Runs `provision(on_stage, on_output, on_progress)` on the Qt thread pool so the window stays responsive.
+
+    `finished` carries what `provision` returns: the backend's published ports.
+    """
+
+    def __init__(self, provision):
+        super().__init__()
+        self.provision = provision
+        self.signals = ProvisioningSignals()
+
+    def run(self):
+        try:
+            published = self.provision(self.signals.stage.emit, self.signals.output.emit, self.signals.progress.emit)
+        except BaseException as e:
+            # install_wsl/import_wsl_instance call sys.exit on fatal errors
+            logging.error(f"Provisioning failed: {e!r}")
+            log_backend.log(f"Provisioning failed: {e!r}", log_backend.ERROR)
+            self.signals.failed.emit(str(e) or type(e).__name__)
+        else:
+            self.signals.finished.emit(published or [])
+
+
+class SplashScreen(QWidget):
+    """Lightweight page showing provisioning progress and each service's status."""
+
+    def __init__(self, services):
+        super().__init__()
+        layout = QVBoxLayout()
+        title = QLabel("Starting Cloudbook...")
+        title.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.stage = QLabel("")
+        self.stage.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.output = QLabel("")
+        self.output.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        layout.addStretch()
+        layout.addWidget(title)
+        layout.addWidget(self.stage)
+        self.progress = QProgressBar()
+        self.progress.setRange(0, 100)
+        self.progress.hide()
+        self.progress_label = QLabel("")
+        self.progress_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self.progress)
+        layout.addWidget(self.progress_label)
+        self.labels = {}
+        self.services_layout = QVBoxLayout()
+        layout.addLayout(self.services_layout)
+        for name in services:
+            self.add_service(name)
+        layout.addWidget(self.output)
+        layout.addStretch()
+        self.setLayout(layout)
+
+    def add_service(self, name):
+        label = QLabel(f"{name}: {readiness.WAITING}")
+        label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.services_layout.addWidget(label)
+        self.labels[name] = label
+
+    def set_stage(self, stage):
+        self.stage.setText(stage)
+
+    def set_progress(self, event):
+        """Show an import progress event from import_progress.ImportProgress."""
+        if event["percent"] is not None:
+            self.progress.setValue(int(event["percent"]))
+            self.progress.show()
+        self.progress_label.setText(format_event(event))
+        if event["final"]:
+            self.progress.hide()
+
+    def set_output(self, step_name, stream, line):
+        self.output.setText(f"{step_name}: {line.strip()[:120]}")
+
+    def set_status(self, name, state, detail):
+        self.labels[name].setText(f"{name}: {state} ({detail})")
+
+
+def run(provision, process_started):
+    """Show the window immediately and provision in the background.
+
+    Chromium warms up on a blank page while WSL and docker are prepared;
+    the web app is loaded once the services answer.
+    """
+    app = QApplication(sys.argv)
+
+    window = QMainWindow()
+    window.setWindowTitle("Embedded Web App")
+
+    services = dict(readiness.DEFAULT_SERVICES)
+    splash = SplashScreen(services)
+    browser = QWebEngineView()
+    # Starts the WebEngine process now instead of after provisioning
+    browser.setUrl(QUrl("about:blank"))
+
+    pages = QStackedWidget()
+    pages.addWidget(splash)
+    pages.addWidget(browser)
+
+    layout = QVBoxLayout()
+    layout.addWidget(pages)
+
+    container = QWidget()
+    container.setLayout(layout)
+    window.setCentralWidget(container)
+
+    readiness_signals = ReadinessSignals()
+    readiness_signals.status.connect(splash.set_status)
+
+    def show_web_app(result):
+        time_to_ui = time.monotonic() - process_started
+        logging.info(f"Time to usable UI: {time_to_ui:.2f}s (services ready: {result.ready_after})")
+        log_backend.log(f"Time to usable UI: {time_to_ui:.2f}s (services ready: {result.ready_after})", log_backend.INFO)
+        browser.setUrl(QUrl(services["frontend"]))
+        pages.setCurrentWidget(browser)
+
+    def wait_for_services(published):
+        # The backend's ports are only known once provisioning has brought its stack up.
+        for name, url in readiness.backend_services(published).items():
+            if name not in services and not (name.startswith("backend") and "backend" in services):
+                services[name] = url
+                splash.add_service(name)
+        splash.set_stage("Waiting for services")
+        threading.Thread(
+            target=lambda: readiness_signals.finished.emit(
+                readiness.wait_until_ready(services, on_status=readiness_signals.status.emit)
+            ),
+            daemon=True,
+        ).start()
+
+    def show_failure(message):
+        splash.set_stage(f"Setup failed: {message}. See error.log for details.")
+
+    readiness_signals.finished.connect(show_web_app)
+
+    worker = ProvisioningWorker(provision)
+    worker.signals.stage.connect(splash.set_stage)
+    worker.signals.output.connect(splash.set_output)
+    worker.signals.progress.connect(splash.set_progress)
+    worker.signals.finished.connect(wait_for_services)
+    worker.signals.failed.connect(show_failure)
+
+    window.resize(1024, 768)
+    window.show()
+    QThreadPool.globalInstance().start(worker)
+    app.exec()
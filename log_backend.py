@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+
+INFO = 'info'
+ERROR = 'error'
+DEBUG = 'debug'
+WARNING = 'warning'
+WSL_OUTPUT = 'wsl_output'
+WSL_ERROR = 'wsl_error'
+OTHERS = 'others'
+APPLICATION = 'application'
+
+CHANNEL_FILES = {
+    INFO: "info.log",
+    DEBUG: "debug.log",
+    ERROR: "error.log",
+    WARNING: "warning.log",
+    WSL_OUTPUT: "wsl_output.log",
+    WSL_ERROR: "wsl_error.log",
+    OTHERS: "others.log",
+    APPLICATION: "application.log",
+}
+
+# Loggers named cloudbook.channel.<channel> write to that channel's file.
+CHANNEL_LOGGER_PREFIX = "cloudbook.channel."
+MAX_BATCH = 512
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 3
+
+_writer = None
+_channel_loggers = {}
+_direct_lock = threading.Lock()
+_TRACEBACKS = logging.Formatter()
+
+
+def _format(item, stamp):
+    channel, created, level, message = item
+    if channel == APPLICATION:
+        return f"{stamp},{int(created % 1 * 1000):03d} - {level} - {message}\n"
+    return f"{stamp} {message}\n"
+
+
+def _channel_path(log_dir, channel):
+    return os.path.join(log_dir, CHANNEL_FILES.get(channel, CHANNEL_FILES[OTHERS]))
+
+
+class _ChannelFile:
+    """An append handle kept open for the life of the process, rotated by size."""
+
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = open(path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+
+    def write(self, text):
+        # Sizes are on-disk bytes; non-ASCII output (e.g. from wsl) takes more than one per character.
+        size = len(text.encode('utf-8'))
+        if self.max_bytes and self.size and self.size + size > self.max_bytes:
+            self.rotate()
+        self.file.write(text)
+        self.size += size
+
+    def flush(self):
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = 0
+
+    def close(self):
+        self.file.close()
+
+
+class BatchWriter(threading.Thread):
+    """Background thread draining the log queue and writing records in batches."""
+
+    def __init__(self, log_dir, max_bytes, backup_count, console):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = queue.SimpleQueue()
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.console = console
+        self.files = {}
+        self._second = None
+        self._stamp = ""
+
+    def _file(self, channel):
+        handle = self.files.get(channel)
+        if handle is None:
+            path = _channel_path(self.log_dir, channel)
+            handle = self.files[channel] = _ChannelFile(path, self.max_bytes, self.backup_count)
+        return handle
+
+    def _timestamp(self, created):
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        return self._stamp
+
+    def _format(self, item):
+        return _format(item, self._timestamp(item[1]))
+
+    def put(self, item):
+        """Queue `item`, or write it straight to its file if this thread has died."""
+        if self.is_alive():
+            self.queue.put(item)
+        else:
+            _write_direct(self.log_dir, item)
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            touched = set()
+            waiters = []
+            try:
+                for item in batch:
+                    if item is None:
+                        running = False
+                        continue
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                        continue
+                    text = self._format(item)
+                    self._file(item[0]).write(text)
+                    touched.add(item[0])
+                    if self.console and item[0] == APPLICATION:
+                        sys.stderr.write(text)
+                for channel in touched:
+                    self.files[channel].flush()
+            finally:
+                # Even if a write failed and this thread is about to die, nobody stays blocked in flush().
+                for waiter in waiters:
+                    waiter.set()
+        for handle in self.files.values():
+            handle.close()
+
+
+def _write_direct(log_dir, item):
+    """Fallback when the writer thread is gone: append synchronously, as update_logs used to."""
+    text = _format(item, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(item[1])))
+    try:
+        with _direct_lock, open(_channel_path(log_dir, item[0]), 'a', encoding='utf-8') as f:
+            f.write(text)
+    except OSError:
+        sys.stderr.write(text)
+
+
+class ChannelQueueHandler(logging.Handler):
+    """Hands records to the writer thread; the calling thread never touches a file."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        name = record.name
+        if name.startswith(CHANNEL_LOGGER_PREFIX):
+            channel = name[len(CHANNEL_LOGGER_PREFIX):]
+        else:
+            channel = APPLICATION
+        try:
+            message = record.getMessage()
+            # Tracebacks are formatted here, on the logging thread, while the frames still exist.
+            if record.exc_info and not record.exc_text:
+                record.exc_text = _TRACEBACKS.formatException(record.exc_info)
+            if record.exc_text:
+                message = f"{message}\n{record.exc_text}"
+            if record.stack_info:
+                message = f"{message}\n{_TRACEBACKS.formatStack(record.stack_info)}"
+            self.writer.put((channel, record.created, record.levelname, message))
+        except Exception:
+            self.handleError(record)
+
+
+def _start_writer(log_dir=".", max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, console=True):
+    global _writer
+    if _writer is None:
+        os.makedirs(log_dir, exist_ok=True)
+        _writer = BatchWriter(log_dir, max_bytes, backup_count, console)
+        _writer.start()
+        handler = ChannelQueueHandler(_writer)
+        for channel in CHANNEL_FILES:
+            channel_logger = logging.getLogger(CHANNEL_LOGGER_PREFIX + channel)
+            channel_logger.propagate = False
+            channel_logger.handlers = [handler]
+            channel_logger.setLevel(logging.DEBUG)
+            _channel_loggers[channel] = channel_logger
+        atexit.register(shutdown)
+    return _writer
+
+
+def configure(log_dir=".", level=logging.DEBUG, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, console=True):
+    """Route the root logger and every channel through one batching writer thread.
+
+    If log() already started the writer, its settings are kept and only the
+    root logger is routed to it.
+    """
+    writer = _start_writer(log_dir, max_bytes, backup_count, console)
+    root = logging.getLogger()
+    if not any(isinstance(existing, ChannelQueueHandler) for existing in root.handlers):
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(ChannelQueueHandler(writer))
+        root.setLevel(level)
+    return writer
+
+
+def log(message, channel=INFO):
+    """Write `message` to a channel file such as info.log or wsl_output.log.
+
+    Skips the logging machinery entirely: the call only timestamps the
+    message and puts it on the writer's queue. The first call starts the
+    writer if configure() has not; the root logger is left alone.
+    """
+    writer = _writer or _start_writer()
+    if channel not in CHANNEL_FILES:
+        channel = OTHERS
+    writer.put((channel, time.time(), "INFO", message))
+
+
+def flush(timeout=5.0):
+    """Block until everything logged so far has been written, or for at most `timeout` seconds."""
+    writer = _writer
+    if writer is None or not writer.is_alive():
+        return
+    done = threading.Event()
+    writer.queue.put(done)
+    deadline = time.monotonic() + timeout
+    # Stop waiting if the writer dies with the event still queued.
+    while not done.wait(min(0.1, max(deadline - time.monotonic(), 0))):
+        if not writer.is_alive() or time.monotonic() >= deadline:
+            return
+
+
+def shutdown():
+    """Flush and stop the writer thread; registered to run at interpreter exit."""
+    global _writer
+    if _writer is None:
+        return
+    if _writer.is_alive():
+        _writer.queue.put(None)
+        _writer.join(timeout=5.0)
+    _writer = None
+    _channel_loggers.clear()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, ChannelQueueHandler):
+            root.removeHandler(existing)
+
+
+def _legacy_update_logs(message, log_dir):
+    """The previous open/append/close per call, kept for the benchmark below."""
+    current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(os.path.join(log_dir, "legacy_info.log"), 'a') as file:
+        file.write(current_time + " " + message + "\n")
+
+
+def benchmark(calls=20000):
+    """Compare the per-call cost of the batched backend with the legacy update_logs."""
+    import tempfile
+    with tempfile.TemporaryDirectory() as log_dir:
+        started = time.perf_counter()
+        for index in range(calls):
+            _legacy_update_logs(f"message {index}", log_dir)
+        legacy = (time.perf_counter() - started) / calls
+
+        configure(log_dir, console=False)
+        started = time.perf_counter()
+        for index in range(calls):
+            log(f"message {index}", INFO)
+        enqueue = (time.perf_counter() - started) / calls
+        flush(timeout=60)
+        drained = (time.perf_counter() - started) / calls
+        shutdown()
+    return {
+        "calls": calls,
+        "legacy_us_per_call": round(legacy * 1e6, 2),
+        "queued_us_per_call": round(enqueue * 1e6, 2),
+        "queued_until_written_us_per_call": round(drained * 1e6, 2),
+    }
+
+
+if __name__ == "__main__":
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
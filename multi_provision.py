@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import functools
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+import run_store
+import payload_verify
+import install_wsl3
+from install_wsl3 import FRONTEND_CONTAINER, update_logs
+from import_progress import format_event
+from log_backend import INFO, ERROR, WARNING
+
+# Provision many instances (per tester or tenant) from the one payload the launcher ships.
+# The payload is staged once and verified at most once; imports are bounded separately from the
+# rest of provisioning because they compete for disk bandwidth, while `docker` steps mostly wait.
+# All WSL 2 distros share the host's network, so every instance gets its own frontend port and
+# its backend's published ports shifted by BACKEND_PORT_STRIDE per instance.
+# The whole port layout is checked (see check_port_layout) before any of it is published.
+# Every instance writes its own logs under LOG_DIR/<instance>/.
+#
+# On Linux, point CLOUDBOOK_WSL_EXE / CLOUDBOOK_WSL_ROOT / CLOUDBOOK_PAYLOAD at stubs
+# (e.g. the fakes in benchmark_provisioning.py) to exercise it end to end.
+MAX_IMPORTS = 2
+# Provisioning steps mostly wait on the distro, so run more instances than there are cores.
+MAX_INSTANCES = min(16, 4 * (os.cpu_count() or 1))
+# The desktop instance publishes the frontend on 9000; lab instances count up from here.
+BASE_PORT = 9100
+# The backend stack's published ports move by this much per instance (the first by one stride),
+# so instance N's backend never binds the host ports of the desktop instance or of another one.
+BACKEND_PORT_STRIDE = 100
+LOG_DIR = "instances"
+REPORT_FILE = "multi_provision_report.json"
+
+
+def instance_names(prefix, count):
+    return [f"{prefix}-{index + 1}" for index in range(count)]
+
+
+def frontend_for(port):
+    """The frontend container with its own host port; all WSL 2 distros share one network."""
+    return dataclasses.replace(FRONTEND_CONTAINER, ports=(f"{port}:80",))
+
+
+def check_port_layout(backend_ports, names, base_port=BASE_PORT, stride=BACKEND_PORT_STRIDE):
+    """Raise ValueError unless no two instances publish the same host port and all of them fit below 65536.
+
+    `backend_ports` are the backend stack's unshifted (service, host port)
+    pairs: the desktop instance publishes them as they are, the instance
+    with index N moves them by (N + 1) * `stride`. The frontends take the
+    desktop's port and `base_port` upward.
+    """
+    owners = {}
+
+    def claim(port, owner):
+        if port > 65535:
+            raise ValueError(f"{owner} would publish port {port}, above 65535; provision fewer instances")
+        if port in owners:
+            raise ValueError(f"{owner} and {owners[port]} would both publish port {port}; "
+                             f"provision fewer instances or choose another base port")
+        owners[port] = owner
+
+    for mapping in FRONTEND_CONTAINER.ports:
+        claim(int(mapping.rsplit(":", 2)[-2]), "the desktop frontend")
+    for index, name in enumerate(names):
+        claim(base_port + index, f"'{name}' frontend")
+    for index, owner in enumerate(["the desktop backend"] + [f"'{name}' backend" for name in names]):
+        for service, port in dict.fromkeys(backend_ports):
+            claim(port + index * stride, f"{owner} ({service})")
+
+
+def verify_shared_payload(payload):
+    """Verify the staged payload once for every instance; returns (tree digest, verified)."""
+    manifest = payload_verify.load_manifest_for(payload)
+    if manifest is None:
+        logging.warning(f"'{payload}' has no verification manifest; importing it unchecked.")
+        update_logs(f"'{payload}' has no verification manifest; importing it unchecked.", WARNING)
+        # The digest is still needed for each instance's payload cache; hash it once here.
+        return payload_verify.tree_digest(payload), False
+    with payload_verify.open_verified(payload, manifest) as reader:
+        while reader.read(payload_verify.TREE_CHUNK_SIZE):
+            pass
+    logging.info(f"Verified '{payload}' once for all instances (tree digest {reader.root}).")
+    update_logs(f"Verified '{payload}' once for all instances (tree digest {reader.root}).", INFO)
+    return reader.root, True
+
+
+class SharedPayload:
+    """The staged payload's (tree digest, verified), computed on first use and shared by all instances.
+
+    When every instance is already up to date nothing asks for it, so a warm
+    run never reads the payload in full.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+
+    def __call__(self):
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._result is None:
+                try:
+                    self._result = verify_shared_payload(self.path)
+                except payload_verify.PayloadCorruptError as e:
+                    # Remembered, so the other instances fail fast instead of hashing it again.
+                    self._error = e
+                    raise
+            return self._result
+
+    @property
+    def digest(self):
+        return self._result[0] if self._result is not None else None
+
+
+def provision_instance(instance_name, port, payload, import_slots, log_dir=LOG_DIR, parent=None,
+                       backend_port_offset=0, check_ports=None):
+    """Import (when needed) and provision one instance; never raises, returns its report entry.
+
+    Each instance is recorded as its own run in the shared run store.
+    """
+    instance_log_dir = os.path.join(log_dir, instance_name)
+    os.makedirs(instance_log_dir, exist_ok=True)
+    result = {"instance": instance_name, "port": port, "backend_port_offset": backend_port_offset, "ok": False,
+              "error": None, "log_dir": instance_log_dir}
+    started = time.monotonic()
+    with tracing.span("instance", parent=parent, instance=instance_name, port=port) as span, \
+            run_store.recording(instance=instance_name, port=port) as run:
+        try:
+            with open(os.path.join(instance_log_dir, "import.log"), "w") as progress_log:
+
+                def on_progress(event):
+                    progress_log.write(format_event(event) + "\n")
+                    progress_log.flush()
+
+                with import_slots, run.stage("import"):
+                    result["import_wait_seconds"] = round(time.monotonic() - started, 3)
+                    import_started = time.monotonic()
+                    install_wsl3.import_wsl_instance_if_needed(payload.path, instance_name, on_progress, payload)
+                    result["import_seconds"] = round(time.monotonic() - import_started, 3)
+
+            provision_started = time.monotonic()
+            with run.stage("provision"):
+                report = install_wsl3.execute_commands_in_instance(
+                    instance_name, frontend=frontend_for(port), log_file=os.path.join(instance_log_dir, "logging_.txt"),
+                    backend_port_offset=backend_port_offset, check_ports=check_ports)
+            result["provision_seconds"] = round(time.monotonic() - provision_started, 3)
+            result["steps"] = dict(report.status)
+            result["ok"] = report.ok
+            if not report.ok:
+                result["error"] = f"steps did not all succeed: {report.status}"
+        except payload_verify.PayloadCorruptError as e:
+            result["error"] = f"refusing to import a corrupt payload: {e}"
+        except SystemExit as e:
+            # The single-instance code paths exit on fatal errors; that must only end this instance.
+            result["error"] = f"aborted with exit code {e.code}; see application.log"
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        span.set("ok", result["ok"])
+    result["seconds"] = round(time.monotonic() - started, 3)
+    if result["ok"]:
+        logging.info(f"Instance '{instance_name}' is ready on port {port} ({result['seconds']:.1f}s)")
+        update_logs(f"Instance '{instance_name}' is ready on port {port} ({result['seconds']:.1f}s)", INFO)
+    else:
+        logging.error(f"Instance '{instance_name}' failed: {result['error']}")
+        update_logs(f"Instance '{instance_name}' failed: {result['error']}", ERROR)
+    return result
+
+
+def provision_many(names, base_port=BASE_PORT, max_imports=MAX_IMPORTS, max_instances=MAX_INSTANCES,
+                   log_dir=LOG_DIR, on_result=None):
+    """Provision `names` side by side from one shared payload and return the aggregate report."""
+    if len(set(names)) != len(names):
+        raise ValueError("Instance names must be unique")
+    # The frontends are checked now; the backend's ports are only known once an instance has
+    # read its compose config, and every instance checks the whole layout before bringing it up.
+    check_port_layout((), names, base_port)
+    check_ports = functools.partial(check_port_layout, names=names, base_port=base_port)
+    started = time.monotonic()
+    install_wsl3.install_wsl_if_needed()
+    payload = SharedPayload(install_wsl3.extract_tar_file())
+    import_slots = threading.BoundedSemaphore(max_imports)
+
+    with tracing.span("provision_many", instances=len(names), max_imports=max_imports) as root:
+
+        def run(index, name):
+            result = provision_instance(name, base_port + index, payload, import_slots, log_dir, root,
+                                        (index + 1) * BACKEND_PORT_STRIDE, check_ports)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_instances, thread_name_prefix="instance") as pool:
+            results = list(pool.map(run, range(len(names)), names))
+
+    return {
+        "payload": str(payload.path),
+        "digest": payload.digest,
+        "max_imports": max_imports,
+        "max_instances": max_instances,
+        "wall_seconds": round(time.monotonic() - started, 3),
+        "succeeded": sum(1 for result in results if result["ok"]),
+        "failed": sum(1 for result in results if not result["ok"]),
+        "import_seconds_total": round(sum(result.get("import_seconds", 0.0) for result in results), 3),
+        "instances": results,
+    }
+
+
+def format_result(result):
+    state = "ok" if result["ok"] else f"FAILED ({result['error']})"
+    timings = f"import {result.get('import_seconds', 0):.1f}s, provision {result.get('provision_seconds', 0):.1f}s"
+    return f"{result['instance']:<24} port {result['port']:<6} {timings:<36} {state}"
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Provision several Cloudbook instances from one payload, each with its own frontend port.")
+    names = parser.add_mutually_exclusive_group(required=True)
+    names.add_argument("--count", type=int, help="number of instances, named <prefix>-1..<prefix>-N")
+    names.add_argument("--names", nargs="+", help="explicit instance names")
+    parser.add_argument("--prefix", default="cloudbook", help="name prefix used with --count")
+    parser.add_argument("--base-port", type=int, default=BASE_PORT,
+                        help="frontend port of the first instance; the others count up")
+    parser.add_argument("--max-imports", type=int, default=MAX_IMPORTS, help="concurrent `wsl --import` runs")
+    parser.add_argument("--max-instances", type=int, default=MAX_INSTANCES, help="instances provisioned at once")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="per-instance logs go to <log-dir>/<instance>/")
+    parser.add_argument("--report", default=REPORT_FILE, help="where to write the JSON report")
+    args = parser.parse_args()
+
+    install_wsl3.configure_logging()
+    names = args.names or instance_names(args.prefix, args.count)
+    try:
+        check_port_layout((), names, args.base_port)
+    except ValueError as e:
+        parser.error(str(e))
+    # A corrupt payload fails every instance that needs an import; each reports it in its result.
+    report = provision_many(names, args.base_port, args.max_imports, args.max_instances, args.log_dir,
+                            on_result=lambda result: print(format_result(result), flush=True))
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{report['succeeded']} of {len(names)} instances ready in {report['wall_seconds']:.1f}s "
+          f"(report: {args.report})")
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import queue
+import threading
+import subprocess
+from collections import deque
+
+STDOUT = "stdout"
+STDERR = "stderr"
+
+# Longest line handed to sinks in one piece; longer lines arrive split.
+MAX_LINE_BYTES = 64 * 1024
+TAIL_LINES = 200
+
+
+class TailBuffer:
+    """Sink keeping only the last `max_lines` lines of each stream."""
+
+    def __init__(self, max_lines=TAIL_LINES):
+        self.lines = {STDOUT: deque(maxlen=max_lines), STDERR: deque(maxlen=max_lines)}
+
+    def __call__(self, stream, line):
+        self.lines[stream].append(line)
+
+    def text(self, stream):
+        return "".join(self.lines[stream])
+
+
+class ByteCounter:
+    """Sink counting the bytes of each stream, for output sizes beyond what the tail keeps."""
+
+    def __init__(self):
+        self.bytes = {STDOUT: 0, STDERR: 0}
+
+    def __call__(self, stream, line):
+        self.bytes[stream] += len(line.encode(errors="replace"))
+
+
+class LogFileSink:
+    """Sink appending every line to an open log file, prefixed with a label."""
+
+    def __init__(self, log, label="", lock=None):
+        self.log = log
+        self.label = label
+        self.lock = lock or threading.Lock()
+
+    def __call__(self, stream, line):
+        prefix = f"[{self.label}] " if self.label else ""
+        marker = "!" if stream == STDERR else ">"
+        with self.lock:
+            self.log.write(f"{prefix}{marker} {line if line.endswith(chr(10)) else line + chr(10)}")
+            self.log.flush()
+
+
+def drain_pipe(pipe, stream, lines):
+    """Push decoded lines from `pipe` into a shared queue; (stream, None) marks the end.
+
+    The pipe is closed once it reaches end of file.
+    """
+    with pipe:
+        for raw in iter(lambda: pipe.readline(MAX_LINE_BYTES), b""):
+            lines.put((stream, raw.decode(errors="replace")))
+    lines.put((stream, None))
+
+
+def start_draining(process):
+    """Read stdout and stderr of `process` concurrently into one queue, so neither pipe can fill up."""
+    lines = queue.Queue()
+    for pipe, stream in ((process.stdout, STDOUT), (process.stderr, STDERR)):
+        threading.Thread(target=drain_pipe, args=(pipe, stream, lines), daemon=True).start()
+    return lines
+
+
+def dispatch(sinks, stream, line):
+    for sink in sinks:
+        sink(stream, line)
+
+
+def stream_process(argv, sinks=(), tail_lines=TAIL_LINES, timeout=None, **popen_kwargs):
+    """Run `argv`, pushing its output line by line to `sinks` as it is produced.
+
+    Memory use is bounded by the tail buffer regardless of how much the
+    process prints. Returns (exit_code, tail).
+    """
+    tail = TailBuffer(tail_lines)
+    sinks = list(sinks) + [tail]
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+    lines = start_draining(process)
+    open_streams = 2
+    try:
+        while open_streams:
+            stream, line = lines.get(timeout=timeout)
+            if line is None:
+                open_streams -= 1
+                continue
+            dispatch(sinks, stream, line)
+    except queue.Empty:
+        process.kill()
+        process.wait()
+        raise subprocess.TimeoutExpired(argv, timeout)
+    return process.wait(), tail
@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import logging
+
+from wsl_config import WSL_ROOT
+from payload_container import open_payload, stat_payload, payload_name
+from payload_verify import ALGORITHM, tree_digest, shipped_root
+
+MANIFEST_VERSION = 1
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def manifest_path(instance_name):
+    """Manifest lives beside the instance directory so it survives re-imports of the directory."""
+    return os.path.join(WSL_ROOT, f"{instance_name}.manifest.json")
+
+
+def sampled_digest(path, size=None):
+    """Hash a fixed number of evenly spaced chunks; cost does not depend on the file size."""
+    if size is None:
+        size = stat_payload(path)[0]
+    digest = hashlib.sha256(str(size).encode())
+    with open_payload(path) as f:
+        if size <= SAMPLE_COUNT * SAMPLE_SIZE:
+            digest.update(f.read())
+            return digest.hexdigest()
+        step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+        for index in range(SAMPLE_COUNT):
+            f.seek(index * step)
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def full_digest(path):
+    """Tree hash of the whole payload; matches the digest a verified import reports."""
+    return tree_digest(path)
+
+
+def _legacy_digest(path):
+    """Plain SHA-256, recorded by manifests written before the tree hash."""
+    digest = hashlib.sha256()
+    with open_payload(path) as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def quick_fingerprint(path):
+    """Size, mtime and sampled-chunk hash of the payload (a file or a container member)."""
+    size, mtime_ns = stat_payload(path)
+    return {
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "sample": sampled_digest(path, size),
+    }
+
+
+def load_manifest(instance_name):
+    """Return the recorded manifest for an instance, or None if there is none."""
+    try:
+        with open(manifest_path(instance_name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(instance_name, payload_path, digest=None, fingerprint=None, name=None):
+    """Record which payload an instance was imported from (`name` overrides the payload's own name)."""
+    manifest = dict(fingerprint or quick_fingerprint(payload_path))
+    manifest["version"] = MANIFEST_VERSION
+    manifest["instance"] = instance_name
+    manifest["payload"] = name or payload_name(payload_path)
+    manifest["digest"] = digest or full_digest(payload_path)
+    manifest["algorithm"] = ALGORITHM
+    os.makedirs(WSL_ROOT, exist_ok=True)
+    path = manifest_path(instance_name)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, path)
+    logging.info(f"Recorded payload digest {manifest['digest']} for '{instance_name}'")
+    return manifest
+
+
+def invalidate(instance_name):
+    """Forget the recorded payload, forcing the next run to re-import."""
+    try:
+        os.remove(manifest_path(instance_name))
+    except FileNotFoundError:
+        pass
+
+
+def payload_matches_manifest(instance_name, payload_path, full=False):
+    """Check whether an instance was imported from this exact payload.
+
+    Size, the sampled hash, the payload's name and, when it shipped with a
+    manifest, its build's root digest are compared without reading the whole
+    file. None of them depends on where the payload was extracted, so a onefile
+    EXE unpacking it into a fresh _MEIPASS on every launch still matches. A
+    payload without a shipped manifest is hashed in full when its mtime
+    differs from the recorded one. With `full`, the whole payload is always
+    hashed (`python payload_cache.py verify`).
+    """
+    manifest = load_manifest(instance_name)
+    if manifest is None:
+        return False
+    fingerprint = quick_fingerprint(payload_path)
+    if fingerprint["size"] != manifest.get("size") or fingerprint["sample"] != manifest.get("sample"):
+        logging.info(f"Payload for '{instance_name}' changed (size or sampled hash differs)")
+        return False
+    if payload_name(payload_path) != manifest.get("payload"):
+        logging.info(f"Payload for '{instance_name}' changed (was {manifest.get('payload')})")
+        return False
+    legacy = manifest.get("algorithm") != ALGORITHM
+    root = None if legacy else shipped_root(payload_path)
+    if root is not None and root != manifest.get("digest"):
+        logging.info(f"Payload for '{instance_name}' changed (build root digest differs)")
+        return False
+    # Without a build root, a rebuilt payload of the same size could differ only outside the samples.
+    unproven = root is None and fingerprint["mtime_ns"] != manifest.get("mtime_ns")
+    if full or unproven:
+        if (_legacy_digest if legacy else full_digest)(payload_path) != manifest.get("digest"):
+            logging.info(f"Payload for '{instance_name}' changed (content digest differs)")
+            return False
+        if unproven and not legacy:
+            # Same content, new mtime: remember it so the next launch takes the fast path.
+            write_manifest(instance_name, payload_path, manifest["digest"], fingerprint, manifest["payload"])
+    return True
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Check an instance against the payload it was imported from.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    verify = commands.add_parser("verify", help="hash the whole payload and compare it with the instance's record")
+    verify.add_argument("instance")
+    verify.add_argument("payload", nargs="?", help="payload file (default: the one the installer would import)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    payload = args.payload
+    if payload is None:
+        from install_wsl3 import get_tar_file_path
+        payload = get_tar_file_path()
+    if load_manifest(args.instance) is None:
+        raise SystemExit(f"No payload recorded for '{args.instance}'")
+    if not payload_matches_manifest(args.instance, payload, full=True):
+        raise SystemExit(f"'{args.instance}' was not imported from {payload}")
+    print(f"'{args.instance}' was imported from {payload}")
+
+
+if __name__ == "__main__":
+    main()
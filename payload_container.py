@@ -0,0 +1,319 @@
+import io
+import os
+import sys
+import json
+import struct
+import logging
+import contextlib
+
+from payload_staging import chunked_copy
+from wsl_config import CONTAINER_NAME
+
+# Layout: [optional EXE bytes][member data ...][JSON index][trailer]
+# The trailer is fixed-size so the index is found with two small reads from the end.
+MAGIC = b"CBPAYLD1"
+TRAILER = struct.Struct("<8sQQ")
+INDEX_VERSION = 1
+# Members start on page boundaries so sequential reads stay aligned.
+ALIGNMENT = 4096
+
+
+class ContainerError(ValueError):
+    pass
+
+
+class MemberReader(io.RawIOBase):
+    """Read-only, seekable view of one member's byte range inside the container."""
+
+    def __init__(self, path, offset, size):
+        super().__init__()
+        self._file = open(path, "rb", buffering=0)
+        self._offset = offset
+        self._size = size
+        self._position = 0
+        self._file.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self._size - self._position
+        if remaining <= 0:
+            return 0
+        view = memoryview(buffer)
+        if len(view) > remaining:
+            view = view[:remaining]
+        read = self._file.readinto(view)
+        self._position += read
+        return read
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence == io.SEEK_END:
+            position += self._size
+        self._position = max(0, min(position, self._size))
+        self._file.seek(self._offset + self._position)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class PayloadMember:
+    """A file stored in a payload container; nothing is read until `open()`."""
+
+    def __init__(self, container, name, offset, size, mtime_ns, attributes=None):
+        self.container = container
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.attributes = dict(attributes or {})
+
+    def open(self):
+        return MemberReader(self.container, self.offset, self.size)
+
+    def __repr__(self):
+        return f"<payload member {self.name} ({self.size} bytes) in {self.container}>"
+
+    def __str__(self):
+        return f"{self.container}:{self.name}"
+
+
+def read_index(container_path):
+    """Return the container index, or None when the file carries no payload trailer."""
+    try:
+        with open(container_path, "rb") as f:
+            f.seek(0, io.SEEK_END)
+            end = f.tell()
+            if end < TRAILER.size:
+                return None
+            f.seek(end - TRAILER.size)
+            magic, index_offset, index_length = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != MAGIC:
+                return None
+            if index_offset + index_length + TRAILER.size != end:
+                raise ContainerError(f"Corrupt payload trailer in {container_path}")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length))
+    except OSError:
+        return None
+    if index.get("version") != INDEX_VERSION:
+        raise ContainerError(f"Unsupported payload index version {index.get('version')} in {container_path}")
+    index["index_offset"] = index_offset
+    return index
+
+
+def list_members(container_path):
+    """Return the members of a container keyed by name, in the order they were added."""
+    index = read_index(container_path)
+    if index is None:
+        return {}
+    mtime_ns = os.stat(container_path).st_mtime_ns
+    members = {}
+    for entry in index["members"]:
+        attributes = {key: value for key, value in entry.items() if key not in ("name", "offset", "size")}
+        members[entry["name"]] = PayloadMember(
+            container_path, entry["name"], entry["offset"], entry["size"], mtime_ns, attributes
+        )
+    return members
+
+
+def candidate_containers():
+    """Where a payload may live: an explicit override, a sidecar beside the EXE, or the EXE itself."""
+    candidates = []
+    override = os.environ.get("CLOUDBOOK_PAYLOAD")
+    if override:
+        candidates.append(override)
+    if getattr(sys, "frozen", False):
+        candidates.append(os.path.join(os.path.dirname(sys.executable), CONTAINER_NAME))
+        candidates.append(sys.executable)
+    else:
+        candidates.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), CONTAINER_NAME))
+    return candidates
+
+
+def find_member(names):
+    """Return the first of `names` found in any candidate container, or None."""
+    for container_path in candidate_containers():
+        if not os.path.isfile(container_path):
+            continue
+        try:
+            members = list_members(container_path)
+        except ContainerError as e:
+            logging.warning(f"Ignoring payload container {container_path}: {e}")
+            continue
+        for name in names:
+            if name in members:
+                return members[name]
+    return None
+
+
+def open_payload(payload):
+    """Open a payload given as a file path or a PayloadMember."""
+    if isinstance(payload, PayloadMember):
+        return payload.open()
+    return open(payload, "rb")
+
+
+def stat_payload(payload):
+    """Return (size, mtime_ns) of a payload given as a file path or a PayloadMember."""
+    if isinstance(payload, PayloadMember):
+        return payload.size, payload.mtime_ns
+    stat = os.stat(payload)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def payload_name(payload):
+    """File name of a payload, used to pick the decompressor and label logs."""
+    if isinstance(payload, PayloadMember):
+        return payload.name
+    return os.path.basename(payload)
+
+
+@contextlib.contextmanager
+def _appending(container_path):
+    """Open a container for appending; yields (file, entries) and writes the index back on exit.
+
+    If appending fails part-way the new bytes are dropped and the previous
+    index restored, so the container stays readable.
+    """
+    created = not os.path.exists(container_path)
+    index = None if created else read_index(container_path)
+    entries = index["members"] if index is not None else []
+    try:
+        with open(container_path, "w+b" if created else "r+b") as container:
+            # Drop the old index and trailer; new members go where they were.
+            start = index["index_offset"] if index is not None else container.seek(0, io.SEEK_END)
+            container.truncate(start)
+            kept = len(entries)
+            try:
+                yield container, entries
+            except BaseException:
+                container.truncate(start)
+                del entries[kept:]
+                if index is not None:
+                    _write_index(container, entries)
+                raise
+            _write_index(container, entries)
+    except BaseException:
+        if created and os.path.exists(container_path):
+            os.remove(container_path)
+        raise
+
+
+def _write_index(container, entries):
+    index_bytes = json.dumps({"version": INDEX_VERSION, "members": entries}).encode()
+    index_offset = container.seek(0, io.SEEK_END)
+    container.write(index_bytes)
+    container.write(TRAILER.pack(MAGIC, index_offset, len(index_bytes)))
+
+
+def _start_member(container, container_path, entries, name):
+    if any(entry["name"] == name for entry in entries):
+        raise ContainerError(f"{name} is already in {container_path}")
+    end = container.seek(0, io.SEEK_END)
+    container.write(b"\0" * (-end % ALIGNMENT))
+    return container.tell()
+
+
+def append_members(container_path, paths, on_chunk=None, attributes=None):
+    """Build time: append files to `container_path` (an EXE or a new sidecar) and rewrite the index.
+
+    Members already in the container are kept; `on_chunk(name, chunk)` sees
+    every byte written, so callers can hash while copying, and
+    `attributes(name)` returns extra index fields recorded once a member is in.
+    """
+    with _appending(container_path) as (container, entries):
+        for path in paths:
+            name = os.path.basename(path)
+            offset = _start_member(container, container_path, entries, name)
+            with open(path, "rb") as src:
+                callback = None if on_chunk is None else (lambda chunk, name=name: on_chunk(name, chunk))
+                size = chunked_copy(src, container, on_chunk=callback)
+            entry = {"name": name, "offset": offset, "size": size}
+            if attributes is not None:
+                entry.update(attributes(name))
+            entries.append(entry)
+            logging.info(f"Added {name} ({size} bytes) at offset {offset} of {container_path}")
+    return entries
+
+
+def append_stream(container_path, name, chunks, attributes=None):
+    """Build time: append one member whose bytes arrive as an iterable of chunks, e.g. from a compressor.
+
+    `attributes()` is called once every chunk is written, so it can return
+    manifests computed from the same stream.
+    """
+    with _appending(container_path) as (container, entries):
+        offset = _start_member(container, container_path, entries, name)
+        size = 0
+        for chunk in chunks:
+            container.write(chunk)
+            size += len(chunk)
+        entry = {"name": name, "offset": offset, "size": size}
+        if attributes is not None:
+            entry.update(attributes())
+        entries.append(entry)
+        logging.info(f"Added {name} ({size} bytes) at offset {offset} of {container_path}")
+    return entry
+
+
+def extract_member(container_path, name, dest_path):
+    """Copy one member out to a regular file (for debugging; imports read members directly)."""
+    member = list_members(container_path)[name]
+    with member.open() as src, open(dest_path, "wb") as dst:
+        return chunked_copy(src, dst)
+
+
+def main():
+    # Build-time CLI only; keep argparse off the launcher's import path.
+    import argparse
+    parser = argparse.ArgumentParser(description="Build and inspect Cloudbook payload containers.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    append = commands.add_parser("append", help="append files to a container or an executable")
+    append.add_argument("container_path")
+    append.add_argument("paths", nargs="+")
+    append.add_argument("--signing-key", help="Ed25519 private key (PEM) to sign the embedded manifests with")
+    append.add_argument("--unsigned", action="store_true", help="development payload; release builds refuse it")
+    listing = commands.add_parser("list", help="show the members of a container")
+    listing.add_argument("container_path")
+    extract = commands.add_parser("extract", help="copy one member out to a file")
+    extract.add_argument("container_path")
+    extract.add_argument("name")
+    extract.add_argument("dest_path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "append":
+        # Verification manifests are hashed from the same bytes being appended.
+        import payload_verify
+        signing_key = None
+        if args.signing_key:
+            with open(args.signing_key, "rb") as f:
+                signing_key = f.read()
+        if not args.unsigned:
+            try:
+                payload_verify.check_release_signing(signing_key)
+            except payload_verify.SignatureError as e:
+                parser.error(str(e))
+        on_chunk, attributes = payload_verify.embedding_hooks(signing_key)
+        append_members(args.container_path, args.paths, on_chunk, attributes)
+    elif args.command == "list":
+        for member in list_members(args.container_path).values():
+            print(f"{member.name}\t{member.size}\t@{member.offset}")
+    else:
+        print(extract_member(args.container_path, args.name, args.dest_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import sys
+import shutil
+import logging
+
+# Streaming copies never hold more than this many bytes of the payload in memory.
+CHUNK_SIZE = 1024 * 1024
+
+# FICLONE ioctl from <linux/fs.h>, used for reflink copies on btrfs/xfs.
+FICLONE = 0x40049409
+
+
+def can_import_in_place(src_path):
+    """Check whether `wsl --import` can read the payload straight from where it is."""
+    return os.path.isfile(src_path) and os.access(src_path, os.R_OK)
+
+
+def _try_hardlink(src_path, dest_path):
+    """Hardlink the payload when source and destination share a filesystem."""
+    try:
+        os.link(src_path, dest_path)
+        return True
+    except (OSError, AttributeError, NotImplementedError):
+        return False
+
+
+def _try_reflink(src, dst):
+    """Ask the filesystem for a copy-on-write clone of the whole file."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _kernel_copy(src, dst, size):
+    """Copy inside the kernel with copy_file_range, falling back to sendfile.
+
+    Returns the number of bytes copied; anything short of `size` is left for
+    the caller to stream, with both files positioned at that offset.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    sendfile = getattr(os, "sendfile", None)
+    offset = 0
+    for copy_func in (copy_file_range, sendfile):
+        if copy_func is None:
+            continue
+        # copy_file_range is given explicit offsets and never moves dst's position, but sendfile
+        # writes at it: resume the next method exactly where the previous one stopped.
+        dst.seek(offset)
+        try:
+            while offset < size:
+                if copy_func is copy_file_range:
+                    sent = copy_func(src.fileno(), dst.fileno(), min(size - offset, 1 << 30), offset, offset)
+                else:
+                    sent = copy_func(dst.fileno(), src.fileno(), offset, min(size - offset, 1 << 30))
+                if sent == 0:
+                    break
+                offset += sent
+            if offset == size:
+                return offset
+        except OSError:
+            # Not supported for this pair of files; let the next method pick up where we stopped.
+            pass
+    if offset:
+        src.seek(offset)
+        dst.seek(offset)
+    return offset
+
+
+def chunked_copy(src, dst, chunk_size=CHUNK_SIZE, on_chunk=None):
+    """Stream `src` into `dst` through one reusable buffer of `chunk_size` bytes."""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        read = src.readinto(buffer)
+        if not read:
+            break
+        dst.write(view[:read])
+        if on_chunk is not None:
+            on_chunk(view[:read])
+        total += read
+    return total
+
+
+def stage_payload(src_path, dest_path=None):
+    """Make the payload available for import without buffering it in memory.
+
+    With no `dest_path` the payload is imported in place and no bytes are
+    copied. Otherwise the cheapest available strategy is used: hardlink,
+    reflink, kernel-side copy, then bounded chunked streaming.
+    """
+    if not os.path.exists(src_path):
+        raise FileNotFoundError(src_path)
+
+    if dest_path is None or os.path.abspath(dest_path) == os.path.abspath(src_path):
+        if not can_import_in_place(src_path):
+            raise PermissionError(f"Payload {src_path} is not readable")
+        logging.info(f"Importing payload in place from {src_path}")
+        return src_path
+
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+
+    if _try_hardlink(src_path, dest_path):
+        logging.info(f"Hardlinked payload {src_path} -> {dest_path}")
+        return dest_path
+
+    size = os.path.getsize(src_path)
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dst:
+        if _try_reflink(src, dst):
+            logging.info(f"Reflinked payload {src_path} -> {dest_path}")
+            return dest_path
+        copied = _kernel_copy(src, dst, size)
+        if copied < size:
+            chunked_copy(src, dst)
+    shutil.copystat(src_path, dest_path)
+    if copied == size:
+        logging.info(f"Copied payload in kernel {src_path} -> {dest_path}")
+    else:
+        logging.info(f"Streamed payload {src_path} -> {dest_path}")
+    return dest_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(stage_payload(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from payload_container import PayloadMember, open_payload, stat_payload, payload_name
+from wsl_config import PAYLOAD_PUBLIC_KEY
+
+# Leaves of the tree hash; large enough that hashlib runs without the GIL most of the time.
+TREE_CHUNK_SIZE = 4 * 1024 * 1024
+ALGORITHM = "sha256-tree"
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+# Sidecar for payloads shipped as plain files; container members carry it in the index.
+SIDECAR_SUFFIX = ".verify.json"
+
+
+class PayloadCorruptError(ValueError):
+    pass
+
+
+class SignatureError(PayloadCorruptError):
+    pass
+
+
+def _leaf_digest(chunk):
+    return hashlib.sha256(chunk).digest()
+
+
+def root_digest(leaves):
+    """Combine leaf digests (bytes) into the payload's content digest."""
+    return hashlib.sha256(b"".join(leaves)).hexdigest()
+
+
+class TreeHasher:
+    """Hash a stream in fixed-size leaves on a thread pool, optionally checking each leaf as it completes.
+
+    At most `2 * max_workers` leaves are in flight, so memory stays bounded
+    no matter how large the payload is.
+    """
+
+    def __init__(self, expected=None, chunk_size=TREE_CHUNK_SIZE, max_workers=MAX_WORKERS, label="payload"):
+        self.expected = expected
+        self.chunk_size = expected["chunk_size"] if expected else chunk_size
+        self.label = label
+        self.size = 0
+        self.leaves = []
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._max_pending = 2 * max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tree-hash")
+        self._root = None
+        self._error = None
+
+    def update(self, data):
+        self.size += len(data)
+        if self.expected is not None and self.size > self.expected["size"]:
+            self._fail(f"{self.label} is larger than the {self.expected['size']} bytes in its manifest")
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        self._collect(block=len(self._pending) > self._max_pending)
+
+    def _submit(self, chunk):
+        self._pending.append(self._pool.submit(_leaf_digest, chunk))
+
+    def _collect(self, block=False):
+        """Record finished leaves in order; a mismatch raises as soon as that leaf is hashed."""
+        while self._pending and (block or self._pending[0].done()):
+            block = False
+            digest = self._pending.popleft().result()
+            index = len(self.leaves)
+            if self.expected is not None:
+                leaves = self.expected["leaves"]
+                if index >= len(leaves) or leaves[index] != digest.hex():
+                    self._fail(f"{self.label} is corrupt: chunk {index} "
+                               f"(bytes {index * self.chunk_size}-{(index + 1) * self.chunk_size}) does not match")
+            self.leaves.append(digest)
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def _fail(self, message):
+        self.close()
+        self._error = PayloadCorruptError(message)
+        raise self._error
+
+    def finish(self):
+        """Hash the tail, check the totals and return the root digest (hex)."""
+        if self._error is not None:
+            # Raised on a feeder thread earlier; report it to whoever finishes the import.
+            raise self._error
+        if self._root is not None:
+            return self._root
+        if self._buffer or not self.leaves and not self._pending:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._collect(block=True)
+        self.close()
+        root = root_digest(self.leaves)
+        if self.expected is not None:
+            if self.size != self.expected["size"]:
+                self._fail(f"{self.label} is truncated: {self.size} of {self.expected['size']} bytes")
+            if root != self.expected["root"]:
+                self._fail(f"{self.label} root digest {root} does not match its manifest")
+        self._root = root
+        return root
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pool.shutdown(wait=False)
+
+
+class VerifyingReader:
+    """Pass reads through from `source` while feeding the same bytes to a TreeHasher.
+
+    Wrap the raw payload (compressed or not) before it reaches the
+    decompressor or `wsl --import`, so verification costs no extra I/O.
+    """
+
+    def __init__(self, source, hasher):
+        self.source = source
+        self.hasher = hasher
+        self.root = None
+
+    def readinto(self, buffer):
+        read = self.source.readinto(buffer)
+        if read:
+            self.hasher.update(memoryview(buffer)[:read])
+        elif self.root is None:
+            self.root = self.hasher.finish()
+        return read
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data:
+            self.hasher.update(data)
+        elif self.root is None and size != 0:
+            self.root = self.hasher.finish()
+        return data
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self.source.closed
+
+    def close(self):
+        self.hasher.close()
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def tree_digest(path, max_workers=MAX_WORKERS):
+    """Tree hash of a payload file or container member, read once in leaf-sized chunks."""
+    hasher = TreeHasher(max_workers=max_workers)
+    with open_payload(path) as f:
+        for chunk in iter(lambda: f.read(TREE_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.finish()
+
+
+def _signed_bytes(manifest):
+    fields = {key: manifest[key] for key in ("name", "size", "chunk_size", "algorithm", "leaves", "root")}
+    return json.dumps(fields, sort_keys=True, separators=(",", ":")).encode()
+
+
+def sign_manifest(manifest, private_key_pem):
+    """Build time: attach an Ed25519 signature (needs the `cryptography` package)."""
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    key = load_pem_private_key(private_key_pem, password=None)
+    manifest["signature"] = key.sign(_signed_bytes(manifest)).hex()
+    return manifest
+
+
+def check_release_signing(private_key_pem, public_key_hex=PAYLOAD_PUBLIC_KEY):
+    """Build time: raise SignatureError unless release builds will accept what this key signs.
+
+    Packaging calls this first, so a missing key fails the build rather than
+    every import on end-user machines.
+    """
+    if not public_key_hex:
+        raise SignatureError("PAYLOAD_PUBLIC_KEY is not set in wsl_config.py, so release builds would refuse "
+                             "every payload; set it, or pass --unsigned for a development payload")
+    if private_key_pem is None:
+        raise SignatureError("No --signing-key given, so release builds would refuse this payload; "
+                             "pass one, or --unsigned for a development payload")
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat, load_pem_private_key
+    public = load_pem_private_key(private_key_pem, password=None).public_key()
+    if public.public_bytes(Encoding.Raw, PublicFormat.Raw).hex() != public_key_hex.lower():
+        raise SignatureError("--signing-key does not match PAYLOAD_PUBLIC_KEY in wsl_config.py")
+
+
+def is_release_build():
+    """PyInstaller builds are what ships; running from source is development."""
+    return bool(getattr(sys, "frozen", False))
+
+
+def check_signature(manifest, public_key_hex=PAYLOAD_PUBLIC_KEY, require=None):
+    """Verify the manifest signature against the configured public key.
+
+    Release builds (`require`, by default) refuse manifests they cannot check,
+    including when no key was configured before building; running from
+    source without a key only checks hashes.
+    """
+    require = is_release_build() if require is None else require
+    if not public_key_hex:
+        if require:
+            raise SignatureError(f"Refusing {manifest['name']}: this release build has no PAYLOAD_PUBLIC_KEY "
+                                 f"to check its signature against (set it in wsl_config.py before building)")
+        logging.warning(f"No payload public key configured; checking {manifest['name']} against its unsigned manifest")
+        return False
+    if "signature" not in manifest:
+        raise SignatureError(f"Manifest for {manifest['name']} is not signed")
+    try:
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+    except ImportError:
+        raise RuntimeError("Checking signed payloads needs `pip install cryptography`")
+    key = Ed25519PublicKey.from_public_bytes(bytes.fromhex(public_key_hex))
+    try:
+        key.verify(bytes.fromhex(manifest["signature"]), _signed_bytes(manifest))
+    except InvalidSignature:
+        raise SignatureError(f"Manifest signature for {manifest['name']} is invalid")
+    return True
+
+
+def build_manifest(name, hasher):
+    """Turn a finished TreeHasher into a manifest dict."""
+    root = hasher.finish()
+    return {
+        "name": name,
+        "size": hasher.size,
+        "chunk_size": hasher.chunk_size,
+        "algorithm": ALGORITHM,
+        "leaves": [leaf.hex() for leaf in hasher.leaves],
+        "root": root,
+    }
+
+
+def embedding_hooks(signing_key=None):
+    """`on_chunk` and `attributes` callbacks for payload_container.append_members.
+
+    Each member's manifest is hashed from the bytes being appended and stored
+    in the container index under "verify".
+    """
+    hashers = {}
+
+    def on_chunk(name, chunk):
+        # Not setdefault: that would build (and leak) a TreeHasher and its thread pool per chunk.
+        if name not in hashers:
+            hashers[name] = TreeHasher()
+        hashers[name].update(chunk)
+
+    def attributes(name):
+        manifest = build_manifest(name, hashers.pop(name, None) or TreeHasher())
+        if signing_key is not None:
+            sign_manifest(manifest, signing_key)
+        return {"verify": manifest}
+
+    return on_chunk, attributes
+
+
+def _read_manifest(payload):
+    if isinstance(payload, PayloadMember):
+        return payload.attributes.get("verify")
+    try:
+        with open(payload + SIDECAR_SUFFIX) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def shipped_root(payload):
+    """Root digest of the manifest a payload shipped with, or None; identifies the build, nothing is checked."""
+    manifest = _read_manifest(payload)
+    if manifest is None or manifest.get("algorithm") != ALGORITHM:
+        return None
+    return manifest.get("root")
+
+
+def load_manifest_for(payload):
+    """Return the verified-signature manifest for a payload, or None if it shipped without one.
+
+    Release builds raise SignatureError instead of returning None or an unsigned manifest.
+    """
+    manifest = _read_manifest(payload)
+    if manifest is None:
+        if is_release_build():
+            raise SignatureError(f"{payload_name(payload)} has no signed manifest; release builds refuse it")
+        return None
+    if manifest.get("algorithm") != ALGORITHM:
+        raise PayloadCorruptError(f"Unsupported manifest algorithm {manifest.get('algorithm')}")
+    check_signature(manifest)
+    return manifest
+
+
+def open_verified(payload, manifest):
+    """Open a payload through a VerifyingReader; truncation is caught before any byte is read."""
+    size = stat_payload(payload)[0]
+    if size != manifest["size"]:
+        raise PayloadCorruptError(
+            f"{payload_name(payload)} is {size} bytes but its manifest expects {manifest['size']} (truncated download?)")
+    return VerifyingReader(open_payload(payload), TreeHasher(manifest, label=payload_name(payload)))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Create or check payload verification manifests.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("manifest", help=f"write <payload>{SIDECAR_SUFFIX} for a plain payload file")
+    create.add_argument("payload")
+    create.add_argument("--signing-key", help="Ed25519 private key (PEM) to sign the manifest with")
+    create.add_argument("--unsigned", action="store_true", help="development payload; release builds refuse it")
+    check = commands.add_parser("check", help="verify a payload file against its sidecar manifest")
+    check.add_argument("payload")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "manifest":
+        signing_key = None
+        if args.signing_key:
+            with open(args.signing_key, "rb") as f:
+                signing_key = f.read()
+        if not args.unsigned:
+            try:
+                check_release_signing(signing_key)
+            except SignatureError as e:
+                parser.error(str(e))
+        hasher = TreeHasher()
+        with open(args.payload, "rb") as f:
+            for chunk in iter(lambda: f.read(TREE_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        manifest = build_manifest(os.path.basename(args.payload), hasher)
+        if signing_key is not None:
+            sign_manifest(manifest, signing_key)
+        with open(args.payload + SIDECAR_SUFFIX, "w") as f:
+            json.dump(manifest, f)
+        print(manifest["root"])
+    else:
+        manifest = load_manifest_for(args.payload)
+        if manifest is None:
+            sys.exit(f"No {SIDECAR_SUFFIX} manifest next to {args.payload}")
+        with open_verified(args.payload, manifest) as reader:
+            while reader.read(TREE_CHUNK_SIZE):
+                pass
+        print(reader.root)
+
+
+if __name__ == "__main__":
+    main()
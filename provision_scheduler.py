@@ -0,0 +1,179 @@
+import time
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from wsl_session import WslSession, CommandResult
+
+# Steps that failed or were skipped because a dependency failed.
+FAILED = "failed"
+SKIPPED = "skipped"
+SUCCEEDED = "succeeded"
+
+# Callable steps parse their queries' output, so keep more of it than the default tail.
+QUERY_TAIL_LINES = 10000
+
+
+@dataclass
+class Step:
+    """One provisioning command and the steps that must succeed before it.
+
+    `command` is either a shell command or a callable taking a
+    `run_command(command)` function and returning a CommandResult, for steps
+    that decide what to run from the output of an earlier query.
+    """
+    name: str
+    command: object
+    deps: tuple = ()
+    timeout: float = None
+    description: str = None
+
+    def __post_init__(self):
+        if self.description is None:
+            self.description = self.command if isinstance(self.command, str) else self.name
+
+
+@dataclass
+class ScheduleReport:
+    results: dict = field(default_factory=dict)
+    status: dict = field(default_factory=dict)
+    started_at: dict = field(default_factory=dict)
+    critical_path: list = field(default_factory=list)
+    wall_time: float = 0.0
+
+    @property
+    def ok(self):
+        return all(state == SUCCEEDED for state in self.status.values())
+
+
+def _check_graph(steps):
+    """Reject unknown dependencies and cycles before anything runs."""
+    by_name = {step.name: step for step in steps}
+    if len(by_name) != len(steps):
+        raise ValueError("Step names must be unique")
+    for step in steps:
+        for dep in step.deps:
+            if dep not in by_name:
+                raise ValueError(f"Step '{step.name}' depends on unknown step '{dep}'")
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through step '{name}'")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for step in steps:
+        visit(step.name)
+    return by_name
+
+
+def critical_path(steps, results):
+    """Longest chain of dependent steps by measured duration."""
+    by_name = {step.name: step for step in steps}
+    memo = {}
+
+    def chain(name):
+        if name not in memo:
+            result = results.get(name)
+            own = result.duration if result is not None else 0.0
+            best = max((chain(dep) for dep in by_name[name].deps), key=lambda c: c[0], default=(0.0, []))
+            memo[name] = (best[0] + own, best[1] + [name])
+        return memo[name]
+
+    if not steps:
+        return []
+    return max((chain(step.name) for step in steps), key=lambda c: c[0])[1]
+
+
+def session_runner(instance_name, sudo_password=None, argv=None, sinks_for_step=None):
+    """Build a runner giving every worker thread its own persistent WSL session.
+
+    `sinks_for_step(step)` may return output sinks that receive the step's
+    lines as they are produced.
+    """
+    local = threading.local()
+    sessions = []
+
+    def run(step):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = WslSession(instance_name, argv=argv, sudo_password=sudo_password)
+            session.start()
+            sessions.append(session)
+        sinks = sinks_for_step(step) if sinks_for_step is not None else ()
+        if callable(step.command):
+            return step.command(lambda command: session.run(command, timeout=step.timeout, sinks=sinks,
+                                                            tail_lines=QUERY_TAIL_LINES))
+        return session.run(step.command, timeout=step.timeout, sinks=sinks)
+
+    run.close = lambda: [session.close() for session in sessions]
+    return run
+
+
+async def _run_async(steps, runner, max_parallel, on_step_done):
+    by_name = _check_graph(steps)
+    report = ScheduleReport()
+    done_events = {step.name: asyncio.Event() for step in steps}
+    semaphore = asyncio.Semaphore(max_parallel)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="provision")
+    parent_span = tracing.current_span()
+
+    def traced_runner(step):
+        with tracing.span(f"step {step.name}", parent=parent_span, command=step.description) as span:
+            result = runner(step)
+            span.set("exit_code", result.exit_code)
+            span.set("stdout_tail_bytes", len(result.stdout))
+            span.set("stderr_tail_bytes", len(result.stderr))
+            if result.exit_code != 0:
+                span.error = f"exit code {result.exit_code}"
+            return result
+
+    async def run_step(step):
+        for dep in step.deps:
+            await done_events[dep].wait()
+        failed_deps = [dep for dep in step.deps if report.status[dep] != SUCCEEDED]
+        if failed_deps:
+            report.status[step.name] = SKIPPED
+            logging.warning(f"Skipping step '{step.name}': dependency {failed_deps} did not succeed")
+        else:
+            async with semaphore:
+                report.started_at[step.name] = time.monotonic()
+                logging.info(f"Starting step '{step.name}': {step.description}")
+                try:
+                    result = await loop.run_in_executor(executor, traced_runner, step)
+                except Exception as e:
+                    result = CommandResult(step.description, "", str(e), -1, time.monotonic() - report.started_at[step.name])
+                report.results[step.name] = result
+                report.status[step.name] = SUCCEEDED if result.exit_code == 0 else FAILED
+                logging.info(f"Step '{step.name}' {report.status[step.name]} in {result.duration:.2f}s")
+        if on_step_done is not None:
+            on_step_done(step, report.status[step.name], report.results.get(step.name))
+        done_events[step.name].set()
+
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(run_step(step) for step in by_name.values()))
+    finally:
+        executor.shutdown(wait=True)
+    report.wall_time = time.monotonic() - started
+    report.critical_path = critical_path(steps, report.results)
+    return report
+
+
+def run_steps(steps, runner, max_parallel=2, on_step_done=None):
+    """Run steps as soon as their dependencies succeed, at most `max_parallel` at a time.
+
+    `runner(step)` is called on a worker thread and returns a CommandResult.
+    Dependents of a failed step are skipped, independent branches keep going.
+    """
+    return asyncio.run(_run_async(list(steps), runner, max_parallel, on_step_done))
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import tracing
+
+# The web UI is the angular_todo container. The backend's ports live in /usr/backend's compose
+# file inside the distro; the installer reports them once the stack is up (see backend_services),
+# and CLOUDBOOK_BACKEND_URL overrides them.
+DEFAULT_SERVICES = {"frontend": os.environ.get("CLOUDBOOK_FRONTEND_URL", "http://localhost:9000/")}
+if os.environ.get("CLOUDBOOK_BACKEND_URL"):
+    DEFAULT_SERVICES["backend"] = os.environ["CLOUDBOOK_BACKEND_URL"]
+DEFAULT_DEADLINE = 180.0
+BASE_DELAY = 0.1
+MAX_DELAY = 2.0
+PROBE_TIMEOUT = 2.0
+
+WAITING = "waiting"
+READY = "ready"
+TIMED_OUT = "timed out"
+
+
+@dataclass
+class ReadinessResult:
+    ready_after: dict = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def all_ready(self):
+        return all(seconds is not None for seconds in self.ready_after.values())
+
+
+async def probe(url, timeout=PROBE_TIMEOUT):
+    """Send one GET and return the HTTP status code; raises OSError while nothing is listening."""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    path = parts.path or "/"
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=parts.scheme == "https"), timeout
+    )
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    fields = status_line.split()
+    if len(fields) < 2 or not fields[0].startswith(b"HTTP/"):
+        raise ConnectionError(f"Unexpected response from {url}: {status_line!r}")
+    return int(fields[1])
+
+
+def backend_services(published, host="localhost"):
+    """Readiness URLs for the backend stack's published (service, host port) pairs.
+
+    Only ports compose publishes on the host show up here; databases and
+    other internals normally stay on the stack's own network.
+    """
+    services = {}
+    for service, port in published:
+        name = "backend" if len(published) == 1 else f"backend {service}"
+        services[name] = f"http://{host}:{port}/"
+    return services
+
+
+async def wait_for_service(name, url, deadline, on_status=None):
+    """Poll `url` with jittered exponential backoff until it answers below 500 or `deadline` passes."""
+    started = time.monotonic()
+    delay = BASE_DELAY
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            status = await probe(url, min(PROBE_TIMEOUT, max(deadline - time.monotonic(), 0.01)))
+            if status < 500:
+                elapsed = time.monotonic() - started
+                logging.info(f"{name} ready at {url} (HTTP {status}) after {elapsed:.2f}s, {attempt} attempts")
+                if on_status is not None:
+                    on_status(name, READY, f"HTTP {status}")
+                return elapsed
+            detail = f"HTTP {status}"
+        except (OSError, asyncio.TimeoutError) as e:
+            detail = type(e).__name__
+        if on_status is not None:
+            on_status(name, WAITING, detail)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.warning(f"{name} not ready at {url} before the deadline ({detail})")
+            if on_status is not None:
+                on_status(name, TIMED_OUT, detail)
+            return None
+        # Full jitter keeps many clients (or services) from polling in lockstep.
+        await asyncio.sleep(min(random.uniform(0, delay), remaining))
+        delay = min(delay * 2, MAX_DELAY)
+
+
+async def wait_until_ready_async(services=None, timeout=DEFAULT_DEADLINE, on_status=None):
+    services = services or DEFAULT_SERVICES
+    started = time.monotonic()
+    deadline = started + timeout
+    names = list(services)
+    results = await asyncio.gather(*(wait_for_service(name, services[name], deadline, on_status) for name in names))
+    return ReadinessResult(dict(zip(names, results)), time.monotonic() - started)
+
+
+@tracing.traced
+def wait_until_ready(services=None, timeout=DEFAULT_DEADLINE, on_status=None):
+    """Block until every service answers over HTTP or the overall deadline passes."""
+    return asyncio.run(wait_until_ready_async(services, timeout, on_status))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    urls = sys.argv[1:]
+    services = {url: url for url in urls} if urls else None
+    print(wait_until_ready(services, timeout=30, on_status=lambda *status: print(*status)))
@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import heapq
+import fnmatch
+import hashlib
+import logging
+import tarfile
+import statistics
+from collections import defaultdict, namedtuple
+
+from import_progress import IMPORT_RUNS_FILE
+
+# Streaming analysis of an exported rootfs tar: largest files, per-directory totals, duplicate
+# contents and known junk, optionally writing a slimmed copy in the same pass. The tar is read
+# once in stream mode, so nothing is extracted; memory grows with the number of large files and
+# removed paths (a digest or a path each), never with their contents.
+TOP_PATHS = 25
+DIRECTORY_DEPTH = 3
+# Smaller files are not hashed for duplicate detection; they are many and save little.
+MIN_DUPLICATE_SIZE = 64 * 1024
+# Paths kept per duplicate group in the report.
+DUPLICATE_PATHS_SHOWN = 5
+COPY_BUFFER_SIZE = 1024 * 1024
+
+JunkPattern = namedtuple("JunkPattern", "name patterns removable hint")
+
+# Patterns match member paths without the leading "./"; `*` also matches "/". Directories are
+# never removed, so services that expect e.g. /var/log/nginx to exist still start.
+JUNK_PATTERNS = [
+    JunkPattern("apt package lists", ("var/lib/apt/lists/*",), True, "recreated by `apt-get update`"),
+    JunkPattern("apt package cache", ("var/cache/apt/*",), True, "downloaded .debs and package caches"),
+    JunkPattern("logs", ("var/log/*",), True, "logs from the build distro"),
+    JunkPattern("temporary files", ("tmp/*", "var/tmp/*"), True, "cleared on boot anyway"),
+    JunkPattern("user caches", ("root/.cache/*", "home/*/.cache/*", "root/.npm/*", "home/*/.npm/*"), True,
+                "pip, npm and other per-user caches"),
+    JunkPattern("python bytecode", ("*/__pycache__/*",), True, "regenerated on first import"),
+    JunkPattern("shell history", ("root/.bash_history", "home/*/.bash_history"), True,
+                "developer shell history"),
+    JunkPattern("docker build cache", ("var/lib/docker/buildkit/*",), False,
+                "run `docker builder prune -af` in the distro before exporting; removing it here "
+                "would leave docker's metadata pointing at missing files"),
+    JunkPattern("documentation", ("usr/share/doc/*", "usr/share/man/*", "usr/share/info/*"), False,
+                "can be excluded with dpkg path-exclude rules in the build distro"),
+]
+
+
+def member_path(name):
+    """Tar member name without the leading "./" or "/" exported tars use."""
+    while name.startswith(("./", "/")):
+        name = name[1:] if name.startswith("/") else name[2:]
+    return name
+
+
+def match_junk(path, patterns=JUNK_PATTERNS):
+    for junk in patterns:
+        if any(fnmatch.fnmatchcase(path, pattern) for pattern in junk.patterns):
+            return junk
+    return None
+
+
+def custom_patterns(excludes):
+    """Extra removable patterns from the command line, e.g. "usr/backend/node_modules/*"."""
+    return [JunkPattern(f"--exclude {pattern}", (pattern,), True, "excluded on the command line")
+            for pattern in excludes]
+
+
+class _HashingReader:
+    """Pass a member's data through while hashing it, so copying and hashing share one read."""
+
+    def __init__(self, source):
+        self.source = source
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.digest.update(data)
+        return data
+
+
+class RootfsReport:
+    """Running totals for one pass over the tar.
+
+    Everything but duplicate detection is bounded by the report sizes. For
+    duplicates, the first large file of each size is remembered as a digest
+    and path; a group is only built once a size repeats.
+    """
+
+    def __init__(self, top=TOP_PATHS, depth=DIRECTORY_DEPTH, min_duplicate_size=MIN_DUPLICATE_SIZE):
+        self.top = top
+        self.depth = depth
+        self.min_duplicate_size = min_duplicate_size
+        self.members = 0
+        self.files = 0
+        self.total_bytes = 0
+        self.largest = []
+        self.directories = defaultdict(int)
+        self.junk = defaultdict(lambda: {"files": 0, "bytes": 0})
+        self.removed = {"files": 0, "bytes": 0}
+        self._first_of_size = {}
+        self._groups = {}
+
+    def add(self, path, member, digest=None):
+        self.members += 1
+        if not member.isfile():
+            return
+        self.files += 1
+        self.total_bytes += member.size
+        entry = (member.size, path)
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, entry)
+        elif entry > self.largest[0]:
+            heapq.heapreplace(self.largest, entry)
+        parts = path.split("/")[:-1]
+        for depth in range(min(len(parts), self.depth)):
+            self.directories["/".join(parts[:depth + 1])] += member.size
+        if digest is not None:
+            first = self._first_of_size.get(member.size)
+            if first is None:
+                self._first_of_size[member.size] = (digest, path)
+                return
+            group = self._groups.get(digest)
+            if group is None:
+                group = self._groups[digest] = [member.size, 1, [first[1]]] if digest == first[0] else \
+                    [member.size, 0, []]
+            group[1] += 1
+            if len(group[2]) < DUPLICATE_PATHS_SHOWN:
+                group[2].append(path)
+
+    def add_junk(self, junk, member, removed):
+        self.junk[junk.name]["files"] += 1
+        self.junk[junk.name]["bytes"] += member.size
+        if removed:
+            self.removed["files"] += 1
+            self.removed["bytes"] += member.size
+
+    def duplicate_groups(self):
+        groups = [
+            {"size": size, "copies": count, "wasted_bytes": size * (count - 1), "paths": paths}
+            for size, count, paths in self._groups.values() if count > 1
+        ]
+        groups.sort(key=lambda group: group["wasted_bytes"], reverse=True)
+        return groups[:self.top]
+
+    def to_dict(self, patterns=JUNK_PATTERNS):
+        by_name = {junk.name: junk for junk in patterns}
+        directories = sorted(self.directories.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "members": self.members,
+            "files": self.files,
+            "total_bytes": self.total_bytes,
+            "largest": [{"path": path, "bytes": size} for size, path in sorted(self.largest, reverse=True)],
+            "directories": [{"path": path, "bytes": size} for path, size in directories[:self.top]],
+            "duplicates": self.duplicate_groups(),
+            "junk": [dict(stats, name=name, removable=by_name[name].removable, hint=by_name[name].hint)
+                     for name, stats in sorted(self.junk.items(), key=lambda item: item[1]["bytes"], reverse=True)],
+            "removed": dict(self.removed),
+        }
+
+
+def _relink(member, linkname):
+    member.linkname = linkname
+    # A long original target is stored in the pax header, which would win over `linkname`.
+    member.pax_headers.pop("linkpath", None)
+
+
+def _restore_links(source, out, orphans, report):
+    """Second pass for kept hard links whose target was removed as junk.
+
+    The first link to each removed file is written as a regular file with
+    the target's data; further links to it point at that first link.
+    """
+    with tarfile.open(fileobj=source, mode="r|*") as tar:
+        for member in tar:
+            links = orphans.pop(member_path(member.name), None)
+            if links is None or not member.isfile():
+                continue
+            first = links[0]
+            first.type = tarfile.REGTYPE
+            _relink(first, "")
+            first.size = member.size
+            out.addfile(first, tar.extractfile(member))
+            report.add(member_path(first.name), first)
+            # The data is back in the tar under the link's name.
+            report.removed["bytes"] -= member.size
+            for link in links[1:]:
+                _relink(link, first.name)
+                out.addfile(link)
+                report.add(member_path(link.name), link)
+            if not orphans:
+                break
+    for links in orphans.values():
+        for link in links:
+            logging.warning(f"Dropping hard link {link.name}: its target {link.linkname} is not in the tar")
+
+
+def analyze(source, slim_output=None, patterns=JUNK_PATTERNS, find_duplicates=True, report=None, reopen=None):
+    """Read a tar stream once, returning a RootfsReport; with `slim_output`, also write the slimmed tar.
+
+    Removable junk (files, links and devices; never directories) is left out
+    of the slimmed tar. A kept hard link to removed junk becomes a regular
+    file holding the target's data; as the stream has moved past that data,
+    this takes a second read of the tar from `reopen()`, a function
+    returning a fresh stream of it. Without `reopen` (e.g. reading stdin)
+    such links are dropped with a warning.
+    """
+    report = report or RootfsReport()
+    # Removed path -> name of the member its data is stored under in the source tar.
+    removed_paths = {}
+    # Data path -> kept hard links to it, in tar order.
+    orphans = defaultdict(list)
+    with tarfile.open(fileobj=source, mode="r|*") as tar:
+        out = tarfile.open(fileobj=slim_output, mode="w|", format=tarfile.PAX_FORMAT) \
+            if slim_output is not None else None
+        try:
+            for member in tar:
+                path = member_path(member.name)
+                junk = match_junk(path, patterns) if not member.isdir() else None
+                remove = out is not None and junk is not None and junk.removable
+                if junk is not None:
+                    report.add_junk(junk, member, remove)
+                target = removed_paths.get(member_path(member.linkname)) if member.islnk() else None
+                if remove:
+                    # Where its data is stored: the file itself, or whatever the removed link pointed at.
+                    removed_paths[path] = target or (member.linkname if member.islnk() else member.name)
+                    continue
+                if target is not None:
+                    if member_path(target) in removed_paths:
+                        orphans[member_path(target)].append(member)
+                        continue
+                    # It went through a removed link to a file that is kept.
+                    _relink(member, target)
+                digest = None
+                if member.isfile() and (out is not None or
+                                        find_duplicates and member.size >= report.min_duplicate_size):
+                    reader = _HashingReader(tar.extractfile(member))
+                    if out is not None:
+                        out.addfile(member, reader)
+                    else:
+                        while reader.read(COPY_BUFFER_SIZE):
+                            pass
+                    if find_duplicates and member.size >= report.min_duplicate_size:
+                        digest = reader.digest.digest()
+                elif out is not None:
+                    out.addfile(member)
+                report.add(path, member, digest)
+            if orphans and reopen is None:
+                for links in orphans.values():
+                    for link in links:
+                        logging.warning(f"Dropping hard link {link.name}: its target {link.linkname} was removed "
+                                        f"and the tar cannot be read a second time")
+            elif orphans:
+                logging.info(f"Re-reading the tar for {len(orphans)} removed files that kept hard links point at")
+                with reopen() as second:
+                    _restore_links(second, out, orphans, report)
+        finally:
+            if out is not None:
+                out.close()
+    return report
+
+
+def typical_import_rate(path=IMPORT_RUNS_FILE):
+    """Median MB/s of recorded imports, to turn removed bytes into seconds saved; None without history."""
+    rates = []
+    try:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if not record.get("error") and record.get("average_mb_per_s"):
+                    rates.append(record["average_mb_per_s"])
+    except (OSError, ValueError):
+        return None
+    return statistics.median(rates[-20:]) if rates else None
+
+
+def _size(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+def format_report(data, import_rate=None):
+    lines = [f"{data['files']} files, {_size(data['total_bytes'])} in {data['members']} members", "",
+             "Largest files:"]
+    lines += [f"  {_size(item['bytes']):>10}  {item['path']}" for item in data["largest"]]
+    lines += ["", "Largest directories:"]
+    lines += [f"  {_size(item['bytes']):>10}  {item['path']}/" for item in data["directories"]]
+    if data["duplicates"]:
+        lines += ["", "Duplicate contents (wasted / copies):"]
+        for group in data["duplicates"]:
+            lines.append(f"  {_size(group['wasted_bytes']):>10}  {group['copies']} x {_size(group['size'])}: "
+                         f"{', '.join(group['paths'])}")
+    lines += ["", "Known junk:"]
+    for junk in data["junk"]:
+        action = "removable" if junk["removable"] else "report only"
+        lines.append(f"  {_size(junk['bytes']):>10}  {junk['name']} ({junk['files']} files, {action}): {junk['hint']}")
+    removed = data["removed"]
+    if removed["files"]:
+        saved = f"Removed {removed['files']} files, {_size(removed['bytes'])} " \
+                f"({100.0 * removed['bytes'] / max(data['total_bytes'] + removed['bytes'], 1):.1f}%)"
+        if import_rate:
+            saved += f", about {removed['bytes'] / 1e6 / import_rate:.0f}s less import time at {import_rate} MB/s"
+        lines += ["", saved]
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Report what takes space in an exported rootfs tar and optionally write a slimmed copy.")
+    parser.add_argument("tar", help="rootfs tar (.tar, .tar.xz, .tar.zst) or '-' for stdin")
+    parser.add_argument("--slim", metavar="OUTPUT", help="write the tar without removable junk ('-' for stdout)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="PATTERN",
+                        help='also remove members matching PATTERN, e.g. "usr/backend/node_modules/*"')
+    parser.add_argument("--top", type=int, default=TOP_PATHS, help="entries per report section")
+    parser.add_argument("--depth", type=int, default=DIRECTORY_DEPTH, help="directory depth for the totals")
+    parser.add_argument("--min-duplicate-size", type=int, default=MIN_DUPLICATE_SIZE,
+                        help="only hash files at least this many bytes for duplicate detection")
+    parser.add_argument("--no-duplicates", action="store_true", help="skip hashing (faster)")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.tar == "-":
+        source = sys.stdin.buffer
+    else:
+        from compressed_import import open_decompressed
+        source = open_decompressed(args.tar)
+    slim_output = None
+    if args.slim == "-":
+        slim_output = sys.stdout.buffer
+    elif args.slim:
+        slim_output = open(args.slim + ".partial", "wb")
+    report = RootfsReport(args.top, args.depth, args.min_duplicate_size)
+    # The first matching pattern wins, so explicit excludes override report-only defaults.
+    patterns = custom_patterns(args.exclude) + JUNK_PATTERNS
+    try:
+        with source:
+            analyze(source, slim_output, patterns, not args.no_duplicates, report,
+                    reopen=None if args.tar == "-" else lambda: open_decompressed(args.tar))
+    except BaseException:
+        if args.slim and args.slim != "-":
+            slim_output.close()
+            os.remove(args.slim + ".partial")
+        raise
+    if args.slim and args.slim != "-":
+        slim_output.close()
+        os.replace(args.slim + ".partial", args.slim)
+
+    data = report.to_dict(patterns)
+    # With the slimmed tar on stdout, the text report goes to stderr.
+    print(format_report(data, typical_import_rate()), file=sys.stderr if args.slim == "-" else sys.stdout)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(data, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import sys
+import json
+import hashlib
+import logging
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+import payload_cache
+from payload_container import payload_name, list_members
+from payload_verify import shipped_root
+from wsl_config import WSL_EXE, PAYLOAD_NAME
+
+DELTA_MANIFEST_NAME = ".cloudbook-delta.json"
+DELTA_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+# Changed files are spooled here while hashing; larger ones spill to a temp file.
+SPOOL_LIMIT = 16 * 1024 * 1024
+
+
+class BaseMismatchError(Exception):
+    """The instance was not imported from the payload the delta was built against."""
+
+
+def _normalize(name):
+    """Key tar members by path regardless of a leading './' or '/'."""
+    while name.startswith("./") or name.startswith("/"):
+        name = name[2:] if name.startswith("./") else name[1:]
+    return name.rstrip("/")
+
+
+def _metadata(member):
+    """The parts of a tar header that matter for the extracted rootfs."""
+    return [member.type.decode("latin-1"), member.mode, member.uid, member.gid, member.linkname,
+            member.devmajor, member.devminor]
+
+
+def _hash_stream(fileobj, spool=None):
+    """SHA-256 a member's data, optionally copying it into `spool` on the way."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        if spool is not None:
+            spool.write(chunk)
+    return digest.hexdigest()
+
+
+def index_rootfs(tar_path):
+    """Map every member of a rootfs tar to its metadata and content hash in one streaming pass."""
+    index = {}
+    with tarfile.open(tar_path, "r|*") as tar:
+        for member in tar:
+            entry = {"meta": _metadata(member), "size": member.size, "sha256": None}
+            if member.isreg():
+                entry["sha256"] = _hash_stream(tar.extractfile(member))
+            index[_normalize(member.name)] = entry
+    return index
+
+
+def shipped_digest(payload):
+    """The digest the installer records for a payload: its build root, or its tree hash."""
+    return shipped_root(payload) or payload_cache.full_digest(payload)
+
+
+def build_delta(base_tar, target_tar, delta_path, base_payload=None, target_payload=None):
+    """Write a delta archive turning the `base_tar` rootfs into `target_tar`.
+
+    The archive holds the added and changed members followed by a JSON
+    manifest listing removed paths and the digests of both payloads.
+    `base_payload` and `target_payload` are the payloads the installers
+    ship (compressed files or container members); the instance records
+    those, not the raw tars. Each defaults to its tar.
+    """
+    logging.info(f"Indexing base rootfs {base_tar}...")
+    base_index = index_rootfs(base_tar)
+    seen = set()
+    removed = []
+    stats = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0, "delta_bytes": 0}
+
+    with tarfile.open(delta_path, "w") as delta, tarfile.open(target_tar, "r|*") as target:
+        for member in target:
+            key = _normalize(member.name)
+            seen.add(key)
+            base_entry = base_index.get(key)
+            meta = _metadata(member)
+            if not member.isreg():
+                if base_entry is not None and base_entry["meta"] == meta:
+                    stats["unchanged"] += 1
+                    continue
+                if base_entry is not None and base_entry["meta"][0] != meta[0]:
+                    removed.append(key)
+                delta.addfile(member)
+                stats["added" if base_entry is None else "changed"] += 1
+                continue
+
+            with tempfile.SpooledTemporaryFile(SPOOL_LIMIT) as spool:
+                sha256 = _hash_stream(target.extractfile(member), spool)
+                if (base_entry is not None and base_entry["meta"] == meta
+                        and base_entry["sha256"] == sha256):
+                    stats["unchanged"] += 1
+                    continue
+                if base_entry is not None and base_entry["meta"][0] != meta[0]:
+                    removed.append(key)
+                spool.seek(0)
+                delta.addfile(member, spool)
+                stats["delta_bytes"] += member.size
+                stats["added" if base_entry is None else "changed"] += 1
+
+        removed.extend(sorted(key for key in base_index if key not in seen and key))
+        stats["removed"] = len(removed)
+
+        target_payload = target_payload or target_tar
+        target_fingerprint = payload_cache.quick_fingerprint(target_payload)
+        manifest = {
+            "version": DELTA_VERSION,
+            "base_digest": shipped_digest(base_payload or base_tar),
+            "target_digest": shipped_digest(target_payload),
+            "target_size": target_fingerprint["size"],
+            "target_sample": target_fingerprint["sample"],
+            "target_name": payload_name(target_payload),
+            "removed": removed,
+            "stats": stats,
+        }
+        data = json.dumps(manifest, indent=2).encode()
+        info = tarfile.TarInfo(DELTA_MANIFEST_NAME)
+        info.size = len(data)
+        with tempfile.SpooledTemporaryFile() as manifest_file:
+            manifest_file.write(data)
+            manifest_file.seek(0)
+            delta.addfile(info, manifest_file)
+
+    logging.info(f"Delta written to {delta_path}: {stats}")
+    return manifest
+
+
+def read_delta_manifest(delta_path):
+    """Return the manifest stored in a delta archive."""
+    with tarfile.open(delta_path, "r") as delta:
+        return json.load(delta.extractfile(DELTA_MANIFEST_NAME))
+
+
+def _run_in_instance(instance_name, script, feed):
+    """Run `script` as root inside the instance with `feed(stdin)` writing its input."""
+    command = [WSL_EXE, "-d", instance_name, "-u", "root", "--", "bash", "-c", script]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        feed(process.stdin)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def apply_delta(delta_path, instance_name):
+    """Apply a delta archive inside an already imported instance through `wsl -d`."""
+    manifest = read_delta_manifest(delta_path)
+    recorded = payload_cache.load_manifest(instance_name)
+    if recorded is None or recorded.get("digest") != manifest["base_digest"]:
+        raise BaseMismatchError(
+            f"Instance '{instance_name}' does not match delta base {manifest['base_digest']}"
+        )
+
+    removed = manifest["removed"]
+    if removed:
+        logging.info(f"Removing {len(removed)} paths from '{instance_name}'...")
+        payload = b"".join(path.encode("utf-8", "surrogateescape") + b"\0" for path in removed)
+        _run_in_instance(instance_name, "cd / && xargs -0 -r rm -rf --", lambda pipe: pipe.write(payload))
+
+    def feed_members(pipe):
+        with tarfile.open(delta_path, "r") as delta, tarfile.open(fileobj=pipe, mode="w|") as out:
+            for member in delta:
+                if member.name == DELTA_MANIFEST_NAME:
+                    continue
+                out.addfile(member, delta.extractfile(member) if member.isreg() else None)
+
+    logging.info(f"Extracting {manifest['stats']['added'] + manifest['stats']['changed']} members into '{instance_name}'...")
+    _run_in_instance(instance_name, "tar -xpf - -C / --numeric-owner", feed_members)
+
+    payload_cache.write_manifest(
+        instance_name,
+        delta_path,
+        digest=manifest["target_digest"],
+        fingerprint={"size": manifest["target_size"], "mtime_ns": None, "sample": manifest["target_sample"]},
+        # The instance now matches the payload the delta was built towards, not the delta file.
+        name=manifest.get("target_name", PAYLOAD_NAME),
+    )
+    logging.info(f"Delta applied to '{instance_name}': {manifest['stats']}")
+    return manifest
+
+
+def _payload_arg(value):
+    """A payload file, or `container:member` for one inside a payload container."""
+    if value is None:
+        return None
+    container, _, member = value.rpartition(":")
+    # A bare drive letter (C:\...) is part of a file path, not a container.
+    if len(container) > 1 and member:
+        return list_members(container)[member]
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or apply cloudbook rootfs deltas.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="diff two rootfs tars into a delta archive")
+    build.add_argument("base_tar")
+    build.add_argument("target_tar")
+    build.add_argument("delta_path")
+    build.add_argument("--base-payload", metavar="PATH[:MEMBER]",
+                       help="payload the base release shipped (default: base_tar)")
+    build.add_argument("--target-payload", metavar="PATH[:MEMBER]",
+                       help="payload shipping with this delta, e.g. the .tar.zst or a container member "
+                            "(default: target_tar)")
+    apply = commands.add_parser("apply", help="apply a delta archive to an imported instance")
+    apply.add_argument("delta_path")
+    apply.add_argument("instance_name")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "build":
+        manifest = build_delta(args.base_tar, args.target_tar, args.delta_path,
+                               _payload_arg(args.base_payload), _payload_arg(args.target_payload))
+    else:
+        manifest = apply_delta(args.delta_path, args.instance_name)
+    json.dump(manifest["stats"], sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import platform
+import secrets
+import statistics
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+
+# Every launch appends its run, stages and provisioning steps as JSON lines to RUN_STORE_FILE.
+# Beside it, an append-only index keeps one short tab-separated line per record (run id, kind,
+# stage, name, status, seconds and the record's offset), so the queries below read only the
+# index and seek into the store for the few records they print in full.
+RUN_STORE_FILE = "runs.jsonl"
+INDEX_SUFFIX = ".idx"
+# Error tails are cut to this many trailing lines and characters before they are stored.
+ERROR_TAIL_LINES = 20
+ERROR_TAIL_CHARS = 4000
+# A step is a regression when it takes this much longer than in the previous run...
+REGRESSION_FACTOR = 1.5
+# ...and at least this many seconds longer, so sub-second noise is not reported.
+REGRESSION_MIN_SECONDS = 1.0
+QUERY_RUNS = 20
+TOP_STEPS = 10
+
+RUN = "run"
+RUN_END = "run_end"
+STAGE = "stage"
+STEP = "step"
+
+IndexEntry = namedtuple("IndexEntry", "run_id kind stage name status seconds offset length")
+
+# Runs of several instances can finish steps at once; keep data and index lines in step.
+_store_lock = threading.Lock()
+_local = threading.local()
+
+
+def new_run_id():
+    """Sortable by start time, unique across machines whose stores are merged."""
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + secrets.token_hex(3)
+
+
+def error_tail(text, lines=ERROR_TAIL_LINES, chars=ERROR_TAIL_CHARS):
+    return "".join((text or "").splitlines(keepends=True)[-lines:])[-chars:]
+
+
+def _field(value):
+    return str(value if value is not None else "").replace("\t", " ").replace("\n", " ")
+
+
+def _index_line(entry):
+    seconds = "" if entry.seconds is None else f"{entry.seconds:.3f}"
+    return "\t".join([_field(entry.run_id), entry.kind, _field(entry.stage), _field(entry.name),
+                      _field(entry.status), seconds, str(entry.offset), str(entry.length)]) + "\n"
+
+
+def _parse_index_line(line):
+    run_id, kind, stage, name, status, seconds, offset, length = line.rstrip("\n").split("\t")
+    return IndexEntry(run_id, kind, stage or None, name or None, status or None,
+                      float(seconds) if seconds else None, int(offset), int(length))
+
+
+def _index_entry(record, offset, length):
+    # Run headers are indexed under their instance, which regressions compare runs by.
+    name = record.get("name", record.get("instance"))
+    return IndexEntry(record["run_id"], record["type"], record.get("stage"), name,
+                      record.get("status"), record.get("seconds"), offset, length)
+
+
+def append_record(record, path=RUN_STORE_FILE):
+    """Append one record to the store and its index line; failures are logged, never raised."""
+    data = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+    try:
+        with _store_lock, open(path, "ab") as store, open(path + INDEX_SUFFIX, "a", newline="\n") as index:
+            store.seek(0, os.SEEK_END)
+            offset = store.tell()
+            store.write(data)
+            index.write(_index_line(_index_entry(record, offset, len(data))))
+    except OSError as e:
+        logging.warning(f"Could not record run data in {path}: {e}")
+    return record
+
+
+class Run:
+    """One launch being recorded; stages and steps are appended as they finish."""
+
+    def __init__(self, path=RUN_STORE_FILE, **attributes):
+        self.path = path
+        self.run_id = new_run_id()
+        self.started = time.monotonic()
+        self.failed = 0
+        self._stage = threading.local()
+        append_record(dict({
+            "type": RUN,
+            "run_id": self.run_id,
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "host": socket.gethostname(),
+            "platform": platform.platform(),
+        }, **attributes), path)
+
+    @property
+    def current_stage(self):
+        return getattr(self._stage, "name", None)
+
+    def stage(self, name):
+        return _StageRecorder(self, name)
+
+    def record_step(self, name, command, status, result=None, stdout_bytes=None, stderr_bytes=None, stage=None):
+        """Record one finished step; `result` is its CommandResult, None when it was skipped.
+
+        Steps finishing on worker threads pass the `stage` their caller was in.
+        """
+        record = {"type": STEP, "run_id": self.run_id, "stage": stage or self.current_stage, "name": name,
+                  "command": command, "status": status}
+        if result is not None:
+            record.update({
+                "seconds": round(result.duration, 3),
+                "exit_code": result.exit_code,
+                "stdout_bytes": stdout_bytes if stdout_bytes is not None else len(result.stdout.encode()),
+                "stderr_bytes": stderr_bytes if stderr_bytes is not None else len(result.stderr.encode()),
+            })
+            if result.exit_code != 0:
+                record["error_tail"] = error_tail(result.stderr or result.stdout)
+        if status != "succeeded":
+            self.failed += 1
+        return append_record(record, self.path)
+
+    def finish(self, error=None):
+        return append_record({"type": RUN_END, "run_id": self.run_id,
+                              "status": "failed" if error or self.failed else "succeeded",
+                              "seconds": round(time.monotonic() - self.started, 3), "error": error}, self.path)
+
+
+class _StageRecorder:
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.outer = self.run.current_stage
+        self.run._stage.name = self.name
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.run._stage.name = self.outer
+        error = None if exc_type is None else f"{exc_type.__name__}: {exc}"
+        if exc_type is not None:
+            self.run.failed += 1
+        append_record({"type": STAGE, "run_id": self.run.run_id, "name": self.name,
+                       "status": "failed" if error else "succeeded",
+                       "seconds": round(time.monotonic() - self.started, 3), "error": error}, self.run.path)
+        return False
+
+
+def current_run():
+    """The run being recorded on this thread, or None."""
+    return getattr(_local, "run", None)
+
+
+class recording:
+    """Context manager recording a run for the code on this thread; yields the Run."""
+
+    def __init__(self, path=RUN_STORE_FILE, **attributes):
+        self.path = path
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.outer = current_run()
+        self.run = _local.run = Run(self.path, **self.attributes)
+        return self.run
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.run = self.outer
+        if exc_type is SystemExit:
+            error = f"exited with code {exc.code}"
+        else:
+            error = None if exc_type is None else f"{exc_type.__name__}: {exc}"
+        self.run.finish(error)
+        return False
+
+
+def read_index(path=RUN_STORE_FILE):
+    """All index entries in append order; a torn last line from a crash is skipped."""
+    entries = []
+    try:
+        with open(path + INDEX_SUFFIX, newline="\n") as f:
+            for line in f:
+                try:
+                    entries.append(_parse_index_line(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def rebuild_index(path=RUN_STORE_FILE):
+    """Rewrite the index from the store, e.g. after copying only runs.jsonl off a machine."""
+    entries = []
+    with open(path, "rb") as store:
+        offset = 0
+        for line in store:
+            try:
+                entries.append(_index_entry(json.loads(line), offset, len(line)))
+            except (ValueError, KeyError):
+                pass
+            offset += len(line)
+    with open(path + INDEX_SUFFIX + ".tmp", "w", newline="\n") as f:
+        f.writelines(_index_line(entry) for entry in entries)
+    os.replace(path + INDEX_SUFFIX + ".tmp", path + INDEX_SUFFIX)
+    return len(entries)
+
+
+def read_records(entries, path=RUN_STORE_FILE):
+    """The full records behind index entries, read by offset."""
+    records = []
+    with open(path, "rb") as store:
+        for entry in entries:
+            store.seek(entry.offset)
+            records.append(json.loads(store.read(entry.length)))
+    return records
+
+
+def recent_runs(entries, limit=QUERY_RUNS):
+    """Run ids of the last `limit` runs, oldest first."""
+    run_ids = [entry.run_id for entry in entries if entry.kind == RUN]
+    return run_ids[-limit:] if limit else run_ids
+
+
+def _step_key(entry):
+    return f"{entry.stage}/{entry.name}" if entry.stage else entry.name
+
+
+def slowest_steps(entries, runs=QUERY_RUNS, top=TOP_STEPS):
+    """Steps and stages with the highest median time over the last `runs` runs."""
+    selected = set(recent_runs(entries, runs))
+    durations = defaultdict(list)
+    for entry in entries:
+        if entry.run_id in selected and entry.kind in (STEP, STAGE) and entry.seconds is not None:
+            durations[(entry.kind, _step_key(entry))].append(entry.seconds)
+    rows = [{"kind": kind, "name": name, "runs": len(values), "median_s": round(statistics.median(values), 3),
+             "max_s": max(values), "last_s": values[-1]}
+            for (kind, name), values in durations.items()]
+    rows.sort(key=lambda row: row["median_s"], reverse=True)
+    return rows[:top]
+
+
+def regressions(entries, run_id=None, factor=REGRESSION_FACTOR, min_seconds=REGRESSION_MIN_SECONDS):
+    """Steps and stages of `run_id` (default: the last run) that got slower than in the run before it.
+
+    Runs are only compared with earlier runs of the same instance.
+    """
+    runs = [entry for entry in entries if entry.kind == RUN]
+    if not runs:
+        return None, None, []
+    if run_id is None:
+        run_id = runs[-1].run_id
+    instance_of = {entry.run_id: entry.name for entry in runs}
+    if run_id not in instance_of:
+        raise KeyError(f"No run {run_id}")
+    position = [entry.run_id for entry in runs].index(run_id)
+    earlier = [entry.run_id for entry in runs[:position] if entry.name == instance_of[run_id]]
+    if not earlier:
+        return run_id, None, []
+    previous_id = earlier[-1]
+    timings = {run_id: {}, previous_id: {}}
+    for entry in entries:
+        if entry.run_id in timings and entry.kind in (STEP, STAGE, RUN_END) and entry.seconds is not None:
+            name = "(whole run)" if entry.kind == RUN_END else _step_key(entry)
+            timings[entry.run_id][(entry.kind, name)] = entry.seconds
+    rows = []
+    for key, seconds in timings[run_id].items():
+        before = timings[previous_id].get(key)
+        if before is not None and seconds >= before * factor and seconds - before >= min_seconds:
+            rows.append({"kind": key[0], "name": key[1], "previous_s": before, "seconds": seconds,
+                         "change_s": round(seconds - before, 3)})
+    rows.sort(key=lambda row: row["change_s"], reverse=True)
+    return run_id, previous_id, rows
+
+
+def failure_frequency(entries, runs=QUERY_RUNS, path=RUN_STORE_FILE):
+    """How often each step and stage failed over the last `runs` runs, with its latest error tail."""
+    selected = set(recent_runs(entries, runs))
+    counts = defaultdict(lambda: {"runs": 0, "failed": 0, "last_failure": None})
+    for entry in entries:
+        if entry.run_id in selected and entry.kind in (STEP, STAGE):
+            row = counts[(entry.kind, _step_key(entry))]
+            row["runs"] += 1
+            if entry.status != "succeeded":
+                row["failed"] += 1
+                row["last_failure"] = entry
+    failing = {key: row for key, row in counts.items() if row["failed"]}
+    latest = read_records([row["last_failure"] for row in failing.values()], path) if failing else []
+    rows = []
+    for ((kind, name), row), record in zip(failing.items(), latest):
+        rows.append({"kind": kind, "name": name, "failed": row["failed"], "runs": row["runs"],
+                     "last_run": record["run_id"], "last_status": record.get("status"),
+                     "last_error": record.get("error_tail") or record.get("error")})
+    rows.sort(key=lambda row: (row["failed"] / row["runs"], row["failed"]), reverse=True)
+    return rows
+
+
+def run_summaries(entries, limit=QUERY_RUNS, path=RUN_STORE_FILE):
+    """Header, outcome and failed step count of the last `limit` runs, newest first."""
+    selected = recent_runs(entries, limit)
+    wanted = set(selected)
+    headers, ends, failed = {}, {}, defaultdict(int)
+    for entry in entries:
+        if entry.run_id not in wanted:
+            continue
+        if entry.kind == RUN:
+            headers[entry.run_id] = entry
+        elif entry.kind == RUN_END:
+            ends[entry.run_id] = entry
+        elif entry.kind == STEP and entry.status != "succeeded":
+            failed[entry.run_id] += 1
+    records = dict(zip(selected, read_records([headers[run_id] for run_id in selected], path)))
+    summaries = []
+    for run_id in reversed(selected):
+        end = ends.get(run_id)
+        summaries.append({
+            "run_id": run_id,
+            "started_at": records[run_id].get("started_at"),
+            "instance": records[run_id].get("instance"),
+            "host": records[run_id].get("host"),
+            "status": end.status if end else "unfinished",
+            "seconds": end.seconds if end else None,
+            "failed_steps": failed[run_id],
+        })
+    return summaries
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the provisioning runs recorded on this machine.")
+    parser.add_argument("--store", default=RUN_STORE_FILE, help="run store file (its index is <store>.idx)")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of text")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runs = commands.add_parser("runs", help="list recent runs")
+    runs.add_argument("--limit", type=int, default=QUERY_RUNS)
+    slowest = commands.add_parser("slowest", help="steps with the highest median time")
+    slowest.add_argument("--runs", type=int, default=QUERY_RUNS, help="look at the last N runs")
+    slowest.add_argument("--top", type=int, default=TOP_STEPS)
+    regressed = commands.add_parser("regressions", help="what got slower than in the previous run")
+    regressed.add_argument("--run", help="run id to check (default: the last run)")
+    regressed.add_argument("--factor", type=float, default=REGRESSION_FACTOR)
+    regressed.add_argument("--min-seconds", type=float, default=REGRESSION_MIN_SECONDS)
+    failures = commands.add_parser("failures", help="how often each step failed, with its last error")
+    failures.add_argument("--runs", type=int, default=QUERY_RUNS, help="look at the last N runs")
+    show = commands.add_parser("show", help="print every record of one run")
+    show.add_argument("run_id")
+    commands.add_parser("reindex", help="rebuild the index from the store")
+    args = parser.parse_args()
+
+    if args.command == "reindex":
+        print(f"Indexed {rebuild_index(args.store)} records")
+        return
+    entries = read_index(args.store)
+    if args.command == "runs":
+        rows = run_summaries(entries, args.limit, args.store)
+        lines = [f"{row['run_id']}  {row['instance'] or '-':<16} {row['status']:<10} {_seconds(row['seconds']):>8}  "
+                 f"{row['failed_steps']} failed steps" for row in rows]
+    elif args.command == "slowest":
+        rows = slowest_steps(entries, args.runs, args.top)
+        lines = [f"{row['median_s']:>8.1f}s median {row['max_s']:>8.1f}s max {row['last_s']:>8.1f}s last  "
+                 f"{row['kind']:<5} {row['name']} ({row['runs']} runs)" for row in rows]
+    elif args.command == "regressions":
+        try:
+            run_id, previous_id, rows = regressions(entries, args.run, args.factor, args.min_seconds)
+        except KeyError as e:
+            sys.exit(str(e.args[0]))
+        if previous_id is None:
+            rows, lines = [], [f"No earlier run of the same instance to compare {run_id or 'anything'} with"]
+        else:
+            lines = [f"Run {run_id} against {previous_id}:"] + [
+                f"  {row['previous_s']:>8.1f}s -> {row['seconds']:>8.1f}s (+{row['change_s']:.1f}s)  "
+                f"{row['kind']:<7} {row['name']}" for row in rows] + ([] if rows else ["  nothing got slower"])
+    elif args.command == "failures":
+        rows = failure_frequency(entries, args.runs, args.store)
+        lines = []
+        for row in rows:
+            lines.append(f"{row['failed']:>4}/{row['runs']:<4} {row['kind']:<5} {row['name']} "
+                         f"(last in {row['last_run']}, {row['last_status']})")
+            lines += [f"           {line}" for line in (row["last_error"] or "").splitlines()[-5:]]
+    else:
+        rows = read_records([entry for entry in entries if entry.run_id == args.run_id], args.store)
+        if not rows:
+            sys.exit(f"No run {args.run_id}")
+        lines = [json.dumps(row) for row in rows]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print("\n".join(lines))
+
+
+if __name__ == "__main__":
+    main()
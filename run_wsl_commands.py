@@ -1,27 +1,26 @@
-import subprocess
+import run_store
+from script_runner import run_script
 
 
 def run_wsl_commands(wsl_instance, commands, log_file, sudo_password=None):
     try:
-        # Prepare the log file
-        with open(log_file, 'w', newline='\n') as log:
-            for command in commands:
-                # Check if the command contains sudo and a password is provided
-                if 'sudo' in command and sudo_password:
-                    # Construct the WSL command with password piped to sudo using -S
-                    wsl_command = f"wsl -d {wsl_instance} bash -c \"echo {sudo_password} | sudo -S {command}\""
-                else:
-                    # Construct the WSL command
-                    wsl_command = f"wsl -d {wsl_instance} bash -c \"{command}\""
-                
-                # Run the WSL command
-                result = subprocess.run(wsl_command, shell=True, text=True, capture_output=True)
-                output = f"{command} {result.stdout}"
-                error = f"{command} {result.stderr}"
+        # Append to the log file so earlier runs are kept; each run is also recorded in the run store
+        with open(log_file, 'a', newline='\n') as log, run_store.recording(instance=wsl_instance) as run:
+            log.write(f"Run {run.run_id}\n\n")
+            # `exit` would end the script early; its shell exits on its own when the script ends
+            commands = [command for command in commands if command != "exit"]
+            # All commands run in one uploaded script, in one shell so state like `cd` carries over,
+            # and each still reports its own output and exit code
+            for index, result in enumerate(run_script(wsl_instance, commands, sudo_password=sudo_password)):
+                run.record_step(f"command_{index + 1}", result.command,
+                                "succeeded" if result.exit_code == 0 else "failed", result)
+                output = f"{result.command} {result.stdout}"
+                error = f"{result.command} {result.stderr}"
                 print(output)
                 print(error)
                 # Log the results
-                log.write(f"Command: {command}\n")
+                log.write(f"Command: {result.command}\n")
+                log.write(f"Exit code: {result.exit_code} ({result.duration:.2f}s)\n")
                 log.write(f"Output:\n{result.stdout}\n")
                 log.write(f"Error (if any):\n{result.stderr}\n")
                 log.write("\n" + "-" * 80 + "\n")
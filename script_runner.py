@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import signal
+import uuid
+import logging
+import threading
+import subprocess
+
+import tracing
+from wsl_config import WSL_EXE
+from wsl_session import CommandResult
+from output_streaming import STDOUT, STDERR, MAX_LINE_BYTES, TAIL_LINES, TailBuffer, dispatch
+from provision_scheduler import Step, ScheduleReport, FAILED, SKIPPED, SUCCEEDED, _check_graph, critical_path
+
+# Copies the script from stdin to a file inside the distro and runs it: one wsl.exe spawn in total.
+# Kept free of double quotes so it survives wsl.exe's command-line handling unchanged.
+LOADER = "f=$(mktemp /tmp/cloudbook-script-XXXXXX.sh) && cat > $f && exec bash --noprofile --norc $f < /dev/null"
+
+SCRIPT_HEADER = r"""__cb_dir=$(mktemp -d /tmp/cloudbook-steps-XXXXXX) || exit 97
+trap 'rm -rf "$__cb_dir" "$0"' EXIT
+declare -A __cb_ok
+__cb_now() {
+    if [ -n "$EPOCHREALTIME" ]; then __cb_t=${EPOCHREALTIME/[.,]/}; else __cb_t=$(date +%s%6N); fi
+}
+# Record: <marker> <step index> <ran|skipped> <exit code> <microseconds> <stdout bytes> <stderr bytes>
+__cb_record() {
+    printf '%s %s %s %s %s %s %s\n' "$__cb_marker" "$1" "$2" "$3" "$4" \
+        "$(wc -c < "$__cb_dir/out")" "$(wc -c < "$__cb_dir/err")"
+    cat "$__cb_dir/out" "$__cb_dir/err"
+}
+"""
+
+
+def _wrap(command, sudo_password):
+    # Same sudo handling as WslSession so both runners accept the same command lists.
+    if 'sudo' in command and sudo_password:
+        command = f"echo {sudo_password} | sudo -S {command}"
+    return command
+
+
+def _kill(process):
+    # The script runs in a child shell; on Linux take the whole group down, on Windows wsl.exe does it.
+    if process.poll() is not None:
+        return
+    if sys.platform != "win32":
+        os.killpg(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+
+
+def order_steps(steps):
+    """Dependency order for sequential execution, keeping the given order where possible."""
+    by_name = _check_graph(steps)
+    ordered, seen = [], set()
+
+    def visit(step):
+        if step.name in seen:
+            return
+        seen.add(step.name)
+        for dep in step.deps:
+            visit(by_name[dep])
+        ordered.append(step)
+
+    for step in steps:
+        visit(step)
+    return ordered
+
+
+def compile_script(steps, marker, sudo_password=None):
+    """Generate one bash script running `steps` in order and framing each step's results.
+
+    Each command is passed through a quoted heredoc and `eval`ed in the
+    script's own shell, so quoting is preserved and state such as the
+    working directory carries over, exactly as in a WslSession. Steps whose
+    dependencies did not succeed are reported as skipped.
+    """
+    index_of = {step.name: index for index, step in enumerate(steps)}
+    parts = [f"__cb_marker='{marker}'\n", SCRIPT_HEADER]
+    for index, step in enumerate(steps):
+        if not isinstance(step.command, str):
+            raise ValueError(f"Step '{step.name}' is not a shell command and cannot be compiled into a script")
+        delimiter = f"__CMD_{uuid.uuid4().hex}__"
+        condition = " && ".join(f'[ -n "${{__cb_ok[{index_of[dep]}]}}" ]' for dep in step.deps) or "true"
+        parts.append(
+            f"# step {index}: {step.name}\n"
+            f"if {condition}; then\n"
+            f"IFS= read -r -d '' __cb_cmd <<'{delimiter}'\n{_wrap(step.command, sudo_password)}\n{delimiter}\n"
+            f"__cb_now; __cb_start=$__cb_t\n"
+            f"{{ eval \"$__cb_cmd\"; }} > \"$__cb_dir/out\" 2> \"$__cb_dir/err\" < /dev/null\n"
+            f"__cb_rc=$?\n"
+            f"__cb_now\n"
+            f"__cb_record {index} ran $__cb_rc $((__cb_t - __cb_start))\n"
+            f"[ $__cb_rc -eq 0 ] && __cb_ok[{index}]=1\n"
+            f"else\n"
+            f": > \"$__cb_dir/out\"; : > \"$__cb_dir/err\"\n"
+            f"__cb_record {index} skipped -1 0\n"
+            f"fi\n"
+        )
+    parts.append("printf '%s end\\n' \"$__cb_marker\"\n")
+    return "".join(parts)
+
+
+class _RecordOutput:
+    """The stdout and stderr bytes following a record header, read from the pipe in bounded pieces."""
+
+    def __init__(self, pipe, sizes):
+        self.pipe = pipe
+        self.remaining = dict(sizes)
+
+    def stream(self, sinks):
+        """Hand the output to `sinks` line by line; lines longer than MAX_LINE_BYTES arrive split."""
+        for stream in (STDOUT, STDERR):
+            while self.remaining[stream] > 0:
+                raw = self.pipe.readline(min(self.remaining[stream], MAX_LINE_BYTES))
+                if not raw:
+                    # The script died mid-record; the caller notices the missing records.
+                    self.remaining = {STDOUT: 0, STDERR: 0}
+                    return
+                self.remaining[stream] -= len(raw)
+                dispatch(sinks, stream, raw.decode(errors="replace"))
+
+
+def read_records(pipe, marker):
+    """Yield (index, status, exit_code, seconds, output) per framed record until the end marker.
+
+    `output` must be streamed before the next record is read; whatever the
+    caller leaves unread is skipped.
+    """
+    prefix = marker.encode() + b" "
+    for line in iter(pipe.readline, b""):
+        if not line.startswith(prefix):
+            logging.debug(f"Unframed script output: {line!r}")
+            continue
+        fields = line[len(prefix):].split()
+        if fields == [b"end"]:
+            return
+        index, status, exit_code, micros, out_size, err_size = fields
+        output = _RecordOutput(pipe, {STDOUT: int(out_size), STDERR: int(err_size)})
+        yield int(index), status.decode(), int(exit_code), int(micros) / 1e6, output
+        output.stream(())
+
+
+def run_steps_as_script(steps, instance_name, sudo_password=None, argv=None, sinks_for_step=None,
+                        on_step_done=None, timeout=None, tail_lines=TAIL_LINES):
+    """Run shell-command steps in one `wsl -d` spawn and return a ScheduleReport.
+
+    The script is copied into the distro and executed there; every step
+    comes back as a CommandResult with its own output, exit code and
+    in-distro duration, as with the per-command runner. Output reaches the
+    sinks as each step finishes, read in bounded pieces; only the tails are
+    kept. Steps run one after another in dependency order. Pass `argv` to use another shell, e.g.
+    `["bash", "--noprofile", "--norc"]` when testing on Linux.
+    """
+    steps = order_steps(list(steps))
+    marker = f"__CLOUDBOOK_STEP_{uuid.uuid4().hex}__"
+    script = compile_script(steps, marker, sudo_password)
+    argv = list(argv or [WSL_EXE, "-d", instance_name, "--", "bash", "--noprofile", "--norc"]) + ["-c", LOADER]
+    report = ScheduleReport()
+    started = time.monotonic()
+
+    with tracing.span("script", instance=instance_name, steps=len(steps), script_bytes=len(script)) as span:
+        process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   start_new_session=sys.platform != "win32")
+        script_errors = TailBuffer(tail_lines)
+        stderr_thread = threading.Thread(
+            target=lambda: [script_errors(STDERR, line.decode(errors="replace")) for line in process.stderr],
+            daemon=True,
+        )
+        stderr_thread.start()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, _kill, (process,))
+            timer.start()
+        try:
+            try:
+                process.stdin.write(script.encode())
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            for index, status, exit_code, seconds, output in read_records(process.stdout, marker):
+                step = steps[index]
+                report.started_at[step.name] = started
+                if status == "skipped":
+                    report.status[step.name] = SKIPPED
+                    logging.warning(f"Skipped step '{step.name}': a dependency did not succeed")
+                else:
+                    tail = TailBuffer(tail_lines)
+                    sinks = list(sinks_for_step(step)) if sinks_for_step is not None else []
+                    sinks.append(tail)
+                    output.stream(sinks)
+                    result = CommandResult(step.description, tail.text(STDOUT), tail.text(STDERR), exit_code, seconds)
+                    report.results[step.name] = result
+                    report.status[step.name] = SUCCEEDED if exit_code == 0 else FAILED
+                    logging.info(f"Step '{step.name}' {report.status[step.name]} in {seconds:.2f}s")
+                if on_step_done is not None:
+                    on_step_done(step, report.status[step.name], report.results.get(step.name))
+            returncode = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if process.poll() is None:
+                _kill(process)
+                process.wait()
+        stderr_thread.join()
+        span.set("exit_code", returncode)
+
+    missing = [step for step in steps if step.name not in report.status]
+    if missing:
+        # The script died mid-way (e.g. a command ran `exit`, or the timeout hit): blame the step that was running.
+        detail = script_errors.text(STDERR) or f"script exited with code {returncode}"
+        if timer is not None and returncode < 0:
+            detail = f"timed out after {timeout}s"
+        logging.error(f"Script for '{instance_name}' stopped at step '{missing[0].name}': {detail}")
+        report.status[missing[0].name] = FAILED
+        report.results[missing[0].name] = CommandResult(missing[0].description, "", detail, returncode or -1,
+                                                        time.monotonic() - started)
+        for step in missing[1:]:
+            report.status[step.name] = SKIPPED
+        for step in missing:
+            if on_step_done is not None:
+                on_step_done(step, report.status[step.name], report.results.get(step.name))
+    report.wall_time = time.monotonic() - started
+    report.critical_path = critical_path(steps, report.results)
+    return report
+
+
+def run_script(instance_name, commands, sudo_password=None, argv=None, sinks=(), timeout=None):
+    """Run a plain command list in one spawn; returns one CommandResult per command, in order.
+
+    Commands after a failing one still run, as with the per-command runner.
+    """
+    steps = [Step(f"command {index}", command) for index, command in enumerate(commands)]
+    report = run_steps_as_script(steps, instance_name, sudo_password, argv,
+                                 sinks_for_step=lambda step: sinks, timeout=timeout)
+    return [report.results[step.name] for step in steps if step.name in report.results]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    local = ["bash", "--noprofile", "--norc"] if sys.platform != "win32" else None
+    for result in run_script(sys.argv[1] if len(sys.argv) > 1 else "cloudbook",
+                             ["cd /tmp", "pwd", "echo out; echo err >&2; (exit 3)", "printf '%s' \"it's \\\"quoted\\\"\""],
+                             argv=local):
+        print(result)
@@ -0,0 +1,460 @@
+import io
+import re
+import sys
+import json
+import lzma
+import queue
+import bisect
+import hashlib
+import logging
+import tarfile
+import threading
+import posixpath
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from payload_container import PayloadMember, list_members, read_index, open_payload, payload_name
+from payload_verify import PayloadCorruptError
+from rootfs_analyzer import member_path
+from wsl_config import PAYLOAD_NAME, COMPRESSED_PAYLOAD_NAMES
+
+# Member index of the rootfs tar: one line per member, sorted by path, after a JSON header line.
+#   <path>\t<kind>\t<header offset>\t<data offset>\t<size>\t<sha256>\t<link target>
+# Offsets are into the uncompressed tar. Lookups binary-search the sorted lines with a few
+# small seeks, so the installer never parses the whole index to read one file.
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index"
+HEADER_PREFIX = b"#cloudbook-tar-index "
+# Frame table written by build_payload: where each independently compressed frame starts
+# in the uncompressed tar and in the payload. Container members carry it in the index.
+FRAMES_SUFFIX = ".frames.json"
+# Below this many bytes the binary search switches to a linear scan.
+SCAN_SIZE = 8192
+MAX_LINK_DEPTH = 8
+# Chunks buffered between the build pipeline and the indexer thread.
+TEE_QUEUE_SIZE = 8
+
+IndexEntry = namedtuple("IndexEntry", "path kind header_offset data_offset size sha256 linkname")
+
+
+def _escape(text):
+    # Control characters are escaped too, so the tab ending the path sorts before anything in it.
+    return re.sub(r"[%\x00-\x1f]", lambda match: f"%{ord(match.group()):02X}", text)
+
+
+def _unescape(text):
+    return re.sub(r"%([0-9A-F]{2})", lambda match: chr(int(match.group(1), 16)), text)
+
+
+def _encode(text):
+    # Names that are not valid UTF-8 come out of tarfile as surrogate escapes; keep their bytes.
+    return text.encode("utf-8", "surrogateescape")
+
+
+def _kind(member):
+    if member.isfile():
+        return "file"
+    if member.isdir():
+        return "dir"
+    if member.issym():
+        return "symlink"
+    if member.islnk():
+        return "link"
+    return "other"
+
+
+def index_tar(source):
+    """Read an uncompressed tar stream once and return (entries, tar bytes); file contents are hashed."""
+    entries = []
+    with tarfile.open(fileobj=source, mode="r|") as tar:
+        for member in tar:
+            digest = None
+            if member.isfile():
+                data = tar.extractfile(member)
+                hasher = hashlib.sha256()
+                for chunk in iter(lambda: data.read(1024 * 1024), b""):
+                    hasher.update(chunk)
+                digest = hasher.hexdigest()
+            linkname = member_path(member.linkname) if member.islnk() else member.linkname
+            entries.append(IndexEntry(member_path(member.name), _kind(member), member.offset,
+                                      member.offset_data, member.size, digest, linkname))
+        tar_bytes = tar.offset
+    # Drain the end-of-archive padding so a feeding pipeline never blocks on us.
+    while source.read(1024 * 1024):
+        pass
+    return entries, tar_bytes
+
+
+def index_lines(entries, meta):
+    """Yield the encoded index: the JSON header line, then one sorted line per member."""
+    yield HEADER_PREFIX + json.dumps(meta).encode() + b"\n"
+    lines = []
+    for entry in entries:
+        fields = [_escape(entry.path), entry.kind, str(entry.header_offset), str(entry.data_offset),
+                  str(entry.size), entry.sha256 or "", _escape(entry.linkname or "")]
+        lines.append(_encode("\t".join(fields) + "\n"))
+    lines.sort()
+    yield from lines
+
+
+def index_meta(name, entries, tar_bytes, **extra):
+    meta = {
+        "version": INDEX_VERSION,
+        "payload": name,
+        "members": len(entries),
+        "tar_bytes": tar_bytes,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    meta.update(extra)
+    return meta
+
+
+class _QueueReader:
+    """File-like end of a queue of byte chunks; None marks the end."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._chunk = b""
+        self._position = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._position >= len(self._chunk):
+                chunk = None if self._eof else self._chunks.get()
+                if chunk is None:
+                    self._eof = True
+                    break
+                self._chunk, self._position = chunk, 0
+            available = len(self._chunk) - self._position
+            take = available if size < 0 else min(size, available)
+            parts.append(self._chunk[self._position:self._position + take])
+            self._position += take
+            if size > 0:
+                size -= take
+        return b"".join(parts)
+
+
+class StreamIndexer:
+    """Index a tar on a thread while another pipeline reads it, e.g. build_payload's export.
+
+    `wrap(source)` returns a reader passing bytes through to the caller and a
+    bounded queue; `finish()` returns (entries, tar bytes) once the source is exhausted.
+    """
+
+    def __init__(self):
+        self._chunks = queue.Queue(maxsize=TEE_QUEUE_SIZE)
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="tar-indexer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        reader = _QueueReader(self._chunks)
+        try:
+            self._result = index_tar(reader)
+        except BaseException as e:
+            self._error = e
+            # Keep consuming so the pipeline feeding us is never blocked by a failed index.
+            while reader.read(1024 * 1024):
+                pass
+
+    def wrap(self, source):
+        indexer = self
+
+        class _Tee:
+            def read(self, size=-1):
+                data = source.read(size)
+                indexer._chunks.put(bytes(data) if data else None)
+                return data
+
+            def close(self):
+                source.close()
+
+        return _Tee()
+
+    def close(self):
+        """Stop the indexer thread, e.g. when the build was abandoned."""
+        if self._thread.is_alive():
+            self._chunks.put(None)
+            self._thread.join()
+
+    def finish(self):
+        self.close()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def load_frames(payload):
+    """Frame table of a payload built by build_payload, or None."""
+    if isinstance(payload, PayloadMember):
+        return payload.attributes.get("frames")
+    try:
+        with open(payload + FRAMES_SUFFIX) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _decompress_frame(fmt, data):
+    if fmt == "xz":
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    try:
+        import zstandard
+    except ImportError:
+        import shutil
+        import subprocess
+        zstd = shutil.which("zstd")
+        if zstd is None:
+            raise RuntimeError("Reading .zst payloads needs `pip install zstandard` or the zstd CLI")
+        return subprocess.run([zstd, "-dc"], input=data, stdout=subprocess.PIPE, check=True).stdout
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+class TarIndex:
+    """Random access to the members of a payload's rootfs tar through its index."""
+
+    def __init__(self, index_file, payload, frames=None):
+        self.payload = payload
+        self.frames = frames
+        self._file = io.BufferedReader(index_file, SCAN_SIZE) if isinstance(index_file, io.RawIOBase) else index_file
+        header = self._file.readline()
+        if not header.startswith(HEADER_PREFIX):
+            raise ValueError(f"{payload_name(payload)}{INDEX_SUFFIX} is not a tar index")
+        self.meta = json.loads(header[len(HEADER_PREFIX):])
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported tar index version {self.meta.get('version')}")
+        self._start = self._file.tell()
+        self._end = self._file.seek(0, io.SEEK_END)
+        self._frame_starts = [frame[0] for frame in frames["frames"]] if frames else None
+        self._cached_frame = (None, None)
+
+    def _first_at_or_after(self, key):
+        """Position the index at the first line whose path is >= `key`."""
+        f = self._file
+        lo, hi = self._start, self._end
+        while hi - lo > SCAN_SIZE:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            f.readline()
+            line = f.readline()
+            if not line or line.split(b"\t", 1)[0] >= key:
+                hi = mid
+            else:
+                lo = mid
+        f.seek(lo)
+        if lo > self._start:
+            # `lo` is inside (or at the start of) a line that sorts before `key`.
+            f.readline()
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line or line.split(b"\t", 1)[0] >= key:
+                f.seek(position)
+                return
+
+    @staticmethod
+    def _parse(line):
+        fields = line.rstrip(b"\n").decode("utf-8", "surrogateescape").split("\t")
+        path, kind, header_offset, data_offset, size, sha256, linkname = fields
+        return IndexEntry(_unescape(path), kind, int(header_offset), int(data_offset), int(size),
+                          sha256 or None, _unescape(linkname) or None)
+
+    def lookup(self, path):
+        """Index entry for `path` itself (links are not followed), or None."""
+        key = _encode(_escape(member_path(path).rstrip("/")))
+        self._first_at_or_after(key)
+        line = self._file.readline()
+        if line and line.split(b"\t", 1)[0] == key:
+            return self._parse(line)
+        return None
+
+    def list(self, prefix=""):
+        """Entries whose path starts with `prefix`, in path order."""
+        key = _encode(_escape(member_path(prefix)))
+        self._first_at_or_after(key)
+        for line in iter(self._file.readline, b""):
+            if not line.startswith(key):
+                break
+            yield self._parse(line)
+
+    def resolve(self, path):
+        """Follow symlinks and hard links to the entry holding the data, or None when missing."""
+        path = member_path(path)
+        for _ in range(MAX_LINK_DEPTH):
+            entry = self.lookup(path)
+            if entry is None or entry.kind not in ("symlink", "link"):
+                return entry
+            if entry.kind == "link":
+                path = entry.linkname
+            elif entry.linkname.startswith("/"):
+                path = member_path(entry.linkname)
+            else:
+                path = posixpath.normpath(posixpath.join(posixpath.dirname(entry.path), entry.linkname))
+        raise ValueError(f"Too many levels of links resolving {path}")
+
+    def read_range(self, offset, size):
+        """Bytes [offset, offset + size) of the uncompressed tar."""
+        if self._frame_starts is None:
+            with open_payload(self.payload) as f:
+                f.seek(offset)
+                return f.read(size)
+        parts = []
+        index = bisect.bisect_right(self._frame_starts, offset) - 1
+        end = offset + size
+        while offset < end:
+            frame = self._frame(index)
+            start = self._frame_starts[index]
+            parts.append(frame[offset - start:end - start])
+            offset = start + len(frame)
+            index += 1
+        return b"".join(parts)
+
+    def _frame(self, index):
+        if self._cached_frame[0] == index:
+            return self._cached_frame[1]
+        _, _, compressed_offset, compressed_size = self.frames["frames"][index]
+        with open_payload(self.payload) as f:
+            f.seek(compressed_offset)
+            data = _decompress_frame(self.frames["format"], f.read(compressed_size))
+        self._cached_frame = (index, data)
+        return data
+
+    def read(self, path, verify=True):
+        """Contents of one file, checked against the hash recorded at build time."""
+        entry = self.resolve(path)
+        if entry is None:
+            raise FileNotFoundError(f"{path} is not in {payload_name(self.payload)}")
+        if entry.kind != "file":
+            raise IsADirectoryError(f"{path} is a {entry.kind} in {payload_name(self.payload)}")
+        data = self.read_range(entry.data_offset, entry.size)
+        if verify and entry.sha256 and hashlib.sha256(data).hexdigest() != entry.sha256:
+            raise PayloadCorruptError(f"{path} in {payload_name(self.payload)} does not match its index")
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def index_for(payload):
+    """Open the index shipped with a payload (container member or sidecar), or None."""
+    name = payload_name(payload) + INDEX_SUFFIX
+    if isinstance(payload, PayloadMember):
+        member = list_members(payload.container).get(name)
+        if member is None:
+            return None
+        index_file = member.open()
+    else:
+        try:
+            index_file = open(payload + INDEX_SUFFIX, "rb")
+        except FileNotFoundError:
+            return None
+    from compressed_import import is_compressed_payload
+    frames = load_frames(payload)
+    if frames is None and is_compressed_payload(payload):
+        logging.warning(f"{payload_name(payload)} has an index but no frame table; "
+                        f"its files cannot be read without decompressing it all")
+        index_file.close()
+        return None
+    return TarIndex(index_file, payload, frames)
+
+
+def compose_images(text):
+    """Image references in a compose file, without parsing YAML."""
+    images = []
+    for line in text.splitlines():
+        key, _, value = line.strip().partition(":")
+        if key == "image" and value.strip():
+            images.append(value.strip().strip("'\""))
+    return images
+
+
+def describe(index, compose_path="usr/backend/docker-compose.yml"):
+    """What a payload contains, for logs and the splash screen: build info, OS and compose images."""
+    summary = {
+        "built_at": index.meta.get("built_at"),
+        "members": index.meta.get("members"),
+        "tar_bytes": index.meta.get("tar_bytes"),
+        "root": index.meta.get("root"),
+    }
+    try:
+        for line in index.read("etc/os-release").decode(errors="replace").splitlines():
+            if line.startswith("PRETTY_NAME="):
+                summary["os"] = line.split("=", 1)[1].strip('"')
+    except (FileNotFoundError, IsADirectoryError):
+        summary["os"] = None
+    try:
+        summary["compose_images"] = compose_images(index.read(compose_path).decode(errors="replace"))
+    except (FileNotFoundError, IsADirectoryError):
+        summary["compose_images"] = None
+    return summary
+
+
+def _payload_arg(path, member_name=None):
+    """A payload given on the command line: a plain file, or a member of a container."""
+    if read_index(path) is None:
+        return path
+    members = list_members(path)
+    for name in ([member_name] if member_name else COMPRESSED_PAYLOAD_NAMES + [PAYLOAD_NAME]):
+        if name in members:
+            return members[name]
+    sys.exit(f"No payload member in {path} (members: {', '.join(members)})")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build and query the member index of a rootfs payload.")
+    parser.add_argument("--member", help="payload member to use when PAYLOAD is a container")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help=f"index a payload file into <payload>{INDEX_SUFFIX}")
+    build.add_argument("payload")
+    info = commands.add_parser("info", help="show what a payload contains")
+    info.add_argument("payload")
+    listing = commands.add_parser("ls", help="list members under a path")
+    listing.add_argument("payload")
+    listing.add_argument("prefix", nargs="?", default="")
+    cat = commands.add_parser("cat", help="print one file from the payload")
+    cat.add_argument("payload")
+    cat.add_argument("path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    payload = _payload_arg(args.payload, args.member)
+    if args.command == "build":
+        if isinstance(payload, PayloadMember):
+            sys.exit("Containers get their index from build_payload.py; `build` indexes plain payload files")
+        from compressed_import import open_decompressed
+        with open_decompressed(payload) as reader:
+            entries, tar_bytes = index_tar(reader)
+        with open(payload + INDEX_SUFFIX, "wb") as f:
+            f.writelines(index_lines(entries, index_meta(payload_name(payload), entries, tar_bytes)))
+        print(f"Indexed {len(entries)} members into {payload}{INDEX_SUFFIX}")
+        return
+    index = index_for(payload)
+    if index is None:
+        sys.exit(f"No usable index for {payload}")
+    with index:
+        if args.command == "info":
+            print(json.dumps(describe(index), indent=2))
+        elif args.command == "ls":
+            for entry in index.list(args.prefix):
+                print(f"{entry.kind:<8}{entry.size:>12}  {entry.path}" +
+                      (f" -> {entry.linkname}" if entry.linkname else ""))
+        else:
+            try:
+                data = index.read(args.path)
+            except (FileNotFoundError, IsADirectoryError) as e:
+                sys.exit(str(e))
+            sys.stdout.buffer.write(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark_provisioning
+
+
+class FakeMachine:
+    """The fake wsl/docker of benchmark_provisioning, with their state under one directory."""
+
+    def __init__(self, work_dir):
+        self.work_dir = str(work_dir)
+        self.state_dir = os.path.join(self.work_dir, "state")
+        self.bin_dir = os.path.join(self.work_dir, "bin")
+        self.wsl = os.path.join(self.bin_dir, "wsl")
+        self.docker = os.path.join(self.bin_dir, "docker")
+        os.makedirs(self.state_dir)
+        self.config = json.loads(json.dumps(benchmark_provisioning.DEFAULT_CONFIG))
+        self.config.update(spawn_latency=0.0, docker_latency=0.0, pull_seconds=0.0, compose_seconds=0.0,
+                           compose_warm_seconds=0.0)
+        self.write_config()
+        with open(os.path.join(self.state_dir, "bash_env.sh"), "w") as f:
+            f.write(benchmark_provisioning.BASH_ENV_SCRIPT)
+        benchmark_provisioning._write_launchers(self.bin_dir)
+
+    def write_config(self, **changes):
+        self.config.update(changes)
+        with open(os.path.join(self.state_dir, "config.json"), "w") as f:
+            json.dump(self.config, f)
+
+    def build_payload(self, payload_mb=1):
+        """A verified payload container holding a rootfs-shaped tar; returns its path."""
+        return benchmark_provisioning._build_payload(self.work_dir, payload_mb)
+
+    def env(self, payload):
+        """Environment pointing the installer at the fakes, for running it in a subprocess."""
+        return dict(
+            os.environ,
+            PYTHONPATH=benchmark_provisioning.REPO_DIR,
+            CLOUDBOOK_WSL_EXE=self.wsl,
+            CLOUDBOOK_DOCKER_EXE=self.docker,
+            CLOUDBOOK_WSL_ROOT=os.path.join(self.state_dir, "wsl_root"),
+            CLOUDBOOK_PAYLOAD=payload,
+        )
+
+    def host_ports(self):
+        """Host ports bound by the fake docker: port -> distro."""
+        path = os.path.join(self.state_dir, "wsl.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f).get("host_ports", {})
+
+    def distros(self):
+        """The fake's registered distros: name -> {"state": ...}."""
+        path = os.path.join(self.state_dir, "wsl.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)["distros"]
+
+
+@pytest.fixture
+def fake_machine(tmp_path, monkeypatch):
+    machine = FakeMachine(tmp_path / "machine")
+    monkeypatch.setenv("CLOUDBOOK_FAKE_STATE", machine.state_dir)
+    monkeypatch.setenv("PATH", machine.bin_dir + os.pathsep + os.environ.get("PATH", ""))
+    return machine
@@ -0,0 +1,86 @@
+import os
+import lzma
+import shutil
+import tarfile
+import subprocess
+
+import pytest
+
+import compressed_import
+
+
+@pytest.fixture
+def rootfs_tar(tmp_path):
+    blob = tmp_path / "blob"
+    blob.write_bytes(os.urandom(3 * 1024 * 1024))
+    path = tmp_path / "rootfs.tar"
+    with tarfile.open(path, "w") as tar:
+        tar.add(blob, "usr/lib/blob")
+    return path
+
+
+@pytest.fixture
+def fake_wsl(fake_machine, monkeypatch):
+    monkeypatch.setattr(compressed_import, "WSL_EXE", fake_machine.wsl)
+    return fake_machine
+
+
+def zstd_compress(path, tmp_path):
+    zstd = shutil.which("zstd")
+    if zstd is None:
+        pytest.skip("needs the zstd CLI")
+    archive = tmp_path / "rootfs.tar.zst"
+    subprocess.run([zstd, "-q", "-o", str(archive), str(path)], check=True)
+    return archive
+
+
+def test_xz_payload_streams_into_import(fake_wsl, rootfs_tar, tmp_path):
+    archive = tmp_path / "rootfs.tar.xz"
+    archive.write_bytes(lzma.compress(rootfs_tar.read_bytes()))
+    target = tmp_path / "instance"
+
+    stats = compressed_import.import_compressed_rootfs(str(archive), "cloudbook", str(target))
+
+    assert stats["compressed_bytes"] == archive.stat().st_size
+    assert stats["uncompressed_bytes"] == rootfs_tar.stat().st_size
+    assert (target / "ext4.vhdx").stat().st_size == rootfs_tar.stat().st_size
+    assert "cloudbook" in fake_wsl.distros()
+
+
+def test_zstd_cli_payload_streams_into_import(fake_wsl, rootfs_tar, tmp_path):
+    archive = zstd_compress(rootfs_tar, tmp_path)
+    target = tmp_path / "instance"
+
+    stats = compressed_import.import_compressed_rootfs(str(archive), "cloudbook", str(target))
+
+    assert stats["uncompressed_bytes"] == rootfs_tar.stat().st_size
+    assert (target / "ext4.vhdx").stat().st_size == rootfs_tar.stat().st_size
+
+
+def test_truncated_zstd_payload_fails_the_import(fake_wsl, rootfs_tar, tmp_path):
+    archive = zstd_compress(rootfs_tar, tmp_path)
+    with open(archive, "r+b") as f:
+        f.truncate(archive.stat().st_size // 2)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        compressed_import.import_compressed_rootfs(str(archive), "cloudbook", str(tmp_path / "instance"))
+    assert "cloudbook" not in fake_wsl.distros()
+
+
+def test_failing_import_raises(fake_wsl, rootfs_tar, tmp_path):
+    fake_wsl.write_config(failures={"wsl --import": 1})
+    archive = tmp_path / "rootfs.tar.xz"
+    archive.write_bytes(lzma.compress(rootfs_tar.read_bytes()))
+
+    with pytest.raises(subprocess.CalledProcessError):
+        compressed_import.import_compressed_rootfs(str(archive), "cloudbook", str(tmp_path / "instance"))
+
+
+def test_process_reader_checks_the_exit_code():
+    command = ["sh", "-c", "printf partial; exit 3"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        with compressed_import._ProcessReader(process, command) as reader:
+            assert reader.read(7) == b"partial"
+            reader.read(7)
+    assert raised.value.returncode == 3
@@ -0,0 +1,111 @@
+import os
+import json
+
+import pytest
+
+import container_reconciler
+from wsl_session import CommandResult, WslSession
+
+CONFIG = {
+    "name": "backend",
+    "services": {
+        "api": {"ports": [{"target": 8080, "published": "8080", "protocol": "tcp"},
+                          {"target": 9090, "published": "9090", "protocol": "udp"}]},
+        "workers": {"ports": [{"target": 7000, "published": "7000-7002", "protocol": "tcp"}]},
+        "db": {"ports": [{"target": 5432}]},
+    },
+}
+
+
+class FakeDistro:
+    """Answers `docker compose config` with CONFIG and records every other command."""
+
+    def __init__(self, config=CONFIG, up_exit_code=0):
+        self.config = json.loads(json.dumps(config))
+        self.up_exit_code = up_exit_code
+        self.commands = []
+
+    def __call__(self, command):
+        self.commands.append(command)
+        if command.endswith("docker compose config --format json"):
+            return CommandResult(command, json.dumps(self.config), "", 0, 0.1)
+        return CommandResult(command, "", "", self.up_exit_code, 0.2)
+
+
+def test_published_and_host_ports():
+    assert container_reconciler.published_ports(CONFIG) == [("api", 8080), ("workers", 7000)]
+    assert container_reconciler.host_ports(CONFIG) == [("api", 8080), ("api", 9090), ("workers", 7000),
+                                                       ("workers", 7001), ("workers", 7002)]
+
+
+def test_shift_published_ports():
+    config = json.loads(json.dumps(CONFIG))
+    changes = container_reconciler.shift_published_ports(config, 100)
+    assert changes == ["api: 8080 -> 8180", "api: 9090 -> 9190", "workers: 7000-7002 -> 7100-7102"]
+    assert container_reconciler.published_ports(config) == [("api", 8180), ("workers", 7100)]
+
+
+def test_compose_up_without_offset_or_callbacks():
+    distro = FakeDistro()
+    assert container_reconciler.compose_up("/usr/backend", 0, distro).exit_code == 0
+    assert distro.commands == ["cd /usr/backend && docker compose up --build -d"]
+
+
+def test_compose_up_reports_published_ports():
+    distro = FakeDistro()
+    published = []
+    result = container_reconciler.compose_up("/usr/backend", 0, distro, on_published=published.extend)
+    assert result.exit_code == 0
+    assert result.duration == pytest.approx(0.3)
+    assert published == [("api", 8080), ("workers", 7000)]
+
+
+def test_compose_up_shifts_ports():
+    distro = FakeDistro()
+    published = []
+    result = container_reconciler.compose_up("/usr/backend", 200, distro, on_published=published.extend)
+    assert result.exit_code == 0
+    assert "api: 8080 -> 8280" in result.stdout
+    assert published == [("api", 8280), ("workers", 7200)]
+    assert f"COMPOSE_FILE={container_reconciler.SHIFTED_COMPOSE_FILE}" in distro.commands[-1]
+
+
+def test_failed_compose_up_reports_nothing():
+    published = []
+    result = container_reconciler.compose_up("/usr/backend", 100, FakeDistro(up_exit_code=1),
+                                             on_published=published.extend)
+    assert result.exit_code == 1
+    assert published == []
+
+
+def test_check_ports_can_refuse_the_stack():
+    distro = FakeDistro()
+    seen = []
+
+    def check_ports(ports):
+        seen.extend(ports)
+        raise ValueError("port 8080 is taken")
+
+    result = container_reconciler.compose_up("/usr/backend", 100, distro, check_ports=check_ports)
+    assert result.exit_code == 1
+    assert result.stderr == "port 8080 is taken\n"
+    assert seen == container_reconciler.host_ports(CONFIG)
+    assert len(distro.commands) == 1
+
+
+def test_compose_up_in_the_fake_distro(fake_machine):
+    fake_machine.write_config(compose_ports=["8080", "8443"])
+    os.makedirs(os.path.join(fake_machine.state_dir, "distros", "cloudbook", "usr", "backend"))
+    os.makedirs(os.path.join(fake_machine.state_dir, "distros", "cloudbook", "var", "lib"))
+    with open(os.path.join(fake_machine.state_dir, "wsl.json"), "w") as f:
+        json.dump({"distros": {"cloudbook": {"state": "Stopped"}}, "failures": {}}, f)
+    published = []
+
+    argv = [fake_machine.wsl, "-d", "cloudbook", "--", "bash", "--noprofile", "--norc"]
+    with WslSession("cloudbook", argv=argv) as session:
+        result = container_reconciler.compose_up("/usr/backend", 100, session.run, on_published=published.extend)
+
+    assert result.exit_code == 0, result.stderr
+    assert published == [("api", 8180)]
+    with open(os.path.join(fake_machine.state_dir, "wsl.json")) as f:
+        assert json.load(f)["host_ports"] == {"8180": "cloudbook", "8543": "cloudbook"}
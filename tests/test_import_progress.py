@@ -0,0 +1,123 @@
+import io
+import os
+import json
+import tarfile
+
+import pytest
+
+import wsl_config
+import install_wsl3
+import import_progress
+import compressed_import
+from import_progress import ImportProgress, MeteredReader
+
+
+class Clock:
+    """Stands in for time.monotonic inside import_progress."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(import_progress.time, "monotonic", clock)
+    return clock
+
+
+def test_events_report_rate_and_eta(clock):
+    events = []
+    progress = ImportProgress(100_000_000, events.append, interval=1.0)
+    clock.now += 0.5
+    progress.update(10_000_000)
+    assert events == []
+    clock.now += 0.5
+    progress.update(10_000_000)
+    assert events[-1]["bytes_done"] == 20_000_000
+    assert events[-1]["percent"] == 20.0
+    assert events[-1]["mb_per_s"] == 20.0
+    assert events[-1]["eta_s"] == 4.0
+    assert not events[-1]["final"]
+
+
+def test_sampled_sizes_stay_below_done(clock):
+    events = []
+    progress = ImportProgress(1000, events.append, interval=0)
+    clock.now += 1
+    progress.set_done(1500)
+    assert events[-1]["percent"] == 99.0
+    summary = progress.finish()
+    assert events[-1]["final"] and events[-1]["percent"] == 100.0
+    assert summary == {"bytes": 1500, "seconds": 1.0, "average_mb_per_s": 0.0, "peak_mb_per_s": 0.0}
+
+
+def test_format_event():
+    event = {"bytes_done": 1_500_000_000, "total_bytes": 3_000_000_000, "percent": 50.0, "mb_per_s": 150.0,
+             "eta_s": 75.0, "final": False}
+    assert import_progress.format_event(event) == "Imported 1.50 GB of 3.00 GB (50%) at 150.0 MB/s, about 1:15 left"
+    event.update(total_bytes=None, eta_s=None)
+    assert import_progress.format_event(event) == "Imported 1.50 GB at 150.0 MB/s"
+
+
+def test_metered_reader_counts_what_passes_through():
+    progress = ImportProgress(10, interval=3600)
+    with MeteredReader(io.BytesIO(b"0123456789"), progress) as reader:
+        assert reader.read(4) == b"0123"
+        assert reader.readinto(bytearray(100)) == 6
+        assert reader.read() == b""
+    assert progress.bytes_done == 10
+
+
+def test_record_run_appends_json_lines(tmp_path):
+    path = tmp_path / "runs.jsonl"
+    import_progress.record_run({"instance": "a", "bytes": 1}, path)
+    import_progress.record_run({"instance": "b", "target_dir": str(tmp_path)}, path)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["instance"] for record in records] == ["a", "b"]
+    assert "finished_at" in records[0] and "drive_type" in records[1]
+
+
+def test_metered_import_into_a_throttled_wsl(fake_machine, tmp_path, monkeypatch):
+    fake_machine.write_config(import_mb_per_s=16.0)
+    monkeypatch.setattr(compressed_import, "WSL_EXE", fake_machine.wsl)
+    payload = os.urandom(16 * 1024 * 1024)
+    events = []
+    progress = ImportProgress(len(payload), events.append, interval=0.1)
+
+    with MeteredReader(io.BytesIO(payload), progress) as reader:
+        compressed_import.pipe_into_import(reader, "cloudbook", str(tmp_path / "instance"))
+    summary = progress.finish()
+
+    assert len(events) >= 4
+    done = [event["bytes_done"] for event in events]
+    assert done == sorted(done) and done[-1] == len(payload)
+    assert any(event["eta_s"] for event in events[:-1])
+    assert summary["bytes"] == len(payload)
+    # The fake reads at 16 MB/s, and the pipe buffers only a few MB of the payload.
+    assert summary["average_mb_per_s"] < 80
+
+
+def test_import_records_its_run(fake_machine, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(install_wsl3, "WSL_EXE", fake_machine.wsl)
+    monkeypatch.setattr(wsl_config, "WSL_ROOT", str(tmp_path / "wsl_root"))
+    blob = tmp_path / "blob"
+    blob.write_bytes(os.urandom(2 * 1024 * 1024))
+    tar_path = tmp_path / "rootfs.tar"
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(blob, "usr/lib/blob")
+    events = []
+
+    install_wsl3.import_wsl_instance(str(tar_path), "cloudbook", events.append)
+
+    assert events[-1]["final"]
+    assert "cloudbook" in fake_machine.distros()
+    with open(import_progress.IMPORT_RUNS_FILE) as f:
+        record = json.loads(f.readlines()[-1])
+    assert record["instance"] == "cloudbook"
+    assert record["method"] == "in place"
+    assert record["bytes"] == tar_path.stat().st_size
@@ -0,0 +1,85 @@
+import os
+import re
+import sys
+import json
+import subprocess
+
+import pytest
+
+import multi_provision
+from multi_provision import check_port_layout, instance_names
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multi_provision.py")
+
+
+def test_instance_names_and_frontends():
+    assert instance_names("lab", 3) == ["lab-1", "lab-2", "lab-3"]
+    assert multi_provision.frontend_for(9101).ports == ("9101:80",)
+
+
+def test_port_layout_that_fits():
+    check_port_layout([("api", 8080), ("api", 8443)], instance_names("lab", 9))
+    check_port_layout((), instance_names("lab", 100))
+
+
+@pytest.mark.parametrize("backend_ports, count, base_port, message", [
+    # lab-10's backend moves 8000 by 1000 onto the desktop frontend
+    ([("api", 8000)], 10, 9100, "'lab-10' backend (api) and the desktop frontend would both publish port 9000"),
+    # lab-1's api lands on the desktop's admin port
+    ([("api", 8080), ("admin", 8180)], 1, 9100, "'lab-1' backend (api) and the desktop backend (admin)"),
+    # lab-11's backend runs into the frontends counting up from 9100
+    ([("api", 8050)], 60, 9100, "'lab-11' backend (api) and 'lab-51' frontend would both publish port 9150"),
+    ([("api", 64000)], 16, 9100, "'lab-16' backend (api) would publish port 65600, above 65535"),
+    ((), 3, 65534, "'lab-3' frontend would publish port 65536, above 65535"),
+    ((), 1, 9000, "'lab-1' frontend and the desktop frontend would both publish port 9000"),
+])
+def test_port_layout_conflicts(backend_ports, count, base_port, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        check_port_layout(backend_ports, instance_names("lab", count), base_port)
+
+
+def test_provision_many_rejects_overlapping_frontends(monkeypatch):
+    monkeypatch.setattr(multi_provision.install_wsl3, "install_wsl_if_needed",
+                        lambda: pytest.fail("provisioned despite the port conflict"))
+    with pytest.raises(ValueError, match="above 65535"):
+        multi_provision.provision_many(instance_names("lab", 3), base_port=65534)
+
+
+def run_multi_provision(fake_machine, cwd, *args):
+    env = fake_machine.env(fake_machine.build_payload())
+    return subprocess.run([sys.executable, SCRIPT, "--log-dir", "instances", *args], cwd=cwd, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=300)
+
+
+def test_instances_get_their_own_ports(fake_machine, tmp_path):
+    fake_machine.write_config(compose_ports=["8080", "8443"])
+
+    result = run_multi_provision(fake_machine, tmp_path, "--count", "2", "--prefix", "lab")
+
+    assert result.returncode == 0, result.stderr[-2000:]
+    with open(tmp_path / multi_provision.REPORT_FILE) as f:
+        report = json.load(f)
+    assert [(entry["instance"], entry["port"], entry["backend_port_offset"]) for entry in report["instances"]] == [
+        ("lab-1", 9100, 100), ("lab-2", 9101, 200)]
+    assert fake_machine.host_ports() == {"8180": "lab-1", "8543": "lab-1", "8280": "lab-2", "8643": "lab-2"}
+
+
+def test_conflicting_backend_ports_are_never_published(fake_machine, tmp_path):
+    # Shifted by 100, the backend's 8900 lands on the desktop frontend's 9000.
+    fake_machine.write_config(compose_ports=["8900"])
+
+    result = run_multi_provision(fake_machine, tmp_path, "--count", "2")
+
+    assert result.returncode == 1
+    with open(tmp_path / multi_provision.REPORT_FILE) as f:
+        report = json.load(f)
+    assert [entry["steps"]["backend_compose"] for entry in report["instances"]] == ["failed", "failed"]
+    assert fake_machine.host_ports() == {}
+    with open(tmp_path / "instances" / "cloudbook-1" / "logging_.txt") as f:
+        assert "would both publish port 9000" in f.read()
+
+
+def test_cli_rejects_counts_that_overflow(fake_machine, tmp_path):
+    result = run_multi_provision(fake_machine, tmp_path, "--count", "3", "--base-port", "65534")
+    assert result.returncode == 2
+    assert "above 65535" in result.stderr
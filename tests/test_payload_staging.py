@@ -0,0 +1,71 @@
+import os
+import errno
+
+import pytest
+
+import payload_staging
+
+SIZE = 5 * 1024 * 1024 + 123
+
+
+@pytest.fixture
+def payload(tmp_path, monkeypatch):
+    # Force the copying strategies: hardlinks and reflinks would share the source's blocks.
+    monkeypatch.setattr(payload_staging, "_try_hardlink", lambda src_path, dest_path: False)
+    monkeypatch.setattr(payload_staging, "_try_reflink", lambda src, dst: False)
+    path = tmp_path / "payload.tar"
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+def copy_file_range_failing_after(limit):
+    """A copy_file_range that copies `limit` bytes, then fails as it does across filesystems."""
+
+    def copy_file_range(src, dst, count, offset_src, offset_dst):
+        if offset_src >= limit:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        data = os.pread(src, min(count, limit - offset_src, 1024 * 1024), offset_src)
+        return os.pwrite(dst, data, offset_dst)
+
+    return copy_file_range
+
+
+def sendfile_stopping_after(limit):
+    """A sendfile that writes at the destination's position, like the real one, and stops at `limit`."""
+
+    def sendfile(dst, src, offset, count):
+        data = os.pread(src, min(count, max(limit - offset, 0), 1024 * 1024), offset)
+        return os.write(dst, data)
+
+    return sendfile
+
+
+def test_sendfile_resumes_where_copy_file_range_stopped(payload, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "copy_file_range", copy_file_range_failing_after(3 * 1024 * 1024), raising=False)
+    monkeypatch.setattr(os, "sendfile", sendfile_stopping_after(SIZE), raising=False)
+    dest = tmp_path / "staged.tar"
+
+    assert payload_staging.stage_payload(str(payload), str(dest)) == str(dest)
+    assert dest.read_bytes() == payload.read_bytes()
+
+
+def test_chunked_copy_finishes_a_partial_kernel_copy(payload, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "copy_file_range", copy_file_range_failing_after(1024 * 1024), raising=False)
+    monkeypatch.setattr(os, "sendfile", sendfile_stopping_after(2 * 1024 * 1024 + 7), raising=False)
+    dest = tmp_path / "staged.tar"
+
+    with open(payload, "rb") as src, open(dest, "wb") as dst:
+        copied = payload_staging._kernel_copy(src, dst, SIZE)
+        assert copied == 2 * 1024 * 1024 + 7
+        assert src.tell() == dst.tell() == copied
+        payload_staging.chunked_copy(src, dst)
+    assert dest.read_bytes() == payload.read_bytes()
+
+
+def test_kernel_copy_without_kernel_support(payload, tmp_path, monkeypatch):
+    monkeypatch.delattr(os, "copy_file_range", raising=False)
+    monkeypatch.delattr(os, "sendfile", raising=False)
+    dest = tmp_path / "staged.tar"
+
+    assert payload_staging.stage_payload(str(payload), str(dest)) == str(dest)
+    assert dest.read_bytes() == payload.read_bytes()
@@ -0,0 +1,118 @@
+import socket
+import threading
+import http.server
+
+import pytest
+
+import readiness
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    status = 200
+
+    def do_GET(self):
+        self.send_response(self.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FailingHandler(Handler):
+    status = 503
+
+
+def serve(handler, delay=0.0):
+    """Start an HTTP server on a thread, after `delay` seconds; returns (url, stop)."""
+    port = free_port()
+    servers = []
+    started = threading.Event()
+
+    def run():
+        server = http.server.HTTPServer(("127.0.0.1", port), handler)
+        servers.append(server)
+        started.set()
+        server.serve_forever()
+
+    timer = threading.Timer(delay, run)
+    timer.daemon = True
+    timer.start()
+
+    def stop():
+        started.wait(delay + 5)
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    return f"http://127.0.0.1:{port}/", stop
+
+
+@pytest.fixture
+def statuses():
+    return []
+
+
+def test_ready_service(statuses):
+    url, stop = serve(Handler)
+    try:
+        result = readiness.wait_until_ready({"frontend": url}, timeout=5, on_status=lambda *s: statuses.append(s))
+    finally:
+        stop()
+    assert result.all_ready
+    assert statuses[-1] == ("frontend", readiness.READY, "HTTP 200")
+
+
+def test_service_that_starts_late(statuses):
+    url, stop = serve(Handler, delay=0.5)
+    try:
+        result = readiness.wait_until_ready({"frontend": url}, timeout=10, on_status=lambda *s: statuses.append(s))
+    finally:
+        stop()
+    assert result.ready_after["frontend"] >= 0.4
+    assert statuses[0][1] == readiness.WAITING
+    assert statuses[-1][1] == readiness.READY
+
+
+def test_closed_port_times_out(statuses):
+    url = f"http://127.0.0.1:{free_port()}/"
+    result = readiness.wait_until_ready({"backend": url}, timeout=0.5, on_status=lambda *s: statuses.append(s))
+    assert result.ready_after == {"backend": None}
+    assert not result.all_ready
+    assert result.elapsed < 3
+    assert statuses[-1][:2] == ("backend", readiness.TIMED_OUT)
+
+
+def test_server_errors_are_not_ready(statuses):
+    url, stop = serve(FailingHandler)
+    try:
+        result = readiness.wait_until_ready({"backend": url}, timeout=0.5, on_status=lambda *s: statuses.append(s))
+    finally:
+        stop()
+    assert not result.all_ready
+    assert statuses[-1] == ("backend", readiness.TIMED_OUT, "HTTP 503")
+
+
+def test_services_are_waited_for_together():
+    ready_url, stop = serve(Handler)
+    closed_url = f"http://127.0.0.1:{free_port()}/"
+    try:
+        result = readiness.wait_until_ready({"frontend": ready_url, "backend": closed_url}, timeout=0.5)
+    finally:
+        stop()
+    assert result.ready_after["frontend"] is not None
+    assert result.ready_after["backend"] is None
+
+
+def test_backend_services():
+    assert readiness.backend_services([("api", 8180)]) == {"backend": "http://localhost:8180/"}
+    assert readiness.backend_services([("api", 8080), ("admin", 8081)], host="127.0.0.1") == {
+        "backend api": "http://127.0.0.1:8080/",
+        "backend admin": "http://127.0.0.1:8081/",
+    }
+    assert readiness.backend_services([]) == {}
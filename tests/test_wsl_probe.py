@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import wsl_probe
+
+ENGLISH_LIST = (
+    "  NAME                   STATE           VERSION\r\n"
+    "* Ubuntu-22.04           Running         2\r\n"
+    "  cloudbook              Stopped         2\r\n"
+    "  legacy                 Stopped         1\r\n"
+)
+FRENCH_LIST = (
+    "  NOM                    ÉTAT            VERSION\r\n"
+    "* Ubuntu                 En cours d'exécution    2\r\n"
+    "  cloudbook              Arrêté          2\r\n"
+)
+
+
+def utf16(text, bom=False):
+    return (b"\xff\xfe" if bom else b"") + text.encode("utf-16-le")
+
+
+@pytest.mark.parametrize("raw", [utf16(ENGLISH_LIST), utf16(ENGLISH_LIST, bom=True), ENGLISH_LIST.encode()])
+def test_decode_wsl_output(raw):
+    assert wsl_probe.decode_wsl_output(raw) == ENGLISH_LIST
+
+
+def test_parse_version_output():
+    text = "WSL version: 2.3.26.0\r\nKernel version: 5.15.167.4-1\r\nWSLg version: 1.0.65\r\n"
+    assert wsl_probe.parse_version_output(text) == ("2.3.26.0", "5.15.167.4-1")
+    assert wsl_probe.parse_version_output("") == (None, None)
+
+
+def test_parse_list_verbose():
+    distros = wsl_probe.parse_list_verbose(ENGLISH_LIST)
+    assert list(distros) == ["Ubuntu-22.04", "cloudbook", "legacy"]
+    assert distros["Ubuntu-22.04"] == wsl_probe.DistroInfo("Ubuntu-22.04", "Running", 2, True)
+    assert distros["legacy"].version == 1 and not distros["legacy"].is_default
+
+
+def test_parse_list_verbose_localised():
+    distros = wsl_probe.parse_list_verbose(wsl_probe.decode_wsl_output(utf16(FRENCH_LIST)))
+    assert list(distros) == ["Ubuntu", "cloudbook"]
+    assert distros["Ubuntu"] == wsl_probe.DistroInfo("Ubuntu", "En cours d'exécution", 2, True)
+    assert distros["cloudbook"].state == "Arrêté"
+
+
+def test_parse_list_verbose_without_distros():
+    text = ("Windows Subsystem for Linux has no installed distributions.\r\n"
+            "Use 'wsl.exe --list --online' to list available distributions\r\n")
+    assert wsl_probe.parse_list_verbose(text) == {}
+
+
+def test_parse_running_names():
+    assert wsl_probe.parse_running_names("cloudbook\r\nUbuntu\r\n\r\n") == {"cloudbook", "Ubuntu"}
+    assert wsl_probe.parse_running_names("Aucune distribution en cours d'exécution.\r\n") == set()
+
+
+def test_running_names_win_over_the_localised_state():
+    snapshot = wsl_probe.WslSnapshot(installed=True, distros=wsl_probe.parse_list_verbose(FRENCH_LIST),
+                                     running={"Ubuntu"})
+    assert snapshot.is_running("Ubuntu")
+    assert not snapshot.is_running("cloudbook")
+
+
+def test_snapshot_from_the_fake_wsl(fake_machine, monkeypatch):
+    with open(f"{fake_machine.state_dir}/wsl.json", "w") as f:
+        json.dump({"distros": {"cloudbook": {"state": "Running"}, "other": {"state": "Stopped"}}, "failures": {}}, f)
+    monkeypatch.setattr(wsl_probe, "WSL_EXE", fake_machine.wsl)
+
+    snapshot = wsl_probe.take_snapshot()
+
+    assert snapshot.installed
+    assert (snapshot.wsl_version, snapshot.kernel_version) == ("2.3.26.0", "5.15.167.4-1")
+    assert set(snapshot.distros) == {"cloudbook", "other"}
+    assert snapshot.running == {"cloudbook"}
+    assert snapshot.is_running("cloudbook") and not snapshot.is_running("other")
+
+
+def test_snapshot_without_wsl(tmp_path, monkeypatch):
+    monkeypatch.setattr(wsl_probe, "WSL_EXE", str(tmp_path / "missing" / "wsl.exe"))
+    assert not wsl_probe.take_snapshot().installed
+
+
+def test_get_snapshot_caches_until_invalidated(monkeypatch):
+    snapshots = iter([wsl_probe.WslSnapshot(installed=True), wsl_probe.WslSnapshot(installed=False)])
+    monkeypatch.setattr(wsl_probe, "take_snapshot", lambda: next(snapshots))
+    wsl_probe.invalidate()
+    first = wsl_probe.get_snapshot()
+    assert wsl_probe.get_snapshot() is first
+    wsl_probe.invalidate()
+    assert wsl_probe.get_snapshot() is not first
+    wsl_probe.invalidate()
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import subprocess
+
+import pytest
+
+from wsl_session import SessionCrashed, WslSession
+
+BASH = ["bash", "--noprofile", "--norc"]
+
+
+@pytest.fixture
+def session():
+    with WslSession("local", argv=BASH) as session:
+        yield session
+
+
+def test_shell_state_carries_over(session, tmp_path):
+    session.run(f"cd {tmp_path}")
+    session.run("GREETING=hello")
+    assert session.run("pwd").stdout == f"{tmp_path}\n"
+    assert session.run("echo $GREETING").stdout == "hello\n"
+
+
+def test_streams_and_exit_code_are_kept_apart(session):
+    result = session.run("echo out; echo err >&2; (exit 3)")
+    assert (result.stdout, result.stderr, result.exit_code) == ("out\n", "err\n", 3)
+
+
+def test_output_without_a_final_newline(session):
+    assert session.run("printf abc").stdout == "abc"
+    assert session.run("true").stdout == ""
+
+
+def test_commands_are_passed_through_verbatim(session):
+    result = session.run("cat <<'EOF'\n'quoted' \"text\" $HOME\n__CLOUDBOOK_lookalike__ 1\nEOF")
+    assert result.stdout == "'quoted' \"text\" $HOME\n__CLOUDBOOK_lookalike__ 1\n"
+    assert result.exit_code == 0
+
+
+def test_commands_do_not_read_the_session_script(session):
+    assert session.run("cat").exit_code == 0
+    assert session.run("echo still here").stdout == "still here\n"
+
+
+def test_sinks_see_every_line(session):
+    lines = []
+    result = session.run("for i in 1 2 3; do echo $i; done; echo oops >&2", sinks=[lambda *line: lines.append(line)],
+                         tail_lines=1)
+    assert lines == [("stdout", "1\n"), ("stdout", "2\n"), ("stdout", "3\n"), ("stderr", "oops\n")]
+    assert result.stdout == "3\n"
+
+
+def test_exiting_shell_raises_and_restarts(session):
+    first = session.process.pid
+    with pytest.raises(SessionCrashed) as crashed:
+        session.run("echo partial; exit 7")
+    assert crashed.value.exit_code == 7
+    assert session.process.pid != first
+    assert session.run("echo back").stdout == "back\n"
+
+
+def test_timeout_kills_and_restarts(session):
+    first = session.process.pid
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        session.run("sleep 30", timeout=0.5)
+    assert time.monotonic() - started < 10
+    assert session.process.pid != first
+    assert session.run("echo back").stdout == "back\n"
+
+
+def test_a_closed_session_starts_again_on_use():
+    session = WslSession("local", argv=BASH)
+    assert session.run("echo started").stdout == "started\n"
+    process = session.process
+    session.close()
+    assert process.poll() is not None and process.stdin.closed
+    assert session.run("echo again").exit_code == 0
+    session.close()
+
+
+def test_session_through_the_fake_wsl(fake_machine):
+    rootfs = os.path.join(fake_machine.state_dir, "distros", "cloudbook")
+    os.makedirs(os.path.join(rootfs, "usr", "backend"))
+    with open(os.path.join(fake_machine.state_dir, "wsl.json"), "w") as f:
+        json.dump({"distros": {"cloudbook": {"state": "Stopped"}}, "failures": {}}, f)
+
+    argv = [fake_machine.wsl, "-d", "cloudbook", "--"] + BASH
+    with WslSession("cloudbook", argv=argv) as session:
+        session.run("cd /usr/backend")
+        assert session.run("pwd").stdout == os.path.join(rootfs, "usr", "backend") + "\n"
+    assert fake_machine.distros()["cloudbook"]["state"] == "Running"
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import atexit
+import itertools
+import threading
+import functools
+from collections import deque
+
+# Oldest spans are dropped beyond this, so a long-running GUI cannot grow without bound.
+MAX_SPANS = 100000
+
+_finished = deque(maxlen=MAX_SPANS)
+_local = threading.local()
+_ids = itertools.count(1)
+_export_path = None
+
+
+class Span:
+    """A timed region of work with attributes, nested under the span that was active when it began."""
+
+    __slots__ = ("name", "span_id", "parent_id", "thread_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        end = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end - self.start_ns) / 1e9
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_span():
+    """The innermost open span on this thread, or None."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def set_attribute(key, value):
+    """Attach an attribute to the current span, if there is one."""
+    active = current_span()
+    if active is not None:
+        active.set(key, value)
+
+
+class span:
+    """Context manager opening a span; `parent` links work handed to another thread."""
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        parent = self.parent if self.parent is not None else current_span()
+        self.span = Span(self.name, parent, self.attributes)
+        _stack().append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        stack = _stack()
+        if stack and stack[-1] is self.span:
+            stack.pop()
+        _finished.append(self.span)
+        return False
+
+
+def traced(func=None, name=None):
+    """Decorator running the function inside a span named after it."""
+    if func is None:
+        return functools.partial(traced, name=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name or func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def finished_spans():
+    return list(_finished)
+
+
+def chrome_trace_events(spans=None):
+    """Convert spans to Chrome trace-event 'complete' events (microsecond timestamps)."""
+    pid = os.getpid()
+    events = []
+    for item in spans if spans is not None else list(_finished):
+        args = {key: value if isinstance(value, (int, float, str, bool)) or value is None else str(value)
+                for key, value in item.attributes.items()}
+        args["span_id"] = item.span_id
+        if item.parent_id is not None:
+            args["parent_id"] = item.parent_id
+        if item.error is not None:
+            args["error"] = item.error
+        end_ns = item.end_ns if item.end_ns is not None else time.perf_counter_ns()
+        events.append({
+            "name": item.name,
+            "cat": "error" if item.error else "cloudbook",
+            "ph": "X",
+            "ts": item.start_ns / 1000,
+            "dur": (end_ns - item.start_ns) / 1000,
+            "pid": pid,
+            "tid": item.thread_id,
+            "args": args,
+        })
+    return events
+
+
+def export_chrome_trace(path):
+    """Write all finished spans to `path`; open it in chrome://tracing or Perfetto."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"traceEvents": chrome_trace_events(), "displayTimeUnit": "ms"}, f)
+    os.replace(temp_path, path)
+    return path
+
+
+def enable_export_at_exit(path):
+    """Export the trace when the interpreter exits, including via sys.exit."""
+    global _export_path
+    if _export_path is None:
+        atexit.register(lambda: export_chrome_trace(_export_path))
+    _export_path = path
@@ -0,0 +1,39 @@
+import os
+
+# Overridable so the installer can be exercised on Linux against stub executables.
+WSL_EXE = os.environ.get("CLOUDBOOK_WSL_EXE", "wsl")
+
+DOCKER_EXE = os.environ.get("CLOUDBOOK_DOCKER_EXE", "docker")
+
+# Directory that holds one sub-directory per imported instance.
+WSL_ROOT = os.environ.get("CLOUDBOOK_WSL_ROOT", "C:\\WSL")
+
+PAYLOAD_NAME = "infogreen-cloudbook.tar"
+
+# Payload container shipped beside the EXE (or appended to it) by `payload_container.py append`;
+# members are read in place, so launching an installed app never extracts the rootfs.
+CONTAINER_NAME = "cloudbook.payload"
+
+# Hex Ed25519 public key of the release signing key. Payloads whose manifest is unsigned or
+# mis-signed are refused. Packaging (build_payload, payload_container append) fails while this is
+# None or does not match --signing-key, unless --unsigned is passed for a development payload;
+# release (PyInstaller) builds refuse such payloads, running from source only checks hashes.
+PAYLOAD_PUBLIC_KEY = None
+
+# Compressed payloads are preferred over the raw tar when both are bundled.
+COMPRESSED_PAYLOAD_NAMES = [PAYLOAD_NAME + ".zst", PAYLOAD_NAME + ".xz"]
+
+# Checked against the payload's member index (see tar_index.py) before importing, so a payload
+# built from the wrong distro is refused before `wsl --import` spends minutes on it.
+PAYLOAD_REQUIRED_PATHS = ["usr/backend/docker-compose.yml"]
+
+# Built by `rootfs_delta.py build`; applied in place when the instance matches its base.
+DELTA_NAME = "infogreen-cloudbook.delta.tar"
+
+# Built by `image_preload.py save`; loaded into the distro's docker instead of pulling.
+IMAGES_ARCHIVE_NAME = "cloudbook-images.tar"
+
+
+def instance_dir(instance_name):
+    """Return the directory an instance's virtual disk is imported into."""
+    return os.path.join(WSL_ROOT, instance_name)
@@ -1,28 +1,20 @@
-import subprocess
+from script_runner import run_script
 
 def run_wsl_commands(wsl_instance, commands, log_file, sudo_password=None):
     try:
         # Prepare the log file
         with open(log_file, 'w', newline='\n') as log:
-            # Create a single string of commands
-            full_command = " && ".join(commands)
-            
-            # Check if the command contains sudo and a password is provided
-            if sudo_password:
-                # Add sudo password handling at the start of the full command
-                full_command = f"echo {sudo_password} | sudo -S bash -i -c \"{full_command}\""
-            else:
-                # Run commands without sudo password handling
-                full_command = f"bash -i -c \"{full_command}\""
-                
-            # Run the WSL command in a single session
-            result = subprocess.run(f"wsl -d {wsl_instance} {full_command}", shell=True, text=True, capture_output=True)
-            
+            # Run all commands in a single WSL spawn; unlike joining them with "&&",
+            # every command keeps its own output and exit code and later ones still run
+            results = run_script(wsl_instance, commands, sudo_password=sudo_password)
+
             # Log the results
-            log.write(f"Commands: {commands}\n")
-            log.write(f"Output:\n{result.stdout}\n")
-            log.write(f"Error (if any):\n{result.stderr}\n")
-            log.write("\n" + "-" * 80 + "\n")
+            for result in results:
+                log.write(f"Command: {result.command}\n")
+                log.write(f"Exit code: {result.exit_code} ({result.duration:.2f}s)\n")
+                log.write(f"Output:\n{result.stdout}\n")
+                log.write(f"Error (if any):\n{result.stderr}\n")
+                log.write("\n" + "-" * 80 + "\n")
     except Exception as e:
         # Catch and log any exceptions
         with open(log_file, 'a', newline='\n') as log:
@@ -0,0 +1,152 @@
+import time
+import logging
+import threading
+import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from wsl_config import WSL_EXE
+
+# Snapshots older than this are refreshed; mutating operations invalidate them explicitly.
+DEFAULT_TTL = 5.0
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+@dataclass
+class DistroInfo:
+    name: str
+    state: str
+    version: int
+    is_default: bool = False
+
+
+@dataclass
+class WslSnapshot:
+    installed: bool
+    wsl_version: str = None
+    kernel_version: str = None
+    distros: dict = field(default_factory=dict)
+    # Names from `wsl -l --running -q`; None when that query could not be run.
+    running: set = None
+    taken_at: float = field(default_factory=time.monotonic)
+
+    def exists(self, name):
+        return name in self.distros
+
+    def is_running(self, name):
+        if self.running is not None:
+            return name in self.running
+        # The STATE column is localised; this fallback only understands English Windows.
+        distro = self.distros.get(name)
+        return distro is not None and distro.state.lower() == "running"
+
+
+def decode_wsl_output(raw):
+    """Decode wsl.exe output, which is UTF-16LE unless WSL_UTF8=1 is set."""
+    if raw.startswith(b"\xff\xfe"):
+        return raw[2:].decode("utf-16-le", errors="replace")
+    # UTF-16LE ASCII text has a NUL in every odd byte.
+    if len(raw) >= 2 and raw[1:2] == b"\x00":
+        return raw.decode("utf-16-le", errors="replace")
+    return raw.decode("utf-8", errors="replace")
+
+
+def parse_version_output(text):
+    """Return (wsl_version, kernel_version) from `wsl --version` output."""
+    values = []
+    for line in text.splitlines():
+        if ":" in line:
+            values.append(line.split(":", 1)[1].strip())
+    wsl_version = values[0] if values else None
+    kernel_version = values[1] if len(values) > 1 else None
+    return wsl_version, kernel_version
+
+
+def parse_list_verbose(text):
+    """Parse the NAME/STATE/VERSION table printed by `wsl -l -v`.
+
+    The header is localised (e.g. NOM/ÉTAT/VERSION), so it is not looked
+    for: any row ending in a version number is a distro, and the header or
+    a "no distributions" message never does.
+    """
+    distros = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        is_default = line.lstrip().startswith("*")
+        columns = line.replace("*", " ", 1).split()
+        if len(columns) < 3 or not columns[-1].isdigit():
+            continue
+        # Names cannot contain spaces, but the state column may be localised (so it is kept
+        # for display only, see parse_running_names); take the ends of the row.
+        name, state, version = columns[0], " ".join(columns[1:-1]), int(columns[-1])
+        distros[name] = DistroInfo(name, state, version, is_default)
+    return distros
+
+
+def parse_running_names(text):
+    """Names printed by `wsl -l --running -q`: one per line, with no localised text around them."""
+    # With nothing running some builds print a (localised) sentence instead; names have no spaces.
+    return {line.strip() for line in text.splitlines() if line.strip() and len(line.split()) == 1}
+
+
+def _run(args):
+    try:
+        result = subprocess.run([WSL_EXE] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        return None
+    return result
+
+
+# Cache hits cost nothing; the span shows when the installer really pays for wsl.exe probes.
+@tracing.traced(name="wsl probe")
+def take_snapshot():
+    """Query WSL once: `--version`, `-l -v` and `-l --running -q` run concurrently, `--help` only as a last resort."""
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        version_future = pool.submit(_run, ["--version"])
+        list_future = pool.submit(_run, ["-l", "-v"])
+        running_future = pool.submit(_run, ["-l", "--running", "-q"])
+        version_result, list_result = version_future.result(), list_future.result()
+        running_result = running_future.result()
+
+    if version_result is None and list_result is None:
+        logging.warning("WSL is not installed or not available.")
+        return WslSnapshot(installed=False)
+
+    snapshot = WslSnapshot(installed=False)
+    if version_result is not None and version_result.returncode == 0:
+        snapshot.installed = True
+        snapshot.wsl_version, snapshot.kernel_version = parse_version_output(decode_wsl_output(version_result.stdout))
+    if list_result is not None:
+        snapshot.distros = parse_list_verbose(decode_wsl_output(list_result.stdout))
+        if list_result.returncode == 0:
+            snapshot.installed = True
+    if running_result is not None:
+        # A non-zero exit here means nothing is running (or no distro is installed).
+        snapshot.running = parse_running_names(decode_wsl_output(running_result.stdout)) \
+            if running_result.returncode == 0 else set()
+    if not snapshot.installed:
+        # Older inbox WSL lacks --version and fails -l -v when no distro is installed.
+        help_result = _run(["--help"])
+        snapshot.installed = help_result is not None and help_result.returncode == 0
+    logging.debug(f"WSL snapshot: {snapshot}")
+    return snapshot
+
+
+def get_snapshot(max_age=DEFAULT_TTL):
+    """Return a cached snapshot, re-probing when it is older than `max_age` seconds."""
+    global _snapshot
+    with _lock:
+        if _snapshot is None or time.monotonic() - _snapshot.taken_at > max_age:
+            _snapshot = take_snapshot()
+        return _snapshot
+
+
+def invalidate():
+    """Drop the cached snapshot after installing, importing, unregistering or starting a distro."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
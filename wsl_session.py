@@ -0,0 +1,220 @@
+import os
+import sys
+import time
+import uuid
+import queue
+import logging
+import threading
+import subprocess
+from dataclasses import dataclass
+
+from wsl_config import WSL_EXE
+from output_streaming import STDOUT, STDERR, TAIL_LINES, TailBuffer, dispatch, start_draining
+
+# How often a command without a timeout checks that its shell is still alive.
+LIVENESS_POLL = 0.5
+
+
+@dataclass
+class CommandResult:
+    """Outcome of one command run inside the instance."""
+    command: str
+    stdout: str
+    stderr: str
+    exit_code: int
+    duration: float
+
+
+class SessionCrashed(RuntimeError):
+    """The session's shell exited before the command it was running finished."""
+
+    def __init__(self, command, exit_code):
+        super().__init__(f"WSL session shell exited with code {exit_code} while running: {command}")
+        self.command = command
+        self.exit_code = exit_code
+
+
+class WslSession:
+    """One long-lived bash inside a WSL instance, reused for many commands.
+
+    Every command is followed by a unique sentinel on both stdout and stderr
+    carrying its exit code, so output stays separated per command while shell
+    state such as the working directory carries over from one to the next.
+    Pass `argv` to run the session against a different shell, e.g. a local
+    `["bash"]` when testing on Linux.
+    """
+
+    def __init__(self, instance_name, argv=None, sudo_password=None):
+        self.instance_name = instance_name
+        self.argv = argv or [WSL_EXE, "-d", instance_name, "--", "bash", "--noprofile", "--norc"]
+        self.sudo_password = sudo_password
+        self.process = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Spawn the shell and the threads draining its pipes."""
+        self.process = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        self._lines = start_draining(self.process)
+        logging.debug(f"Started WSL session for '{self.instance_name}' (pid {self.process.pid})")
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def restart(self):
+        """Throw away the current shell and start a fresh one."""
+        logging.warning(f"Restarting WSL session for '{self.instance_name}'")
+        self.close(force=True)
+        self.start()
+
+    def close(self, force=False):
+        """Ask the shell to exit, killing it if it does not."""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                if not force:
+                    self.process.stdin.write(b"exit\n")
+                    self.process.stdin.flush()
+                    self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+        # The drain threads close stdout and stderr when they reach end of file.
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process = None
+
+    def _wrap(self, command):
+        if 'sudo' in command and self.sudo_password:
+            command = f"echo {self.sudo_password} | sudo -S {command}"
+        return command
+
+    def _collect(self, marker, deadline, sinks):
+        """Stream lines to `sinks` until both sentinels arrive; return the exit code.
+
+        Returns None as the exit code if the shell exited before the sentinel.
+        Raises subprocess.TimeoutExpired when `deadline` passes with the shell
+        still alive.
+        """
+        pending = {STDOUT, STDERR}
+        held = {STDOUT: None, STDERR: None}
+        exit_code = None
+        idle_after_exit = 0
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(marker, 0)
+            try:
+                stream, line = self._lines.get(timeout=LIVENESS_POLL if remaining is None
+                                               else min(remaining, LIVENESS_POLL))
+            except queue.Empty:
+                # The shell may be gone while something it started still holds the pipes open;
+                # allow one quiet poll for output the drain threads have not queued yet.
+                if not self.is_alive():
+                    idle_after_exit += 1
+                    if idle_after_exit > 1:
+                        return None
+                continue
+            idle_after_exit = 0
+            if line is None:
+                pending.discard(stream)
+                continue
+            index = line.find(marker)
+            if index == -1:
+                # Hold back one line: the sentinel printf adds a newline in front of itself.
+                if held[stream] is not None:
+                    dispatch(sinks, stream, held[stream])
+                held[stream] = line
+                continue
+            before = (held[stream] or "") + line[:index]
+            held[stream] = None
+            if before.endswith("\n"):
+                before = before[:-1]
+            if before:
+                dispatch(sinks, stream, before)
+            if stream == STDOUT:
+                status = line[index + len(marker):].strip()
+                exit_code = int(status) if status else None
+            pending.discard(stream)
+        for stream, line in held.items():
+            if line is not None:
+                dispatch(sinks, stream, line)
+        return exit_code
+
+    def run(self, command, timeout=None, sinks=(), tail_lines=TAIL_LINES):
+        """Run one command in the session and return its CommandResult.
+
+        Output is pushed to `sinks` line by line as it arrives; the result
+        only keeps the last `tail_lines` lines of each stream. A command
+        exceeding `timeout` seconds kills the shell, which is restarted
+        before `subprocess.TimeoutExpired` is raised. If the shell dies
+        mid-command (e.g. the command ran `exit`), it is restarted as well
+        and SessionCrashed is raised.
+        """
+        with self._lock:
+            if not self.is_alive():
+                if self.process is not None:
+                    self.restart()
+                else:
+                    self.start()
+            marker = f"__CLOUDBOOK_{uuid.uuid4().hex}__"
+            delimiter = f"__CMD_{uuid.uuid4().hex}__"
+            script = (
+                f"IFS= read -r -d '' __cb_cmd <<'{delimiter}'\n{self._wrap(command)}\n{delimiter}\n"
+                f"eval \"$__cb_cmd\" < /dev/null\n"
+                f"__cb_rc=$?\n"
+                f"printf '\\n{marker} %d\\n' \"$__cb_rc\"\n"
+                f"printf '\\n{marker}\\n' >&2\n"
+            )
+            tail = TailBuffer(tail_lines)
+            sinks = list(sinks) + [tail]
+            started = time.monotonic()
+            deadline = None if timeout is None else started + timeout
+            try:
+                self.process.stdin.write(script.encode())
+                self.process.stdin.flush()
+                exit_code = self._collect(marker, deadline, sinks)
+            except BrokenPipeError:
+                exit_code = None
+            except subprocess.TimeoutExpired:
+                self.restart()
+                raise subprocess.TimeoutExpired(command, timeout)
+            if exit_code is None:
+                crashed = SessionCrashed(command, self.process.wait())
+                logging.warning(str(crashed))
+                self.restart()
+                raise crashed
+            result = CommandResult(
+                command=command,
+                stdout=tail.text(STDOUT),
+                stderr=tail.text(STDERR),
+                exit_code=exit_code,
+                duration=time.monotonic() - started,
+            )
+            logging.debug(f"Session command finished in {result.duration:.3f}s with code {exit_code}: {command}")
+            return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    argv = ["bash", "--noprofile", "--norc"] if os.name != "nt" else None
+    with WslSession(sys.argv[1] if len(sys.argv) > 1 else "cloudbook", argv=argv) as session:
+        for command in ["cd /tmp", "pwd", "echo out; echo err >&2; exit_code=3; (exit 3)"]:
+            print(session.run(command))